@@ -1,19 +1,45 @@
-from pathlib import Path
-import sys
+"""
+Posey
 
-from . import gui
-# app_name = Path(sys.argv[0]).stem.lower()
-# if app_name == "maya":
-#     from . import gui_maya as gui
-# else:
-#     from . import gui
+Importing the package only loads the core copy and paste API. DCC backends are imported the first time they're
+requested and the GUI only when _build() is called, so batch scripts never load Qt:
 
-DEBUG = True
+    import posey
+    posey.create().paste("pose.json")
+"""
 
-if DEBUG:
-    print("Reloading gui.py")
-    import importlib
-    importlib.reload(gui)
+import os
 
-_build = gui.build
+from . import const
+from . import backends
+from .backends import available, create, get_backend, register
 
+DEBUG = bool(os.environ.get(const.DEBUG_ENV))
+
+
+def _build(backend=""):
+    """
+    Builds the window for the running application.
+
+    Args:
+        backend: str, Name of the backend to use. Detected from the running application if not provided.
+
+    Returns: MainWindow object
+
+    """
+
+    build = backends.get_gui(backend)
+
+    if DEBUG:
+        import sys
+        import importlib
+        from . import gui
+
+        print("Reloading gui.py")
+        importlib.reload(gui)
+        module = sys.modules[build.__module__]
+        if module is not gui:
+            importlib.reload(module)
+        build = getattr(module, build.__name__)
+
+    return build(backend) if backend else build()
@@ -1,14 +1,148 @@
+"""
+Blender backend
+
+Poses are captured from and pasted onto the pose bones of armatures in pose mode, and onto objects otherwise. Pose
+bones are named "<armature>:<bone>" so the armature object plays the part of a Maya namespace and pose files only
+store the bone name, e.g. "Hero:upper_arm.L" is saved as "upper_arm.L" and pastes onto any armature with that bone.
+
+Bone matrices and channels are read and written for a whole armature at once with foreach_get() and foreach_set(),
+and keys are added straight to the F-curves of each armature's action.
+"""
+
 from collections import OrderedDict
 
 import bpy
+import mathutils
 
-from .main import PoseyTemplate
 from . import const
+from . import pose_math
+from .main import PoseyTemplate
+from .resolve import short_name
+
+# Rotation channel and its size per rotation mode. Every other rotation mode is an euler order.
+ROTATION_CHANNELS = {"QUATERNION": ("rotation_quaternion", 4), "AXIS_ANGLE": ("rotation_axis_angle", 4)}
+EULER_CHANNEL = ("rotation_euler", 3)
+
+
+def to_blender(matrix):
+    """
+    Converts a row major matrix into a mathutils.Matrix. Blender stores matrices column major with column vectors,
+    so both use the same 16 floats and only the indexing differs.
+
+    Args:
+        matrix: sequence, 16 floats
+
+    Returns: mathutils.Matrix
+
+    """
+
+    return mathutils.Matrix([[matrix[col * 4 + row] for col in range(4)] for row in range(4)])
+
+
+def from_blender(matrix):
+    """
+    Args:
+        matrix: mathutils.Matrix, 4x4 matrix
+
+    Returns: list, 16 floats in the row major layout used by pose files
+
+    """
+
+    return [matrix[row][col] for col in range(4) for row in range(4)]
+
+
+def foreach_get(collection, attr, size):
+    """
+    Reads a property of every item of a collection in one call.
+
+    Args:
+        collection: bpy_prop_collection, e.g. an armature's pose bones
+        attr: str, Property name
+        size: int, Number of floats per item
+
+    Returns: numpy.ndarray or list, size floats per item
+
+    """
+
+    count = len(collection) * size
+    if pose_math.has_numpy():
+        values = pose_math.numpy.empty(count, dtype=pose_math.numpy.float32)
+    else:
+        values = [0.0] * count
+
+    collection.foreach_get(attr, values)
+    return values
+
+
+def rotation_values(quat, mode, current):
+    """
+    Converts a rotation into the values of a rotation channel, staying close to the current values so keys don't
+    flip between equivalent rotations.
+
+    Args:
+        quat: sequence, Quaternion (x, y, z, w) from pose_math
+        mode: str, Rotation mode, e.g. "QUATERNION" or "XYZ"
+        current: sequence, The channel's current values
+
+    Returns: list
+
+    """
+
+    x, y, z, w = quat
+    quaternion = mathutils.Quaternion((w, x, y, z))
+
+    if mode == "QUATERNION":
+        if quaternion.dot(mathutils.Quaternion(current)) < 0:
+            quaternion.negate()
+        return list(quaternion)
+
+    if mode == "AXIS_ANGLE":
+        axis, angle = quaternion.to_axis_angle()
+        return [angle, *axis]
+
+    return list(quaternion.to_euler(mode, mathutils.Euler(current, mode)))
+
+
+def insert_keys(obj, channels, frame):
+    """
+    Keys channels of an object at a frame. Keys are added to the action's F-curves directly, and each F-curve is
+    updated once afterwards, instead of calling keyframe_insert() per channel.
+
+    Args:
+        obj: bpy.types.Object, The object or armature to key
+        channels: list of (data path, values, group name)
+        frame: float, The frame to key
+
+    Returns: None
+
+    """
+
+    animation_data = obj.animation_data or obj.animation_data_create()
+    action = animation_data.action
+    if action is None:
+        action = bpy.data.actions.new(f"{obj.name}Action")
+        animation_data.action = action
+
+    fcurves = {(fcurve.data_path, fcurve.array_index): fcurve for fcurve in action.fcurves}
+    keyed = []
+
+    for data_path, values, group in channels:
+        for axis, value in enumerate(values):
+            fcurve = fcurves.get((data_path, axis))
+            if fcurve is None:
+                fcurve = action.fcurves.new(data_path, index=axis, action_group=group)
+                fcurves[(data_path, axis)] = fcurve
+
+            fcurve.keyframe_points.insert(frame, float(value), options={"FAST"})
+            keyed.append(fcurve)
+
+    for fcurve in keyed:
+        fcurve.update()
 
 
 class Posey(PoseyTemplate):
     """
-    Sub-class of PoseyTemplate() containing Maya specific code.
+    Sub-class of PoseyTemplate() containing Blender specific code.
     """
 
     def __init__(self):
@@ -17,13 +151,66 @@ class Posey(PoseyTemplate):
 
     def get_selection(self):
         """
-        Gets the current selection
+        Gets the selected pose bones in pose mode, otherwise the selected objects
 
-        Returns: list
+        Returns: list, "<armature>:<bone>" per pose bone or object names
 
         """
 
-        return bpy.context.selected_objects
+        if bpy.context.mode == "POSE":
+            return [f"{pose_bone.id_data.name}:{pose_bone.name}"
+                    for pose_bone in bpy.context.selected_pose_bones or []]
+
+        return [obj.name for obj in bpy.context.selected_objects]
+
+
+    def find(self, name):
+        """
+        Finds the object and pose bone a name from get_selection() refers to.
+
+        Args:
+            name: str, "<armature>:<bone>" or an object name
+
+        Returns: tuple(bpy.types.Object, str), the object and bone name, which is empty for objects. The object is
+                 None if nothing was found.
+
+        """
+
+        # Object and bone names can both contain ":", so try every split
+        idx = name.find(':')
+        while idx != -1:
+            obj = bpy.data.objects.get(name[:idx])
+            if obj is not None and obj.pose is not None and name[idx + 1:] in obj.pose.bones:
+                return obj, name[idx + 1:]
+            idx = name.find(':', idx + 1)
+
+        return bpy.data.objects.get(name), ""
+
+
+    def group(self, objs):
+        """
+        Groups pose bones by armature so each armature can be read and written in bulk.
+
+        Args:
+            objs: list, Names from get_selection()
+
+        Returns: OrderedDict(), armature to [(index in objs, bone name)]. Objects are grouped under None as
+                 [(index in objs, object)].
+
+        """
+
+        groups = OrderedDict()
+        for i, name in enumerate(objs):
+            obj, bone = self.find(name)
+            if obj is None:
+                raise ValueError(f"{name} doesn't exist")
+
+            if bone:
+                groups.setdefault(obj, []).append((i, bone))
+            else:
+                groups.setdefault(None, []).append((i, obj))
+
+        return groups
 
 
     def get_pose_data(self, sel):
@@ -39,14 +226,265 @@ class Posey(PoseyTemplate):
 
         pose_data = OrderedDict()
 
-        # For each selected obj, save worldSpace matrix to dict
-        for obj in sel:
-            obj_info = {"matrix": obj.matrix_world}
-            pose_data[obj.name] = obj_info
+        for obj, matrix in zip(sel, self.get_world_matrices(sel)):
+            obj_info = {"matrix": matrix}
+            pose_data[short_name(obj)] = obj_info
 
         return pose_data
 
 
+    def get_world_matrices(self, objs):
+        """
+        Gets the current world space matrices of objects. Every pose bone of an armature is read with one
+        foreach_get() call.
+
+        Args:
+            objs: list, Names from get_selection()
+
+        Returns: list of 16 float rows
+
+        """
+
+        matrices = [None] * len(objs)
+
+        for armature, items in self.group(objs).items():
+            if armature is None:
+                for i, obj in items:
+                    matrices[i] = from_blender(obj.matrix_world)
+                continue
+
+            pose_bones = armature.pose.bones
+            index = {name: i for i, name in enumerate(pose_bones.keys())}
+            current = foreach_get(pose_bones, "matrix", 16)
+
+            # Pose bone matrices are in armature space
+            bone_matrices = [current[index[bone] * 16:index[bone] * 16 + 16] for _, bone in items]
+            world_matrices = pose_math.batch_multiply(bone_matrices, from_blender(armature.matrix_world))
+            for (i, _), matrix in zip(items, pose_math.to_rows(world_matrices)):
+                matrices[i] = matrix
+
+        return matrices
+
+
+    def set_world_matrices(self, objs, matrices, preview=False):
+        """
+        Sets world space matrices of objects. Unless previewing, the results are keyed at the current frame and
+        pushed as one undo step.
+
+        Args:
+            objs: list, Names from get_selection()
+            matrices: sequence, 16 float world space matrix per object
+            preview: bool, Write without keying or recording undo, for interactive previews
+
+        Returns: None
+
+        """
+
+        with self.phase("write"):
+            channels = OrderedDict()
+            for armature, items in self.group(objs).items():
+                group_matrices = [matrices[i] for i, _ in items]
+                if armature is None:
+                    channels.update(self.set_object_matrices([obj for _, obj in items], group_matrices))
+                else:
+                    channels[armature] = self.set_bone_matrices(armature, [bone for _, bone in items],
+                                                                group_matrices)
+
+            bpy.context.view_layer.update()
+
+        if preview:
+            return
+
+        # Only key the channels that were pasted
+        with self.phase("key"):
+            frame = self.get_frame()
+            for obj, obj_channels in channels.items():
+                insert_keys(obj, obj_channels, frame)
+
+        if bpy.ops.ed.undo_push.poll():
+            bpy.ops.ed.undo_push(message=f"{const.TOOL_NAME} Paste")
+
+
+    def set_bone_matrices(self, armature, bones, matrices):
+        """
+        Sets the world space matrices of pose bones. Bones are solved against their parents' new pose, so the
+        order they're passed in doesn't matter, and each channel is written for the whole armature with one
+        foreach_set() call.
+
+        Args:
+            armature: bpy.types.Object, The armature
+            bones: list, Bone names
+            matrices: sequence, 16 float world space matrix per bone
+
+        Returns: list of (data path, values, group name), the channels written per bone
+
+        """
+
+        pose_bones = armature.pose.bones
+        index = {name: i for i, name in enumerate(pose_bones.keys())}
+        current = pose_math.to_rows(foreach_get(pose_bones, "matrix", 16))
+
+        rest_index = {name: i for i, name in enumerate(armature.data.bones.keys())}
+        rest = pose_math.to_rows(foreach_get(armature.data.bones, "matrix_local", 16))
+
+        # Bring the targets into armature space
+        world_inverse = pose_math.inverse(from_blender(armature.matrix_world))
+        targets = dict(zip(bones, pose_math.to_rows(pose_math.batch_multiply(matrices, world_inverse))))
+        new_poses = {}
+
+        def new_pose(name):
+            # Armature space matrix of a bone once the targets above it have been written
+            if name in targets:
+                return targets[name]
+
+            if name not in new_poses:
+                parent = pose_bones[name].parent
+                if parent is None:
+                    new_poses[name] = current[index[name]]
+                else:
+                    local = pose_math.multiply(current[index[name]], pose_math.inverse(current[index[parent.name]]))
+                    new_poses[name] = pose_math.multiply(local, new_pose(parent.name))
+
+            return new_poses[name]
+
+        # Solve the basis matrix of every bone, which holds its location, rotation and scale channels
+        bases = []
+        for name in bones:
+            pose_bone = pose_bones[name]
+            bone = pose_bone.bone
+            parent = pose_bone.parent
+            rest_inverse = pose_math.inverse(rest[rest_index[name]])
+
+            if bone.inherit_scale == "FULL" and bone.use_inherit_rotation and bone.use_local_location:
+                if parent is None:
+                    basis = pose_math.multiply(targets[name], rest_inverse)
+                else:
+                    parent_space = pose_math.multiply(targets[name], pose_math.inverse(new_pose(parent.name)))
+                    basis = pose_math.multiply(pose_math.multiply(parent_space, rest[rest_index[parent.name]]),
+                                               rest_inverse)
+            else:
+                # Let Blender handle partial inheritance, passing the parent's new pose explicitly
+                parent_matrices = {}
+                if parent is not None:
+                    parent_matrices = {"parent_matrix": to_blender(new_pose(parent.name)),
+                                       "parent_matrix_local": parent.bone.matrix_local}
+                basis = from_blender(bone.convert_local_to_pose(to_blender(targets[name]), bone.matrix_local,
+                                                                invert=True, **parent_matrices))
+
+            bases.append(basis)
+
+        translations, quats, scales = (values if isinstance(values, list) else values.tolist()
+                                       for values in pose_math.decompose(bases))
+
+        slots = [index[name] for name in bones]
+        modes = [pose_bones[name].rotation_mode for name in bones]
+
+        location = foreach_get(pose_bones, "location", 3)
+        scale = foreach_get(pose_bones, "scale", 3)
+        for slot, translation, bone_scale in zip(slots, translations, scales):
+            location[slot * 3:slot * 3 + 3] = translation
+            scale[slot * 3:slot * 3 + 3] = bone_scale
+
+        rotations = {}
+        for slot, quat, mode in zip(slots, quats, modes):
+            attr, size = ROTATION_CHANNELS.get(mode, EULER_CHANNEL)
+            if attr not in rotations:
+                rotations[attr] = foreach_get(pose_bones, attr, size)
+            values = rotations[attr]
+            values[slot * size:slot * size + size] = rotation_values(quat, mode, values[slot * size:slot * size + size])
+
+        pose_bones.foreach_set("location", location)
+        pose_bones.foreach_set("scale", scale)
+        for attr, values in rotations.items():
+            pose_bones.foreach_set(attr, values)
+
+        channels = []
+        for name, slot, mode in zip(bones, slots, modes):
+            attr, size = ROTATION_CHANNELS.get(mode, EULER_CHANNEL)
+            data_path = f'pose.bones["{bpy.utils.escape_identifier(name)}"]'
+            channels.append((f"{data_path}.location", location[slot * 3:slot * 3 + 3], name))
+            channels.append((f"{data_path}.{attr}", rotations[attr][slot * size:slot * size + size], name))
+            channels.append((f"{data_path}.scale", scale[slot * 3:slot * 3 + 3], name))
+
+        return channels
+
+
+    def set_object_matrices(self, objs, matrices):
+        """
+        Sets the world space matrices of objects, solving each against its parent's new matrix.
+
+        Args:
+            objs: list of bpy.types.Object
+            matrices: sequence, 16 float world space matrix per object
+
+        Returns: OrderedDict(), object to [(data path, values, group name)]
+
+        """
+
+        targets = {obj: list(matrix) for obj, matrix in zip(objs, matrices)}
+        new_worlds = {}
+
+        def new_world(obj):
+            # World matrix of an object once the targets above it have been written
+            if obj in targets:
+                return targets[obj]
+
+            if obj not in new_worlds:
+                world = from_blender(obj.matrix_world)
+                if obj.parent is None:
+                    new_worlds[obj] = world
+                else:
+                    local = pose_math.multiply(world, pose_math.inverse(from_blender(obj.parent.matrix_world)))
+                    new_worlds[obj] = pose_math.multiply(local, new_world(obj.parent))
+
+            return new_worlds[obj]
+
+        channels = OrderedDict()
+        for obj, matrix in targets.items():
+            if obj.parent is None:
+                obj.matrix_basis = to_blender(matrix)
+            elif obj.parent_type == "OBJECT":
+                parent_space = pose_math.multiply(matrix, pose_math.inverse(new_world(obj.parent)))
+                obj.matrix_basis = to_blender(pose_math.multiply(
+                    parent_space, pose_math.inverse(from_blender(obj.matrix_parent_inverse))))
+            else:
+                # Bone and vertex parents are left to Blender
+                obj.matrix_world = to_blender(matrix)
+
+            attr, _ = ROTATION_CHANNELS.get(obj.rotation_mode, EULER_CHANNEL)
+            channels[obj] = [("location", obj.location[:], "Object Transforms"),
+                             (attr, getattr(obj, attr)[:], "Object Transforms"),
+                             ("scale", obj.scale[:], "Object Transforms")]
+
+        return channels
+
+
+    def get_frame(self):
+        """
+        Gets the current frame
+
+        Returns: float
+
+        """
+
+        scene = bpy.context.scene
+        return scene.frame_current + scene.frame_subframe
+
+
+    def set_frame(self, frame):
+        """
+        Sets the current frame
+
+        Args:
+            frame: float, The frame to go to
+
+        Returns: None
+
+        """
+
+        bpy.context.scene.frame_set(int(frame), subframe=frame - int(frame))
+
+
     def paste_dcc(self, selection, pose_data, by_name=True, ref_obj='', mirror=''):
         """
         Paste method specific to each DCC. Should always be called by paste().
@@ -55,96 +493,47 @@ class Posey(PoseyTemplate):
             selection: list, Selected objects to paste to
             pose_data: OrderedDict(), The pose to paste
             by_name: bool, Determines whether the pose will be pasted by name or selection order
-            ref_obj: str, Name of the object to paste pose relative to. This is typically the hip control.
+            ref_obj: str, Name of the object to paste pose relative to, "<armature>:<bone>" for pose bones. This
+                     is typically the hip control.
             mirror: str, the axis on which to mirror the pose over
 
         Returns: bool
 
         """
 
-        # Build reflection matrix if mirroring is desired.
-        reflection_matrix = None
-        if mirror:
-            # We can multiply a matrix by this to mirror it across the given axis.
-            reflection_matrix = maya.api.OpenMaya.MMatrix()
-            # MMatrix.setElement(row, col, val)
-            reflection_matrix.setElement(const.MIRROR_MAP[mirror.lower()], const.MIRROR_MAP[mirror.lower()], -1)
+        # Names, reference object and mirror pairs resolved on the first paste onto this selection
+        plan = self.get_paste_plan(selection, pose_data, by_name=by_name, ref_obj=ref_obj, mirror=mirror)
 
         # Gather info about reference object before pasting pose to the rest of the objects.
         if ref_obj:
 
-            if not maya.cmds.objExists(ref_obj):
-                maya.cmds.error("Reference object doesn't exist. Is the name correct?")
+            if self.find(ref_obj)[0] is None:
+                print("Reference object doesn't exist. Is the name correct?")
                 return False
 
-            try:
-                obj_info = pose_data[ref_obj.rpartition(':')[-1]]
-            except KeyError:
-                maya.cmds.error(
-                    "Could not find reference object in pose file. Please select it and save the pose again")
+            if plan.ref_key is None:
+                print("Could not find reference object in pose file. Please select it and save the pose again")
                 return False
 
-            curr_ref_matrix = maya.cmds.xform(ref_obj, matrix=True, worldSpace=True, q=True)
-            saved_ref_matrix = obj_info["matrix"]
-
-            # TODO: Uncomment this if rotating the ref obj is desired.
-            # # Build new matrix taking rotation from the saved pose and translation from the object's current position.
-            # # Maya uses row major 4x4 matrices and index 12-14 represent translation
-            # result_ref_matrix = saved_ref_matrix.copy()
-            # result_ref_matrix[12] = curr_ref_matrix[12]
-            # result_ref_matrix[13] = curr_ref_matrix[13]
-            # result_ref_matrix[14] = curr_ref_matrix[14]
-            #
-            # # Set matrix
-            # maya.cmds.xform(ref_obj, matrix=result_ref_matrix, worldSpace=True)
+            curr_ref_matrix = self.get_world_matrices([ref_obj])[0]
+            saved_ref_matrix = pose_data[plan.ref_key]["matrix"]
 
         else:
-            curr_ref_matrix = []
-            saved_ref_matrix = []
-
-        # Find pose data for selected objects
-        for obj in selection:
+            curr_ref_matrix = None
+            saved_ref_matrix = None
 
-            # Already handled the ref object above
-            if obj == ref_obj:
-                continue
-
-            # Search by name or selection order
-            obj_info = {}
-            if by_name:
-                try:
-                    obj_info = pose_data[obj.rpartition(':')[-1]]
-                except KeyError:
-                    maya.cmds.warning(f"Pose info not found for {obj}. Skipping.")
-                    continue
-
-            else:
-                curr_idx = selection.index(obj)
-                obj_info = pose_data[list(pose_data)[curr_idx]]
-
-                if not obj_info:
-                    maya.cmds.warning(f"Pose info not found for {obj}. Skipping.")
-                    continue
+        if plan.resolution.unmatched:
+            print(plan.resolution.report())
 
-            result_matrix = maya.api.OpenMaya.MMatrix(obj_info["matrix"])
-            if ref_obj:
-                # Calculate offset matrix b/w the current object's worldSpaceMatrix and the reference object's
-                # worldSpaceInverse matrix. Both matrices are from the pose file.
-                offset_matrix = result_matrix * maya.api.OpenMaya.MMatrix(saved_ref_matrix).inverse()
-
-                if reflection_matrix:
-                    offset_matrix = offset_matrix * reflection_matrix
-
-                # Convert the offset matrix back into world space based on the new position of the reference object.
-                # result_matrix = offset_matrix * maya.api.OpenMaya.MMatrix(result_ref_matrix)
-                result_matrix = offset_matrix * maya.api.OpenMaya.MMatrix(curr_ref_matrix)
-
-            else:
+        if not plan:
+            return False
 
-                if reflection_matrix:
-                    result_matrix = result_matrix * reflection_matrix
+        # Offset, mirror and convert every matrix back into world space in one pass
+        result_matrices = self.compute_paste_matrices(plan.source_matrices(pose_data),
+                                                      saved_ref_matrix=saved_ref_matrix,
+                                                      curr_ref_matrix=curr_ref_matrix, mirror=mirror)
 
-            # Set matrix
-            maya.cmds.xform(obj, matrix=result_matrix, worldSpace=True)
+        # Set matrices
+        self.set_world_matrices(plan.targets, result_matrices)
 
         return True
@@ -1,59 +1,249 @@
+import random
+import functools
 from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
 import maya.cmds
 import maya.mel
 import maya.api.OpenMaya
 
 from . import const
 from .main import PoseyTemplate
+from .resolve import short_name
 
+PLUGIN = Path(__file__).with_name("app_maya_plugin.py")
 
-def manage_hik(func):
-    def wrapper(*args, **kwargs):
+# Modifiers waiting to be run by the poseyApplyModifier command. See app_maya_plugin.py
+pending_modifiers = []
+
+# HumanIK effector attributes that pull the rig away from pasted controls
+HIK_ATTRS = ("pull", "reachRotation", "reachTranslation")
+
+
+@contextmanager
+def undo_chunk(name=const.TOOL_NAME):
+    """
+    Groups everything done inside the block into a single undo step.
+
+    Args:
+        name: str, Name shown in the undo history
+    """
+
+    maya.cmds.undoInfo(openChunk=True, chunkName=name)
+    try:
+        yield
+    finally:
+        maya.cmds.undoInfo(closeChunk=True)
+
+
+@contextmanager
+def suspend_refresh():
+    """
+    Stops the viewport from redrawing while the block runs.
+    """
+
+    suspended = maya.cmds.refresh(query=True, suspend=True)
+    maya.cmds.refresh(suspend=True)
+    try:
+        yield
+    finally:
+        maya.cmds.refresh(suspend=suspended)
+
+
+@contextmanager
+def no_undo():
+    """
+    Stops undo from being recorded while the block runs, without flushing the undo queue.
+    """
+
+    state = maya.cmds.undoInfo(query=True, stateWithoutFlush=True)
+    maya.cmds.undoInfo(stateWithoutFlush=False)
+    try:
+        yield
+    finally:
+        maya.cmds.undoInfo(stateWithoutFlush=state)
+
+
+def apply_modifier(modifier):
+    """
+    Runs an MDGModifier through the poseyApplyModifier command so it can be undone.
+
+    Args:
+        modifier: maya.api.OpenMaya.MDGModifier, The modifier to run
+
+    Returns: None
+
+    """
+
+    if not maya.cmds.pluginInfo(str(PLUGIN), query=True, loaded=True):
+        maya.cmds.loadPlugin(str(PLUGIN), quiet=True)
+
+    pending_modifiers.append(modifier)
+    maya.cmds.poseyApplyModifier(__name__)
+
+
+def watch_scene(func):
+    """
+    Registers callbacks for scene changes that can make resolved DAG paths stale: a new, opened or re-referenced
+    scene, and DAG nodes being deleted, renamed or reparented.
+
+    Args:
+        func: callable, Called without arguments on every change
+
+    Returns: list of callback ids, see maya.api.OpenMaya.MMessage.removeCallbacks()
+
+    """
+
+    om = maya.api.OpenMaya
+
+    def on_scene(*args):
+        func()
+
+    def on_renamed(node, *args):
+        # New animation curves are named as they're keyed, which doesn't concern DAG paths
+        if node.hasFn(om.MFn.kDagNode):
+            func()
+
+    messages = (om.MSceneMessage.kAfterNew, om.MSceneMessage.kAfterOpen, om.MSceneMessage.kAfterLoadReference,
+                om.MSceneMessage.kAfterUnloadReference, om.MSceneMessage.kAfterRemoveReference)
+
+    callbacks = [om.MSceneMessage.addCallback(message, on_scene) for message in messages]
+    callbacks.append(om.MDGMessage.addNodeRemovedCallback(on_scene, "dagNode"))
+    callbacks.append(om.MNodeMessage.addNameChangedCallback(om.MObject.kNullObj, on_renamed))
+    callbacks.append(om.MDagMessage.addParentAddedCallback(on_scene))
+    callbacks.append(om.MDagMessage.addParentRemovedCallback(on_scene))
+
+    return callbacks
+
+
+class HikState:
+    """
+    Saves and restores the pull and reach of HumanIK effectors, so the solver doesn't drag pasted controls towards
+    the pose the rig had before. Only the characters owning a pasted control are touched, and every effector of
+    such a character is released since the full body solve pulls towards all of them, selected or not.
+
+    Effectors are cached per control rig, so finding them doesn't cost a command per effector on every paste.
+    """
+
+    def __init__(self):
+        # HIKControlSetNode name -> list of effector MObjectHandles
+        self.effectors = {}
+
+    def character_effectors(self, controls):
+        """
+        Finds the effectors of every HumanIK control rig the controls belong to.
+
+        Args:
+            controls: list, The controls being pasted
+
+        Returns: list of maya.api.OpenMaya.MObject
+
+        """
+
+        om = maya.api.OpenMaya
+
+        control_sets = set(maya.cmds.listConnections(controls, type="HIKControlSetNode") or [])
+
+        effectors = []
+        for control_set in sorted(control_sets):
+            handles = self.effectors.get(control_set)
+
+            # Rebuild if the rig was deleted or rebuilt since it was cached
+            if handles is None or not all(handle.isValid() for handle in handles):
+                sel_list = om.MSelectionList()
+                for effector in set(maya.cmds.listConnections(control_set, type="hikIKEffector") or []):
+                    sel_list.add(effector)
+                handles = [om.MObjectHandle(sel_list.getDependNode(i)) for i in range(sel_list.length())]
+                self.effectors[control_set] = handles
+
+            effectors.extend(handle.object() for handle in handles)
+
+        return effectors
+
+    @staticmethod
+    def snapshot(effectors):
+        """
+        Reads the pull and reach of every effector.
+
+        Args:
+            effectors: list of maya.api.OpenMaya.MObject
+
+        Returns: list of (maya.api.OpenMaya.MPlug, float)
+
+        """
+
+        om = maya.api.OpenMaya
+
+        state = []
+        for effector in effectors:
+            fn_node = om.MFnDependencyNode(effector)
+            for attr in HIK_ATTRS:
+                plug = fn_node.findPlug(attr, False)
+                state.append((plug, plug.asDouble()))
+
+        return state
+
+    @staticmethod
+    def apply(state):
+        """
+        Writes plug values with a single modifier. Not recorded in the undo queue, since every change is reverted
+        before the paste ends.
+
+        Args:
+            state: list of (maya.api.OpenMaya.MPlug, float)
+
+        Returns: None
+
+        """
+
+        modifier = maya.api.OpenMaya.MDGModifier()
+        for plug, value in state:
+            modifier.newPlugValueDouble(plug, value)
+        modifier.doIt()
+
+    @contextmanager
+    def released(self, controls):
+        """
+        Zeroes the pull and reach of the effectors of the controls' characters while the block runs. The previous
+        values are restored even if the block raises.
 
-        # 1. disable IK
-        # 2. Run funct
-        # 3. Restore IK
+        Args:
+            controls: list, The controls being pasted
+        """
 
-        ik_states = {}
-        ik_effectors = maya.cmds.ls(sl=1, type="hikIKEffector")
-        for e in ik_effectors:
-            ik_states[e] = [maya.cmds.getAttr(f"{e}.pull"),
-                            maya.cmds.getAttr(f"{e}.reachRotation"),
-                            maya.cmds.getAttr(f"{e}.reachTranslation")
-                            ]
+        state = self.snapshot(self.character_effectors(controls)) if controls else []
+        if not state:
+            yield
+            return
 
-            maya.cmds.setAttr(f"{e}.pull", 0)
-            maya.cmds.setAttr(f"{e}.reachRotation", 0)
-            maya.cmds.setAttr(f"{e}.reachTranslation", 0)
+        self.apply([(plug, 0.0) for plug, value in state if value])
+        try:
+            yield
+        finally:
+            self.apply([(plug, value) for plug, value in state if value])
 
 
-        # hikRigAlign - enable 1 Dummy_Fight_ControlRig;
-        #pinning_state = maya.mel.eval("hikGlobals -query -releaseAllPinning")
+def manage_hik(func):
+    """
+    Releases the HumanIK effectors of the pasted controls while a Posey method runs.
 
-        # Prep HIK rig for editing
-        #maya.mel.eval("hikGlobals -edit -releaseAllPinning 1")
-        #maya.mel.eval("hikRigAlign - enable 0")
-        #maya.mel.eval("hikManipStart 1 1")
-        #maya.mel.eval("$gHIKneedSyncOnSetKeyframe = 0")
-        #maya.mel.eval("hikGlobals - query - releaseAllPinning")
+    Args:
+        func: callable, Method taking the selection to paste to as its first argument
 
-        # Run function
-        func(*args, **kwargs)
+    Returns: callable
 
-        for e in ik_states:
-            maya.cmds.setAttr(f"{e}.pull", ik_states[e][0])
-            maya.cmds.setAttr(f"{e}.reachRotation", ik_states[e][1])
-            maya.cmds.setAttr(f"{e}.reachTranslation", ik_states[e][2])
+    """
 
-        # Return HIK rig to default state
-        #maya.mel.eval("hikManipStop")
-        #maya.mel.eval("hikRigAlign - enable 1")
-        # maya.mel.eval(f"hikGlobals -edit -releaseAllPinning {pinning_state}")
+    @functools.wraps(func)
+    def wrapper(self, selection, *args, **kwargs):
+        # Already released for the whole paste session
+        if self.in_session:
+            return func(self, selection, *args, **kwargs)
 
-        # Toggle time to "refresh" the rig
-        # current_time = maya.cmds.currentTime(query=True)
-        # maya.cmds.currentTime(current_time-1, edit=True)
-        # maya.cmds.currentTime(current_time, edit=True)
+        # TODO: Pinning and rig alignment may also need to be disabled, e.g.
+        #  hikGlobals -edit -releaseAllPinning 1; hikRigAlign -enable 0; hikManipStart 1 1
+        with self.hik.released(selection):
+            return func(self, selection, *args, **kwargs)
 
     return wrapper
 
@@ -63,9 +253,30 @@ class Posey(PoseyTemplate):
     Sub-class of PoseyTemplate() containing Maya specific code.
     """
 
+    # Capture poses through the OpenMaya API instead of maya.cmds
+    use_api = True
+
+    # Write pasted poses with a single OpenMaya modifier instead of one xform call per object
+    batch_write = True
+
     def __init__(self):
         super(Posey, self).__init__()
 
+        # Effector pull and reach, released while pasting
+        self.hik = HikState()
+
+        # Set inside paste_session(), which holds the undo chunk, suspended viewport and released effectors
+        self.in_session = False
+
+        # Paste plans hold DAG paths, so they're dropped whenever the scene changes under them
+        self.callbacks = watch_scene(self.paste_plans.clear)
+
+
+    def __del__(self):
+        if getattr(self, "callbacks", None):
+            maya.api.OpenMaya.MMessage.removeCallbacks(self.callbacks)
+            self.callbacks = []
+
 
     def get_selection(self):
         """
@@ -89,16 +300,160 @@ class Posey(PoseyTemplate):
 
         """
 
+        if self.use_api:
+            return self.get_pose_data_api(sel)
+
+        return self.get_pose_data_cmds(sel)
+
+
+    def get_pose_data_cmds(self, sel):
+        """
+        Captures the pose with one getAttr call per object. Slower than get_pose_data_api() but kept as a
+        reference to compare against.
+
+        Args:
+            sel: list, The objects to get pose data from.
+
+        Returns: OrderedDict()
+
+        """
+
         pose_data = OrderedDict()
 
         # For each selected obj, save worldSpace matrix to dict
         for obj in sel:
             obj_info = {"matrix": maya.cmds.getAttr(f"{obj}.worldMatrix")}
-            pose_data[obj.rpartition(':')[-1]] = obj_info
+            pose_data[short_name(obj)] = obj_info
 
         return pose_data
 
 
+    def get_pose_data_api(self, sel):
+        """
+        Captures the pose by resolving the whole selection into a single MSelectionList and reading each world
+        matrix from its DAG path, avoiding a command round trip per object.
+
+        Args:
+            sel: list, The objects to get pose data from.
+
+        Returns: OrderedDict()
+
+        """
+
+        pose_data = OrderedDict()
+
+        sel_list = maya.api.OpenMaya.MSelectionList()
+        for obj in sel:
+            sel_list.add(obj)
+
+        # Duplicate names collapse into one entry, which would misalign the indices below
+        if sel_list.length() != len(sel):
+            return self.get_pose_data_cmds(sel)
+
+        for i, obj in enumerate(sel):
+            try:
+                dag_path = sel_list.getDagPath(i)
+            except TypeError:
+                maya.cmds.warning(f"{obj} is not a DAG node. Skipping.")
+                continue
+
+            obj_info = {"matrix": list(dag_path.inclusiveMatrix())}
+            pose_data[short_name(obj)] = obj_info
+
+        return pose_data
+
+
+    def get_pose_data_at(self, sel, frame):
+        """
+        Captures the pose at another frame by evaluating the world matrices in that frame's context, leaving the
+        current time untouched.
+
+        Args:
+            sel: list, The objects to get pose data from.
+            frame: float, The frame to capture
+
+        Returns: OrderedDict()
+
+        """
+
+        om = maya.api.OpenMaya
+        pose_data = OrderedDict()
+
+        sel_list = om.MSelectionList()
+        for obj in sel:
+            sel_list.add(obj)
+
+        if sel_list.length() != len(sel):
+            return OrderedDict((short_name(obj), {"matrix": maya.cmds.getAttr(f"{obj}.worldMatrix", time=frame)})
+                               for obj in sel)
+
+        context = om.MDGContext(om.MTime(frame, om.MTime.uiUnit()))
+        with om.MDGContextGuard(context):
+            for i, obj in enumerate(sel):
+                try:
+                    dag_path = sel_list.getDagPath(i)
+                except TypeError:
+                    maya.cmds.warning(f"{obj} is not a DAG node. Skipping.")
+                    continue
+
+                plug = om.MFnDependencyNode(dag_path.node()).findPlug("worldMatrix", False)
+                plug = plug.elementByLogicalIndex(dag_path.instanceNumber())
+                obj_info = {"matrix": list(om.MFnMatrixData(plug.asMObject()).matrix())}
+                pose_data[short_name(obj)] = obj_info
+
+        return pose_data
+
+
+    @contextmanager
+    def paste_session(self, selection):
+        """
+        Pastes many poses in a row, e.g. a clip, as a single undo step with the viewport suspended and the HumanIK
+        effectors released once, instead of once per paste.
+
+        Args:
+            selection: list, The objects being pasted to
+
+        Returns: context manager
+
+        """
+
+        if self.in_session:
+            yield
+            return
+
+        with undo_chunk(f"{const.TOOL_NAME} Paste Clip"), suspend_refresh(), self.hik.released(selection):
+            self.in_session = True
+            try:
+                yield
+            finally:
+                self.in_session = False
+
+
+    def get_frame(self):
+        """
+        Gets the current frame
+
+        Returns: float
+
+        """
+
+        return maya.cmds.currentTime(query=True)
+
+
+    def set_frame(self, frame):
+        """
+        Sets the current frame
+
+        Args:
+            frame: float, The frame to go to
+
+        Returns: None
+
+        """
+
+        maya.cmds.currentTime(frame, edit=True)
+
+
     @manage_hik
     def paste_dcc(self, selection, pose_data, by_name=True, ref_obj='', mirror=''):
         """
@@ -115,29 +470,27 @@ class Posey(PoseyTemplate):
 
         """
 
-        # Build reflection matrix if mirroring is desired.
-        reflection_matrix = None
-        if mirror:
-            # We can multiply a matrix by this to mirror it across the given axis.
-            reflection_matrix = maya.api.OpenMaya.MMatrix()
-            # MMatrix.setElement(row, col, val)
-            reflection_matrix.setElement(const.MIRROR_MAP[mirror.lower()], const.MIRROR_MAP[mirror.lower()], -1)
+        # Names, DAG paths, reference object and mirror pairs resolved on the first paste onto this selection
+        plan = self.get_paste_plan(selection, pose_data, by_name=by_name, ref_obj=ref_obj, mirror=mirror)
 
         # Gather info about reference object before pasting pose to the rest of the objects.
         if ref_obj:
 
-            if not maya.cmds.objExists(ref_obj):
+            if plan.ref_handle is None and not maya.cmds.objExists(ref_obj):
                 maya.cmds.error("Reference object doesn't exist. Is the name correct?")
                 return False
 
-            try:
-                obj_info = pose_data[ref_obj.rpartition(':')[-1]]
-            except KeyError:
+            if plan.ref_key is None:
                 maya.cmds.error(
                     "Could not find reference object in pose file. Please select it and save the pose again")
                 return False
 
-            curr_ref_matrix = maya.cmds.xform(ref_obj, matrix=True, worldSpace=True, q=True)
+            obj_info = pose_data[plan.ref_key]
+
+            if plan.ref_handle is not None:
+                curr_ref_matrix = list(plan.ref_handle.inclusiveMatrix())
+            else:
+                curr_ref_matrix = maya.cmds.xform(ref_obj, matrix=True, worldSpace=True, q=True)
             saved_ref_matrix = obj_info["matrix"]
 
             # TODO: Uncomment this if rotating the ref obj is desired.
@@ -152,58 +505,335 @@ class Posey(PoseyTemplate):
             # maya.cmds.xform(ref_obj, matrix=result_ref_matrix, worldSpace=True)
 
         else:
-            curr_ref_matrix = []
-            saved_ref_matrix = []
+            curr_ref_matrix = None
+            saved_ref_matrix = None
+
+        if plan.resolution.unmatched:
+            maya.cmds.warning(plan.resolution.report())
+        if not plan:
+            return False
+
+        # Offset, mirror and convert every matrix back into world space in one pass
+        result_matrices = self.compute_paste_matrices(plan.source_matrices(pose_data),
+                                                      saved_ref_matrix=saved_ref_matrix,
+                                                      curr_ref_matrix=curr_ref_matrix, mirror=mirror)
+
+        # Set matrices
+        self.set_world_matrices(plan.targets, result_matrices, dag_paths=plan.handles)
+
+        return True
+
+
+    def resolve_handles(self, objs):
+        """
+        Looks up the DAG paths of objects for a paste plan.
+
+        Args:
+            objs: list, Object names
+
+        Returns: list of maya.api.OpenMaya.MDagPath, or None if any object isn't a unique DAG node
+
+        """
+
+        om = maya.api.OpenMaya
+
+        sel_list = om.MSelectionList()
+        try:
+            for obj in objs:
+                sel_list.add(obj)
+            if sel_list.length() != len(objs):
+                return None
+            return [sel_list.getDagPath(i) for i in range(len(objs))]
+        except (RuntimeError, TypeError):
+            return None
+
+
+    def plan_valid(self, plan):
+        """
+        Checks a cached plan's DAG paths. The scene callbacks catch most changes, this catches nodes deleted while
+        they were suspended, e.g. during file operations.
+
+        Args:
+            plan: plans.PastePlan, The cached plan
+
+        Returns: bool
+
+        """
+
+        handles = list(plan.handles or [])
+        if plan.ref_handle is not None:
+            handles.append(plan.ref_handle)
+
+        return all(dag_path.isValid() for dag_path in handles)
+
+
+    def get_world_matrices(self, objs):
+        """
+        Gets the current world space matrices of objects.
+
+        Args:
+            objs: list, The objects to query
+
+        Returns: list of 16 float rows
+
+        """
+
+        sel_list = maya.api.OpenMaya.MSelectionList()
+        for obj in objs:
+            sel_list.add(obj)
+
+        if sel_list.length() != len(objs):
+            return [maya.cmds.xform(obj, matrix=True, worldSpace=True, query=True) for obj in objs]
+
+        return [list(sel_list.getDagPath(i).inclusiveMatrix()) for i in range(len(objs))]
 
-        # Find pose data for selected objects
-        for obj in selection:
 
-            # Already handled the ref object above
-            if obj == ref_obj:
+    def set_world_matrices(self, objs, matrices, preview=False, dag_paths=None):
+        """
+        Sets world space matrices of objects. Unless previewing, everything is written as one undo step with the
+        viewport suspended and only the given objects are keyed.
+
+        Args:
+            objs: list, Objects to set
+            matrices: sequence, 16 float world space matrix per object
+            preview: bool, Write without keying or recording undo, for interactive previews
+            dag_paths: list, The objects' DAG paths if already known, e.g. from a paste plan
+
+        Returns: None
+
+        """
+
+        if self.batch_write:
+            write = functools.partial(self.set_world_matrices_api, dag_paths=dag_paths)
+        else:
+            write = self.set_world_matrices_cmds
+
+        if preview:
+            with no_undo():
+                write(objs, matrices)
+            return
+
+        def write_and_key():
+            with self.phase("write"):
+                write(objs, matrices)
+
+            # Only key the controls that were pasted
+            with self.phase("key"):
+                maya.cmds.setKeyframe(objs)
+
+        # A paste session already has the undo chunk open and the viewport suspended
+        if self.in_session:
+            write_and_key()
+            return
+
+        with undo_chunk(f"{const.TOOL_NAME} Paste"), suspend_refresh():
+            write_and_key()
+
+
+    @manage_hik
+    def set_blend_matrices(self, objs, matrices, preview=False):
+        """
+        Sets world space matrices written by a PoseBlend, with the HumanIK effectors released like a paste.
+
+        Args:
+            objs: list, Objects to set
+            matrices: sequence, 16 float world space matrix per object
+            preview: bool, See set_world_matrices()
+
+        Returns: None
+
+        """
+
+        self.set_world_matrices(objs, matrices, preview=preview)
+
+
+    def set_world_matrices_cmds(self, objs, matrices):
+        """
+        Sets world space matrices with one xform call per object. Parents are set before their children so
+        moving a parent doesn't drag along a child that was already placed.
+
+        Args:
+            objs: list, Objects to set
+            matrices: sequence, 16 float world space matrix per object
+
+        Returns: None
+
+        """
+
+        depths = [(maya.cmds.ls(obj, long=True) or [""])[0].count('|') for obj in objs]
+        for i in sorted(range(len(objs)), key=depths.__getitem__):
+            maya.cmds.xform(objs[i], matrix=list(matrices[i]), worldSpace=True)
+
+
+    def set_world_matrices_api(self, objs, matrices, dag_paths=None):
+        """
+        Sets world space matrices by converting them into translate, rotate and scale values and writing every
+        plug with one undoable MDGModifier, so the scene is evaluated once. Objects with pivots or shear set
+        fall back to xform since their channels can't be derived from the matrix alone.
+
+        Args:
+            objs: list, Objects to set
+            matrices: sequence, 16 float world space matrix per object
+            dag_paths: list, The objects' DAG paths. Looked up by name if not given.
+
+        Returns: None
+
+        """
+
+        om = maya.api.OpenMaya
+
+        if dag_paths is None:
+            dag_paths = self.resolve_handles(objs)
+
+        if dag_paths is None:
+            self.set_world_matrices_cmds(objs, matrices)
+            return
+        targets = {dag_path.fullPathName(): om.MMatrix(list(matrix)) for dag_path, matrix in zip(dag_paths, matrices)}
+        new_worlds = {}
+
+        def new_world(dag_path):
+            # World matrix of a node once the targets above it have been written
+            name = dag_path.fullPathName()
+            if name in targets:
+                return targets[name]
+
+            if name not in new_worlds:
+                parent = om.MDagPath(dag_path)
+                parent.pop()
+                if parent.length() == 0:
+                    new_worlds[name] = dag_path.inclusiveMatrix()
+                else:
+                    local = dag_path.inclusiveMatrix() * dag_path.exclusiveMatrixInverse()
+                    new_worlds[name] = local * new_world(parent)
+
+            return new_worlds[name]
+
+        modifier = om.MDGModifier()
+        fallback = []
+        for i, matrix in enumerate(matrices):
+            dag_path = dag_paths[i]
+            fn_transform = om.MFnTransform(dag_path)
+
+            has_pivots = (fn_transform.rotatePivot(om.MSpace.kTransform) != om.MPoint.kOrigin
+                          or fn_transform.scalePivot(om.MSpace.kTransform) != om.MPoint.kOrigin
+                          or fn_transform.shear() != [0.0, 0.0, 0.0])
+            if has_pivots:
+                fallback.append(i)
                 continue
 
-            # Search by name or selection order
-            obj_info = {}
-            if by_name:
-                try:
-                    obj_info = pose_data[obj.rpartition(':')[-1]]
-                except KeyError:
-                    maya.cmds.warning(f"Pose info not found for {obj}. Skipping.")
-                    continue
+            # Bring the world matrix into the parent's space. All plugs are written at once, so when a parent is
+            # pasted too its new matrix has to be used rather than the current one.
+            parent = om.MDagPath(dag_path)
+            parent.pop()
+            parent_inverse = new_world(parent).inverse() if parent.length() else om.MMatrix()
+            local_matrix = om.MTransformationMatrix(om.MMatrix(list(matrix)) * parent_inverse)
 
-            else:
-                curr_idx = selection.index(obj)
-                obj_info = pose_data[list(pose_data)[curr_idx]]
+            # Remove rotate axis and joint orient so only the rotate channels are left
+            rotation = fn_transform.rotateOrientation(om.MSpace.kTransform).inverse() \
+                * local_matrix.rotation(asQuaternion=True)
+            if fn_transform.hasAttribute("jointOrient"):
+                joint_orient = om.MEulerRotation(*[fn_transform.findPlug(f"jointOrient{axis}", False).asDouble()
+                                                   for axis in "XYZ"])
+                rotation = rotation * joint_orient.asQuaternion().inverse()
 
-                if not obj_info:
-                    maya.cmds.warning(f"Pose info not found for {obj}. Skipping.")
-                    continue
+            # MTransformationMatrix rotation orders start at 1, MEulerRotation's start at 0
+            euler = rotation.asEulerRotation()
+            euler.reorderIt(fn_transform.rotationOrder() - 1)
+            euler = euler.closestSolution(fn_transform.rotation(om.MSpace.kTransform))
 
-            result_matrix = maya.api.OpenMaya.MMatrix(obj_info["matrix"])
-            if ref_obj:
-                # Calculate offset matrix b/w the current object's worldSpaceMatrix and the reference object's
-                # worldSpaceInverse matrix. Both matrices are from the pose file.
-                offset_matrix = result_matrix * maya.api.OpenMaya.MMatrix(saved_ref_matrix).inverse()
+            values = {"translate": local_matrix.translation(om.MSpace.kTransform),
+                      "rotate": (euler.x, euler.y, euler.z),
+                      "scale": local_matrix.scale(om.MSpace.kTransform)}
 
-                if reflection_matrix:
-                    offset_matrix = offset_matrix * reflection_matrix
+            for attr, value in values.items():
+                for axis, axis_value in zip("XYZ", value):
+                    plug = fn_transform.findPlug(f"{attr}{axis}", False)
+                    if not plug.isLocked:
+                        modifier.newPlugValueDouble(plug, axis_value)
 
-                # Convert the offset matrix back into world space based on the new position of the reference object.
-                # result_matrix = offset_matrix * maya.api.OpenMaya.MMatrix(result_ref_matrix)
-                result_matrix = offset_matrix * maya.api.OpenMaya.MMatrix(curr_ref_matrix)
+        apply_modifier(modifier)
 
-            else:
+        if fallback:
+            self.set_world_matrices_cmds([objs[i] for i in fallback], [matrices[i] for i in fallback])
 
-                if reflection_matrix:
-                    result_matrix = result_matrix * reflection_matrix
 
-            # Set matrix
-            maya.cmds.xform(obj, matrix=result_matrix, worldSpace=True)
+def build_test_rig(count=200, depth=4, seed=0):
+    """
+    Creates nested transforms with random transforms, for checks run in an empty scene.
 
-        print("KEY SET")
-        maya.cmds.setKeyframe()
+    Args:
+        count: int, Number of transforms
+        depth: int, Length of each parent chain
+        seed: int, Random seed
 
-        return True
+    Returns: list, The transforms' names
+
+    """
+
+    rng = random.Random(seed)
+
+    objs = []
+    for i in range(count):
+        parent = objs[-1] if i % depth else None
+        kwargs = {"parent": parent} if parent else {}
+        obj = maya.cmds.createNode("transform", name=f"poseyTest{i}", skipSelect=True, **kwargs)
+        maya.cmds.xform(obj, translation=[rng.uniform(-10.0, 10.0) for _ in range(3)],
+                        rotation=[rng.uniform(-180.0, 180.0) for _ in range(3)],
+                        scale=[rng.uniform(0.5, 2.0) for _ in range(3)])
+        objs.append(maya.cmds.ls(obj, long=True)[0])
+
+    return objs
+
+
+def bench_capture(sel=None, repeat=5, tolerance=1e-9):
+    """
+    Checks that get_pose_data_api() captures the same pose as get_pose_data_cmds() and times both. Runs in a Maya
+    session or in mayapy:
+
+        import maya.standalone
+        maya.standalone.initialize()
+        from posey import app_maya
+        app_maya.bench_capture()
+
+    Args:
+        sel: list, The objects to capture. Defaults to the selection, or a build_test_rig() if nothing is selected.
+        repeat: int, Number of timed captures per path
+        tolerance: float, Largest matrix element difference allowed between the paths
+
+    Returns: dict, "controls", "cmds" and "api" timings as from bench.measure(), and "speedup" of the API path
+
+    Raises:
+        AssertionError: The paths captured different controls or matrices
+
+    """
+
+    from .bench import measure
+
+    posey = Posey()
+    sel = sel or posey.get_selection() or build_test_rig()
+
+    pose_cmds = posey.get_pose_data_cmds(sel)
+    pose_api = posey.get_pose_data_api(sel)
+
+    if list(pose_cmds) != list(pose_api):
+        raise AssertionError(f"Captured controls differ: cmds {list(pose_cmds)[:10]}, api {list(pose_api)[:10]}")
+
+    for name, obj_info in pose_cmds.items():
+        difference = max(abs(a - b) for a, b in zip(obj_info["matrix"], pose_api[name]["matrix"]))
+        if difference > tolerance:
+            raise AssertionError(f"Captured matrices of {name} differ by {difference}")
+
+    results = {
+        "controls": len(sel),
+        "cmds": measure(lambda: posey.get_pose_data_cmds(sel), repeat),
+        "api": measure(lambda: posey.get_pose_data_api(sel), repeat),
+    }
+    results["speedup"] = results["cmds"]["median"] / max(results["api"]["median"], 1e-9)
+
+    print(f"Captured {len(sel)} controls: cmds {results['cmds']['median'] * 1000:.3f}ms, "
+          f"api {results['api']['median'] * 1000:.3f}ms, {results['speedup']:.1f}x faster")
+
+    return results
 
 
 # def get_selection():
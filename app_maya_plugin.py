@@ -0,0 +1,59 @@
+"""
+Maya plug-in providing an undoable command for OpenMaya modifiers built by app_maya.
+
+Modifiers executed directly from Python never reach Maya's undo queue. app_maya queues a modifier on its own
+module and calls poseyApplyModifier with that module's name, so the command can pick it up, run it and undo it
+as a single step. Loaded on demand by app_maya.apply_modifier().
+"""
+
+import sys
+
+import maya.api.OpenMaya
+
+
+def maya_useNewAPI():
+    """
+    Tells Maya this plug-in uses the Python API 2.0
+    """
+
+    pass
+
+
+class PoseyApplyModifier(maya.api.OpenMaya.MPxCommand):
+    """
+    Runs the next pending modifier queued by app_maya.
+    """
+
+    name = "poseyApplyModifier"
+
+    def __init__(self):
+        super(PoseyApplyModifier, self).__init__()
+        self.modifier = None
+
+    @staticmethod
+    def creator():
+        return PoseyApplyModifier()
+
+    def doIt(self, args):
+        module = sys.modules[args.asString(0)]
+        self.modifier = module.pending_modifiers.pop(0)
+        self.modifier.doIt()
+
+    def redoIt(self):
+        self.modifier.doIt()
+
+    def undoIt(self):
+        self.modifier.undoIt()
+
+    def isUndoable(self):
+        return True
+
+
+def initializePlugin(plugin):
+    fn_plugin = maya.api.OpenMaya.MFnPlugin(plugin)
+    fn_plugin.registerCommand(PoseyApplyModifier.name, PoseyApplyModifier.creator)
+
+
+def uninitializePlugin(plugin):
+    fn_plugin = maya.api.OpenMaya.MFnPlugin(plugin)
+    fn_plugin.deregisterCommand(PoseyApplyModifier.name)
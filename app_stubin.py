@@ -1,16 +1,131 @@
+import math
+import random
 from collections import OrderedDict
 
 from .main import PoseyTemplate
+from . import pose_math
+from .resolve import short_name
+
+
+def random_matrix(rng, spread=10.0):
+    """
+    Builds a random rigid transform.
+
+    Args:
+        rng: random.Random, Random number generator
+        spread: float, Translation range
+
+    Returns: list
+
+    """
+
+    quat = [rng.gauss(0, 1) for _ in range(4)]
+    length = math.sqrt(sum(value * value for value in quat))
+    quat = [value / length for value in quat]
+    translation = [rng.uniform(-spread, spread) for _ in range(3)]
+
+    return pose_math.compose_matrix(translation, quat, [1.0, 1.0, 1.0])
+
+
+def build_rig(control_count, depth=4, namespace="", seed=0):
+    """
+    Builds a synthetic rig made of chains of controls under a root, e.g. spine, limb and finger chains.
+
+    Args:
+        control_count: int, Number of controls including the root
+        depth: int, Number of controls per chain
+        namespace: str, Namespace prefixed to every control
+        seed: int, Random seed so rigs are reproducible
+
+    Returns: OrderedDict(), control name to {"parent": name or None, "matrix": local matrix}. Parents always
+             come before their children.
+
+    """
+
+    rng = random.Random(seed)
+    prefix = f"{namespace}:" if namespace else ""
+
+    root = f"{prefix}root_ctrl"
+    rig = OrderedDict()
+    rig[root] = {"parent": None, "matrix": list(pose_math.IDENTITY)}
+
+    parent = root
+    for i in range(1, control_count):
+        # Start a new chain under the root every depth controls
+        if (i - 1) % max(depth, 1) == 0:
+            parent = root
+
+        name = f"{prefix}ctrl_{i:05d}"
+        rig[name] = {"parent": parent, "matrix": random_matrix(rng)}
+        parent = name
+
+    return rig
 
 
 class Posey(PoseyTemplate):
     """
-    Sub-class of PoseyTemplate() containing Maya specific code.
+    Sub-class of PoseyTemplate() backed by an in-memory scene, so poses can be copied and pasted without a DCC.
+    Used for development and by the benchmarks in bench.py.
     """
 
-    def __init__(self):
+    def __init__(self, rig=None):
         super(Posey, self).__init__()
 
+        self.scene = OrderedDict()
+        self.selection = []
+        self.frame = 1.0
+
+        # Keys set by pasting, {control: {frame: local matrix}}
+        self.keys = {}
+
+        if rig:
+            self.load_rig(rig)
+
+
+    def load_rig(self, rig, select=True):
+        """
+        Adds the controls of a rig from build_rig() to the scene.
+
+        Args:
+            rig: OrderedDict(), The rig
+            select: bool, Select the rig's controls
+
+        Returns: None
+
+        """
+
+        for name, node in rig.items():
+            self.scene[name] = {"parent": node["parent"], "matrix": list(node["matrix"])}
+
+        if select:
+            self.selection = list(rig)
+
+
+    def world_matrix(self, obj, cache=None):
+        """
+        Computes the world matrix of a control from its parents.
+
+        Args:
+            obj: str, The control
+            cache: dict, World matrices already computed during this call
+
+        Returns: list
+
+        """
+
+        if cache is not None and obj in cache:
+            return cache[obj]
+
+        node = self.scene[obj]
+        matrix = node["matrix"]
+        if node["parent"]:
+            matrix = pose_math.multiply(matrix, self.world_matrix(node["parent"], cache))
+
+        if cache is not None:
+            cache[obj] = matrix
+
+        return matrix
+
 
     def get_selection(self):
         """
@@ -20,7 +135,7 @@ class Posey(PoseyTemplate):
 
         """
 
-        return []
+        return [obj for obj in self.selection if obj in self.scene]
 
 
     def get_pose_data(self, sel):
@@ -35,9 +150,99 @@ class Posey(PoseyTemplate):
         """
 
         pose_data = OrderedDict()
+
+        cache = {}
+        for obj in sel:
+            obj_info = {"matrix": list(self.world_matrix(obj, cache))}
+            pose_data[short_name(obj)] = obj_info
+
         return pose_data
 
 
+    def get_world_matrices(self, objs):
+        """
+        Gets the current world space matrices of objects.
+
+        Args:
+            objs: list, The objects to query
+
+        Returns: list of 16 float rows
+
+        """
+
+        cache = {}
+        return [list(self.world_matrix(obj, cache)) for obj in objs]
+
+
+    def set_world_matrices(self, objs, matrices, preview=False):
+        """
+        Sets world space matrices of objects, keying them at the current frame unless previewing. Local matrices
+        are solved against the parents' new world matrices, so the order objects are passed in doesn't matter.
+
+        Args:
+            objs: list, Objects to set
+            matrices: sequence, 16 float world space matrix per object
+            preview: bool, Write without keying
+
+        Returns: None
+
+        """
+
+        with self.phase("write"):
+            targets = {obj: list(matrix) for obj, matrix in zip(objs, matrices)}
+            new_worlds = {}
+
+            def new_world(obj):
+                # World matrix after the write, taking targets higher up the hierarchy into account
+                if obj not in new_worlds:
+                    node = self.scene[obj]
+                    if obj in targets:
+                        new_worlds[obj] = targets[obj]
+                    elif node["parent"]:
+                        new_worlds[obj] = pose_math.multiply(node["matrix"], new_world(node["parent"]))
+                    else:
+                        new_worlds[obj] = node["matrix"]
+                return new_worlds[obj]
+
+            locals_ = {}
+            for obj, matrix in targets.items():
+                parent = self.scene[obj]["parent"]
+                locals_[obj] = pose_math.multiply(matrix, pose_math.inverse(new_world(parent))) if parent else matrix
+
+            for obj, local in locals_.items():
+                self.scene[obj]["matrix"] = local
+
+        if not preview:
+            with self.phase("key"):
+                for obj, local in locals_.items():
+                    self.keys.setdefault(obj, {})[self.frame] = local
+
+
+    def get_frame(self):
+        """
+        Gets the current frame
+
+        Returns: float
+
+        """
+
+        return self.frame
+
+
+    def set_frame(self, frame):
+        """
+        Sets the current frame
+
+        Args:
+            frame: float, The frame to go to
+
+        Returns: None
+
+        """
+
+        self.frame = frame
+
+
     def paste_dcc(self, selection, pose_data, by_name=True, ref_obj='', mirror=''):
         """
         Paste method specific to each DCC. Should always be called by paste().
@@ -53,4 +258,31 @@ class Posey(PoseyTemplate):
 
         """
 
-        return False
+        plan = self.get_paste_plan(selection, pose_data, by_name=by_name, ref_obj=ref_obj, mirror=mirror)
+
+        saved_ref_matrix = None
+        curr_ref_matrix = None
+        if ref_obj:
+            if ref_obj not in self.scene:
+                print("Reference object doesn't exist. Is the name correct?")
+                return False
+
+            if plan.ref_key is None:
+                print("Could not find reference object in pose file. Please select it and save the pose again")
+                return False
+
+            saved_ref_matrix = pose_data[plan.ref_key]["matrix"]
+            curr_ref_matrix = self.world_matrix(ref_obj)
+
+        if plan.resolution.unmatched:
+            print(plan.resolution.report())
+        if not plan:
+            return False
+
+        result_matrices = self.compute_paste_matrices(plan.source_matrices(pose_data),
+                                                      saved_ref_matrix=saved_ref_matrix,
+                                                      curr_ref_matrix=curr_ref_matrix, mirror=mirror)
+
+        self.set_world_matrices(plan.targets, result_matrices)
+
+        return True
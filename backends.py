@@ -0,0 +1,198 @@
+"""
+Registry of DCC backends
+
+A backend is a PoseyTemplate subclass for one DCC. Backends are registered by name with the import path of their
+class and only imported when first requested, so importing posey never pulls in a DCC's API.
+
+Third party packages can add backends through the "posey.backends" entry point group:
+
+    [project.entry-points."posey.backends"]
+    houdini = "posey_houdini.app:Posey"
+
+When no backend is asked for, the one named in the POSEY_BACKEND environment variable is used, then the first
+backend whose DCC module is already loaded in this process, then the in-memory stub.
+"""
+
+import os
+import sys
+import importlib
+import threading
+from collections import OrderedDict
+
+from . import const
+
+ENTRY_POINT_GROUP = "posey.backends"
+DEFAULT_BACKEND   = "stubin"
+
+# name -> (import path, modules that show the DCC is running, gui import path)
+registry = OrderedDict()
+loaded = {}
+entry_points_loaded = False
+registry_lock = threading.RLock()
+
+
+def register(name, target, modules=(), gui=""):
+    """
+    Registers a backend. Registering an existing name replaces it.
+
+    Args:
+        name: str, Backend name, e.g. "maya"
+        target: str or class, "module:Class" import path or the PoseyTemplate subclass itself. Relative module
+                paths are resolved against this package.
+        modules: list, Module names which, when already imported, show this DCC is the host application
+        gui: str, "module:function" import path of the function that builds the window for this DCC
+
+    Returns: None
+
+    """
+
+    with registry_lock:
+        registry[name] = (target, tuple(modules), gui)
+        loaded.pop(name, None)
+
+
+def load_entry_points():
+    """
+    Registers backends advertised by installed packages. Only runs once per session.
+
+    Returns: None
+
+    """
+
+    global entry_points_loaded
+
+    with registry_lock:
+        if entry_points_loaded:
+            return
+        entry_points_loaded = True
+
+        # importlib.metadata is fairly slow to import and doesn't exist before Python 3.8
+        try:
+            from importlib import metadata
+        except ImportError:
+            return
+
+        entry_points = metadata.entry_points()
+        if hasattr(entry_points, "select"):
+            entry_points = entry_points.select(group=ENTRY_POINT_GROUP)
+        else:
+            entry_points = entry_points.get(ENTRY_POINT_GROUP, [])
+
+        for entry_point in entry_points:
+            if entry_point.name not in registry:
+                registry[entry_point.name] = (entry_point.value, (), "")
+
+
+def import_target(target):
+    """
+    Imports "module:attribute", resolving relative module paths against this package.
+
+    Args:
+        target: str or object, Import path. Anything else is returned as is.
+
+    Returns: object
+
+    """
+
+    if not isinstance(target, str):
+        return target
+
+    module_name, _, attribute = target.partition(':')
+    module = importlib.import_module(module_name, package=__package__)
+
+    return getattr(module, attribute) if attribute else module
+
+
+def available():
+    """
+    Lists every registered backend, including entry points.
+
+    Returns: list
+
+    """
+
+    load_entry_points()
+    return list(registry)
+
+
+def detect():
+    """
+    Picks the backend for the current process without importing any DCC module.
+
+    Returns: str
+
+    """
+
+    name = os.environ.get(const.BACKEND_ENV, "")
+    if name:
+        return name
+
+    for name, (_, modules, _) in list(registry.items()):
+        if any(module in sys.modules for module in modules):
+            return name
+
+    return DEFAULT_BACKEND
+
+
+def get_backend(name=""):
+    """
+    Gets a backend class, importing it on first use.
+
+    Args:
+        name: str, Backend name. Detected from the running application if not provided.
+
+    Returns: class
+
+    """
+
+    name = name or detect()
+
+    with registry_lock:
+        if name in loaded:
+            return loaded[name]
+
+        if name not in registry:
+            load_entry_points()
+        if name not in registry:
+            raise KeyError(f"Unknown backend '{name}'. Available backends: {', '.join(available())}")
+
+        backend = import_target(registry[name][0])
+        loaded[name] = backend
+
+    return backend
+
+
+def create(name=""):
+    """
+    Creates an instance of a backend.
+
+    Args:
+        name: str, Backend name. Detected from the running application if not provided.
+
+    Returns: PoseyTemplate
+
+    """
+
+    return get_backend(name)()
+
+
+def get_gui(name=""):
+    """
+    Gets the function that builds the window for a backend, falling back to the generic window.
+
+    Args:
+        name: str, Backend name. Detected from the running application if not provided.
+
+    Returns: callable
+
+    """
+
+    name = name or detect()
+    gui = registry.get(name, (None, (), ""))[2]
+
+    return import_target(gui or ".gui:build")
+
+
+register("maya", ".app_maya:Posey", modules=("maya.cmds",), gui=".gui_maya:build")
+register("blender", ".app_blender:Posey", modules=("bpy",))
+register(DEFAULT_BACKEND, ".app_stubin:Posey")
@@ -0,0 +1,233 @@
+"""
+Headless benchmarks for copying and pasting poses
+
+Runs against the in-memory scene in app_stubin, so no DCC is needed:
+
+    python -m posey.bench                      print results as JSON
+    python -m posey.bench --save-baseline      store the results as the baseline
+    python -m posey.bench --baseline           compare against the baseline, exits with 1 on a regression
+
+Timings depend on the machine, so no baseline is shipped. Save one with --save-baseline on the machine the
+comparisons run on, e.g. before starting on a change, then compare with --baseline.
+
+Every benchmark is repeated and the min and median wall times are reported in seconds. Regressions are judged on
+the median, and timings shorter than NOISE_FLOOR are ignored since they mostly measure the machine.
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import statistics
+from pathlib import Path
+
+from . import const
+from . import pose_io
+from . import pose_math
+from . import resolve
+from .app_stubin import Posey, build_rig
+
+NAMESPACE   = "bench"
+NOISE_FLOOR = 5e-5
+
+
+def measure(func, repeat=5):
+    """
+    Times a function.
+
+    Args:
+        func: callable, Called without arguments once per repeat
+        repeat: int, Number of timed calls
+
+    Returns: dict, "min" and "median" in seconds
+
+    """
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return {"min": min(times), "median": statistics.median(times)}
+
+
+def bench_size(size, folder, repeat=5):
+    """
+    Runs every benchmark on a rig of the given size.
+
+    Args:
+        size: int, Number of controls
+        folder: Path, Folder for the pose files written by the benchmarks
+        repeat: int, Number of timed calls per benchmark
+
+    Returns: dict, benchmark name to timings
+
+    """
+
+    posey = Posey(build_rig(size, namespace=NAMESPACE))
+    selection = posey.get_selection()
+    pose_data = posey.get_pose_data(selection)
+
+    json_path = Path(folder, f"bench_{size}.json")
+    binary_path = Path(folder, f"bench_{size}{const.BINARY_EXT}")
+    fixed_path = Path(folder, f"bench_{size}_fixed{const.BINARY_EXT}")
+    pose_io.write_json(json_path, pose_data)
+    pose_io.write_binary(binary_path, pose_data)
+    pose_io.write_binary(fixed_path, pose_data, encoding=const.ENCODING_FIXED)
+
+    # Pasting by order onto a shuffled selection matches every control to a different entry
+    shuffled = list(selection)
+    random.Random(size).shuffle(shuffled)
+    names = list(pose_data)
+    matrices = [pose_data[name]["matrix"] for name in names]
+    ref_obj = selection[0]
+    ref_matrix = pose_data[names[0]]["matrix"]
+
+    results = {
+        "capture": measure(lambda: posey.get_pose_data(selection), repeat),
+        "copy": measure(lambda: posey.copy(json_path).result(), repeat),
+        "serialize_json": measure(lambda: pose_io.write_json(json_path, pose_data), repeat),
+        "serialize_binary": measure(lambda: pose_io.write_binary(binary_path, pose_data), repeat),
+        "serialize_fixed": measure(lambda: pose_io.write_binary(fixed_path, pose_data,
+                                                                encoding=const.ENCODING_FIXED), repeat),
+        "deserialize_json": measure(lambda: pose_io.read_json(json_path), repeat),
+        "deserialize_binary": measure(lambda: pose_io.read_binary(binary_path), repeat),
+        "deserialize_fixed": measure(lambda: pose_io.read_binary(fixed_path), repeat),
+        "resolve_by_name": measure(lambda: resolve.NameIndex(names).resolve(selection), repeat),
+        "resolve_by_order": measure(lambda: resolve.NameIndex(names).resolve(shuffled, by_name=False), repeat),
+        "paste_math_python": measure(lambda: pose_math.batch_paste(matrices, ref_matrix, ref_matrix, mirror="x",
+                                                                   use_numpy=False), repeat),
+        "paste": measure(lambda: posey.paste(filepath=json_path, ref_obj=ref_obj, mirror="x"), repeat),
+    }
+
+    # A file nothing else writes, read once right before timing so every repeat is a cache hit
+    cached_path = Path(folder, f"bench_{size}_cached.json")
+    pose_io.write_json(cached_path, pose_data)
+    posey.deserialize_pose(cached_path)
+    results["deserialize_cached"] = measure(lambda: posey.deserialize_pose(cached_path), repeat)
+
+    if pose_math.has_numpy():
+        results["paste_math_numpy"] = measure(lambda: pose_math.batch_paste(matrices, ref_matrix, ref_matrix,
+                                                                            mirror="x", use_numpy=True), repeat)
+
+    return results
+
+
+def run(sizes=const.BENCH_SIZES, repeat=5):
+    """
+    Runs the benchmarks at every rig size.
+
+    Args:
+        sizes: list, Control counts
+        repeat: int, Number of timed calls per benchmark
+
+    Returns: dict, machine info and {benchmark: {size: timings}}
+
+    """
+
+    # Keep thousands of benchmark copies and pastes out of the timing log
+    log_timings = const.LOG_TIMINGS
+    const.LOG_TIMINGS = False
+
+    benchmarks = {}
+    try:
+        with tempfile.TemporaryDirectory(prefix="posey_bench_") as folder:
+            for size in sizes:
+                for name, timings in bench_size(size, folder, repeat).items():
+                    benchmarks.setdefault(name, {})[str(size)] = timings
+
+            pose_io.background_writer().wait()
+            pose_io.pose_cache().invalidate()
+    finally:
+        const.LOG_TIMINGS = log_timings
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": pose_math.has_numpy(),
+        "repeat": repeat,
+        "benchmarks": benchmarks,
+    }
+
+
+def compare(results, baseline, threshold=const.BENCH_THRESHOLD):
+    """
+    Finds benchmarks whose median got slower than the baseline by more than the threshold.
+
+    Args:
+        results: dict, From run()
+        baseline: dict, From an earlier run()
+        threshold: float, Allowed slowdown, 0.25 is 25% slower
+
+    Returns: list of (benchmark, size, baseline median, median)
+
+    """
+
+    regressions = []
+    for name, sizes in results["benchmarks"].items():
+        for size, timings in sizes.items():
+            old = baseline.get("benchmarks", {}).get(name, {}).get(size)
+            if old is None:
+                continue
+
+            if timings["median"] < NOISE_FLOOR and old["median"] < NOISE_FLOOR:
+                continue
+
+            if timings["median"] > old["median"] * (1.0 + threshold):
+                regressions.append((name, size, old["median"], timings["median"]))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m posey.bench", description="Posey benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(const.BENCH_SIZES),
+                        help="Rig sizes in controls")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed calls per benchmark")
+    parser.add_argument("--output", help="Write the results to this file instead of stdout")
+    parser.add_argument("--baseline", nargs="?", const=str(const.BENCH_BASELINE),
+                        help="Compare against a baseline file")
+    parser.add_argument("--save-baseline", nargs="?", const=str(const.BENCH_BASELINE),
+                        help="Save the results as a baseline file")
+    parser.add_argument("--threshold", type=float, default=const.BENCH_THRESHOLD,
+                        help="Allowed slowdown before a benchmark counts as a regression")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.repeat)
+    output = json.dumps(results, indent=2)
+
+    if args.output:
+        pose_io.atomic_write(args.output, output, mode="w", encoding="utf-8", lock=False)
+    else:
+        print(output)
+
+    if args.save_baseline:
+        Path(args.save_baseline).parent.mkdir(parents=True, exist_ok=True)
+        pose_io.atomic_write(args.save_baseline, output, mode="w", encoding="utf-8", lock=False)
+
+    if args.baseline:
+        try:
+            with open(args.baseline, "r", encoding="utf-8") as baseline_file:
+                baseline = json.load(baseline_file)
+        except OSError:
+            print(f"Could not read baseline {args.baseline}. Create it on this machine with --save-baseline",
+                  file=sys.stderr)
+            return 2
+
+        regressions = compare(results, baseline, args.threshold)
+        for name, size, old, new in regressions:
+            print(f"Regression: {name} at {size} controls, {old * 1000:.3f}ms -> {new * 1000:.3f}ms",
+                  file=sys.stderr)
+
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,273 @@
+"""
+Batch operations on pose files and the pose library, without a DCC
+
+    python -m posey.cli import DIR [DIR ...]                add pose files to the library
+    python -m posey.cli convert PATH [PATH ...] --format binary
+    python -m posey.cli reindex                             rehash pose files, rebuild the search and similarity
+                                                            indexes and optionally prune unused thumbnails
+    python -m posey.cli validate PATH [PATH ...]            check pose files, exits with 1 if any are invalid
+    python -m posey.cli scan [--root DIR]                   sync the library with new, changed and deleted files
+
+Reading, hashing, parsing and converting files runs on a process pool. The library is only written from the main
+process, in one transaction per const.BATCH_SIZE poses, since SQLite only allows one writer at a time anyway.
+"""
+
+import sys
+import time
+import struct
+import argparse
+import functools
+from pathlib import Path
+
+from . import const
+from . import library
+from . import parallel
+from . import pose_io
+from . import scanner
+
+
+def convert_file(job):
+    """
+    Converts a pose file to another format. Runs in a worker process.
+
+    Args:
+        job: tuple(str, str, str, str), source file, destination file, const.FORMAT_JSON or const.FORMAT_BINARY,
+             and matrix encoding
+
+    Returns: dict, "filepath", "output" and "problems"
+
+    """
+
+    src, dst, fmt, encoding = job
+    result = {"filepath": str(src), "output": str(dst), "problems": []}
+
+    try:
+        pose_data = pose_io.read_pose(src)
+        result["problems"] = pose_io.validate_pose(pose_data)
+        if not result["problems"]:
+            Path(dst).parent.mkdir(parents=True, exist_ok=True)
+            pose_io.atomic_write(dst, pose_io.encode_pose(pose_data, fmt, encoding))
+    except (OSError, ValueError, struct.error) as e:
+        result["problems"].append(str(e))
+
+    return result
+
+
+def import_files(paths, db_path="", workers=None, store=False, author="", character="", tags=()):
+    """
+    Adds pose files to the library. Files already in the library have their entry updated.
+
+    Args:
+        paths: list, Pose files and folders
+        db_path: str, The library database. Defaults to const.POSE_DB.
+        workers: int, Number of processes
+        store: bool, Store the poses in the database instead of indexing the files
+        author: str, Author of every pose
+        character: str, Character of every pose
+        tags: list, Tags added to every pose
+
+    Returns: tuple(int, list), number of poses imported and (filepath, problems) per failed file
+
+    """
+
+    files = [str(filepath.resolve()) for filepath, _ in parallel.find_files(paths)]
+    load = functools.partial(parallel.load_file, keep_pose=store)
+
+    imported = 0
+    failed = []
+    with library.PoseLibrary(db_path) as lib:
+        for batch in parallel.batches(parallel.run(load, files, workers)):
+            with lib.transaction():
+                for result in batch:
+                    if result["problems"]:
+                        failed.append((result["filepath"], result["problems"]))
+                        continue
+
+                    name = Path(result["filepath"]).stem
+                    if store:
+                        lib.store_pose(name, result["pose"], author=author, character=character, tags=tags)
+                    else:
+                        pose_id = lib.add_pose(name, result["filepath"], author=author, character=character,
+                                               tags=tags, content_hash=result["hash"])
+                        lib.store_features(pose_id, *result["features"])
+                    imported += 1
+
+    return imported, failed
+
+
+def convert_files(paths, fmt, encoding="", output="", workers=None):
+    """
+    Converts pose files to another format. Folder structure is kept when converting into another folder.
+
+    Args:
+        paths: list, Pose files and folders
+        fmt: str, const.FORMAT_JSON or const.FORMAT_BINARY
+        encoding: str, Matrix encoding of binary files, see quantize.py
+        output: str, Folder to write to. Defaults to next to each source file.
+        workers: int, Number of processes
+
+    Returns: tuple(int, list), number of files converted and (filepath, problems) per failed file
+
+    """
+
+    ext = const.BINARY_EXT if fmt == const.FORMAT_BINARY else ".json"
+
+    jobs = []
+    for filepath, root in parallel.find_files(paths):
+        dst = Path(output, filepath.relative_to(root)) if output else filepath
+        jobs.append((str(filepath), str(dst.with_suffix(ext)), fmt, encoding))
+
+    converted = 0
+    failed = []
+    for result in parallel.run(convert_file, jobs, workers):
+        if result["problems"]:
+            failed.append((result["filepath"], result["problems"]))
+        else:
+            converted += 1
+
+    return converted, failed
+
+
+def reindex(db_path="", workers=None, prune_thumbnails=False):
+    """
+    Rehashes every pose file in the library and rebuilds the search and similarity indexes. Thumbnails are named
+    after the content hash, so poses edited outside of Posey get new thumbnails.
+
+    Args:
+        db_path: str, The library database. Defaults to const.POSE_DB.
+        workers: int, Number of processes
+        prune_thumbnails: bool, Delete thumbnails in const.THUMB_DIR no pose uses anymore
+
+    Returns: tuple(int, list), number of poses reindexed and (filepath, problems) per failed pose
+
+    """
+
+    reindexed = 0
+    failed = []
+    with library.PoseLibrary(db_path) as lib:
+        entries = lib.filepaths()
+        files = [(pose_id, filepath) for pose_id, filepath in entries if not filepath.startswith(const.LIBRARY_PREFIX)]
+        stored = [pose_id for pose_id, filepath in entries if filepath.startswith(const.LIBRARY_PREFIX)]
+
+        results = zip([pose_id for pose_id, _ in files],
+                      parallel.run(parallel.load_file, [filepath for _, filepath in files], workers))
+        for batch in parallel.batches(results):
+            with lib.transaction():
+                for pose_id, result in batch:
+                    if result["problems"]:
+                        failed.append((result["filepath"], result["problems"]))
+                        continue
+
+                    lib.set_content_hash(pose_id, result["hash"])
+                    lib.store_features(pose_id, *result["features"])
+                    reindexed += 1
+
+        # Poses stored in the database are already in this process
+        for batch in parallel.batches(stored):
+            with lib.transaction():
+                for pose_id in batch:
+                    lib.set_features(pose_id, lib.load_pose(pose_id))
+                    reindexed += 1
+
+        lib.rebuild_search()
+
+        if prune_thumbnails and const.THUMB_DIR.exists():
+            hashes = lib.content_hashes()
+            for thumb_path in const.THUMB_DIR.glob("*.png"):
+                if thumb_path.stem.rpartition("_")[0] not in hashes:
+                    thumb_path.unlink()
+
+    return reindexed, failed
+
+
+def validate_files(paths, workers=None):
+    """
+    Checks that pose files can be read and have valid matrices.
+
+    Args:
+        paths: list, Pose files and folders
+        workers: int, Number of processes
+
+    Returns: tuple(int, list), number of valid files and (filepath, problems) per invalid file
+
+    """
+
+    files = [str(filepath) for filepath, _ in parallel.find_files(paths)]
+
+    valid = 0
+    failed = []
+    for result in parallel.run(functools.partial(parallel.load_file, features=False), files, workers):
+        if result["problems"]:
+            failed.append((result["filepath"], result["problems"]))
+        else:
+            valid += 1
+
+    return valid, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m posey.cli", description="Posey batch operations")
+    parser.add_argument("--workers", type=int, help="Worker processes. Defaults to the number of CPUs.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="Add pose files to the library")
+    import_parser.add_argument("paths", nargs="+", help="Pose files and folders")
+    import_parser.add_argument("--db", default="", help="Library database")
+    import_parser.add_argument("--store", action="store_true", help="Store poses in the database")
+    import_parser.add_argument("--author", default="")
+    import_parser.add_argument("--character", default="")
+    import_parser.add_argument("--tags", nargs="*", default=[])
+
+    convert_parser = commands.add_parser("convert", help="Convert pose files to another format")
+    convert_parser.add_argument("paths", nargs="+", help="Pose files and folders")
+    convert_parser.add_argument("--format", choices=(const.FORMAT_JSON, const.FORMAT_BINARY), required=True)
+    convert_parser.add_argument("--encoding", default="", help="Matrix encoding of binary files")
+    convert_parser.add_argument("--output", default="", help="Folder to write to instead of next to each file")
+
+    reindex_parser = commands.add_parser("reindex", help="Rebuild the library's hashes and indexes")
+    reindex_parser.add_argument("--db", default="", help="Library database")
+    reindex_parser.add_argument("--prune-thumbnails", action="store_true", help="Delete unused thumbnails")
+
+    validate_parser = commands.add_parser("validate", help="Check pose files")
+    validate_parser.add_argument("paths", nargs="+", help="Pose files and folders")
+
+    scan_parser = commands.add_parser("scan", help="Sync the library with a pose folder")
+    scan_parser.add_argument("--root", default=str(const.POSE_DIR), help="Pose folder")
+    scan_parser.add_argument("--db", default="", help="Library database")
+
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    if args.command == "import":
+        count, failed = import_files(args.paths, db_path=args.db, workers=args.workers, store=args.store,
+                                     author=args.author, character=args.character, tags=args.tags)
+        verb = "Imported"
+    elif args.command == "convert":
+        count, failed = convert_files(args.paths, args.format, encoding=args.encoding, output=args.output,
+                                      workers=args.workers)
+        verb = "Converted"
+    elif args.command == "reindex":
+        count, failed = reindex(db_path=args.db, workers=args.workers, prune_thumbnails=args.prune_thumbnails)
+        verb = "Reindexed"
+    elif args.command == "scan":
+        with library.PoseLibrary(args.db) as lib:
+            result = scanner.scan(lib, root=args.root, workers=args.workers)
+        print(f"Added {result.added}, updated {result.updated}, removed {result.removed}, "
+              f"{result.unchanged} unchanged")
+        count, failed = result.added + result.updated, result.failed
+        verb = "Scanned"
+    else:
+        count, failed = validate_files(args.paths, workers=args.workers)
+        verb = "Validated"
+
+    for filepath, problems in failed:
+        for problem in problems:
+            print(f"{filepath}: {problem}", file=sys.stderr)
+
+    print(f"{verb} {count} poses in {time.perf_counter() - start:.2f}s, {len(failed)} failed")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
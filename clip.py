@@ -0,0 +1,289 @@
+"""
+Streamed storage for multi-frame pose clips
+
+A clip file shares the binary pose file's name table and adds one matrix block per frame:
+
+    header    struct HEADER_FMT: magic, version, flags, control count, name table size, matrix block offset,
+              frame count
+    params    version 2 only, the matrix encoding's quantize.PARAMS_FMT parameters
+    names     utf-8 control names separated by NUL bytes
+    padding   zero bytes up to an 8 byte boundary
+    matrices  frame count * control count * 16 float64 values, one block of row major matrices per frame
+    times     frame count float64 frame times, written when the clip is closed
+
+Version 2 clips store each frame's block in one of the compact encodings in quantize.py instead, named by the
+header flags. Frames are still fixed size, so any frame can be found and decoded on its own.
+
+Frames are appended to the file in chunks while they're captured so long clips never have to be held in memory,
+and the reader memory-maps the file and hands out one frame at a time.
+"""
+
+import os
+import sys
+import mmap
+import struct
+import tempfile
+from pathlib import Path
+from collections import OrderedDict
+
+from . import const
+from . import pose_io
+from . import quantize
+
+MAGIC      = b"PSYC"
+VERSION    = 2
+HEADER_FMT = "<4sHHIIQQ"
+HEADER_LEN = struct.calcsize(HEADER_FMT)
+MATRIX_LEN = pose_io.MATRIX_LEN
+
+
+class ClipWriter:
+    """
+    Writes a clip frame by frame. Frames are buffered and flushed every chunk_size frames.
+
+    Args:
+        filepath: str, The clip file to write
+        names: list, Control names, in the order matrices are passed to add_frame()
+        chunk_size: int, Number of frames buffered before they're written
+        encoding: str, Matrix encoding, see quantize.py. Defaults to const.POSE_ENCODING.
+        tolerance: float, Largest matrix element error allowed by the encoding
+    """
+
+    def __init__(self, filepath, names, chunk_size=const.CLIP_CHUNK_FRAMES, encoding="",
+                 tolerance=const.QUANT_TOLERANCE):
+        self.filepath = filepath
+        self.names = list(names)
+        self.chunk_size = chunk_size
+        self.tolerance = tolerance
+
+        # Scale is always kept since it may only be animated later in the clip
+        self.encoding = quantize.Encoding.from_name(encoding or const.POSE_ENCODING)
+        self.params = self.encoding.params()
+
+        self.frames = []
+        self.buffer = []
+
+        name_table = b"\0".join(name.encode("utf-8") for name in self.names)
+        self.name_table = name_table
+        self.matrix_offset = HEADER_LEN + len(self.params) + len(name_table)
+        self.padding = -self.matrix_offset % 8
+        self.matrix_offset += self.padding
+
+        # Matrices are written straight after the names. Frame times are only known at the end, so they go into
+        # a trailing block and the frame count in the header is patched on close. Everything goes to a temporary
+        # file that replaces the clip once it's complete.
+        fd, self.tmp_path = tempfile.mkstemp(dir=str(Path(filepath).parent), prefix=f".{Path(filepath).name}.",
+                                             suffix=".tmp")
+        self.file = open(fd, "wb")
+        self.file.write(self.header())
+        self.file.write(self.params + name_table + b"\0" * self.padding)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def header(self):
+        # Plain float64 clips stay readable by version 1 readers
+        version, flags = (VERSION, self.encoding.flags) if self.params else (1, 0)
+        return struct.pack(HEADER_FMT, MAGIC, version, flags, len(self.names), len(self.name_table),
+                           self.matrix_offset, len(self.frames))
+
+    def add_frame(self, frame, matrices):
+        """
+        Adds a frame to the clip.
+
+        Args:
+            frame: float, The frame time
+            matrices: sequence, Flat len(names) * 16 floats
+
+        Returns: None
+
+        """
+
+        if len(matrices) != len(self.names) * MATRIX_LEN:
+            raise ValueError(f"Expected {len(self.names) * MATRIX_LEN} matrix values, got {len(matrices)}")
+
+        if self.params:
+            try:
+                block = self.encoding.encode(matrices)
+            except (OverflowError, struct.error):
+                block = None
+
+            # Frames share one encoding, so a frame it can't represent can't fall back to float64 on its own
+            if block is None or quantize.max_error(matrices, self.encoding.decode(block, len(self.names))) \
+                    > self.tolerance:
+                raise ValueError(f"Frame {frame} can't be encoded within {self.tolerance}. "
+                                 f"Use the {const.ENCODING_FLOAT64} encoding for this clip.")
+        else:
+            block = struct.pack(f"<{len(matrices)}d", *matrices)
+
+        self.frames.append(float(frame))
+        self.buffer.append(block)
+
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes buffered frames to disk.
+
+        Returns: None
+
+        """
+
+        if self.buffer:
+            self.file.write(b"".join(self.buffer))
+            self.buffer = []
+
+    def close(self):
+        """
+        Writes the remaining frames and the frame table, then moves the finished clip into place.
+
+        Returns: None
+
+        """
+
+        if self.file.closed:
+            return
+
+        self.flush()
+        self.file.write(struct.pack(f"<{len(self.frames)}d", *self.frames))
+        self.file.seek(0)
+        self.file.write(self.header())
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+        with pose_io.folder_lock(self.filepath):
+            os.replace(self.tmp_path, str(self.filepath))
+
+    def abort(self):
+        """
+        Discards the clip, leaving any existing file at the destination untouched.
+
+        Returns: None
+
+        """
+
+        if not self.file.closed:
+            self.file.close()
+
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+
+class ClipReader:
+    """
+    Memory-mapped access to a clip file.
+
+    Args:
+        filepath: str, The clip file
+    """
+
+    def __init__(self, filepath):
+        with open(filepath, "rb") as clip_file:
+            try:
+                self.buffer = mmap.mmap(clip_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError("Clip file is truncated")
+
+        view = memoryview(self.buffer)
+        if len(view) < HEADER_LEN:
+            raise ValueError("Clip file is truncated")
+
+        magic, version, flags, count, names_len, matrix_offset, frame_count = struct.unpack_from(HEADER_FMT, view)
+        if magic != MAGIC:
+            raise ValueError("Not a clip file")
+        if version > VERSION:
+            raise ValueError(f"Unsupported clip version {version}")
+
+        self.encoding, params_len = quantize.Encoding(), 0
+        if version >= 2:
+            self.encoding, params_len = quantize.Encoding.from_header(flags, view, HEADER_LEN)
+
+        self.count = count
+        self.frame_len = count * MATRIX_LEN
+        self.frame_size = count * self.encoding.record_size
+        frames_end = matrix_offset + frame_count * self.frame_size
+        if len(view) < frames_end + frame_count * 8:
+            raise ValueError("Clip file is truncated")
+
+        names_start = HEADER_LEN + params_len
+        name_table = bytes(view[names_start:names_start + names_len])
+        self.names = [name.decode("utf-8") for name in name_table.split(b"\0")] if count else []
+        self.frames = list(struct.unpack_from(f"<{frame_count}d", view, frames_end))
+
+        if self.encoding.kind != quantize.FLOAT64:
+            # Kept encoded and decoded a frame at a time
+            self.matrices = view[matrix_offset:frames_end]
+        elif sys.byteorder == "little":
+            self.matrices = view[matrix_offset:frames_end].cast("d")
+        else:
+            self.matrices = struct.unpack_from(f"<{frame_count * self.frame_len}d", view, matrix_offset)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self.frames)
+
+    def close(self):
+        """
+        Releases the memory-mapped file.
+
+        Returns: None
+
+        """
+
+        if isinstance(self.matrices, memoryview):
+            self.matrices.release()
+
+        try:
+            self.buffer.close()
+        except BufferError:
+            # Frames handed out by frame_matrices() are still referenced. The mapping is freed along with them.
+            pass
+
+    def frame_matrices(self, idx):
+        """
+        Gets the matrices of a frame, without copying them unless the clip is encoded.
+
+        Args:
+            idx: int, Frame index, not frame time
+
+        Returns: sequence, Flat control count * 16 floats
+
+        """
+
+        if self.encoding.kind != quantize.FLOAT64:
+            return self.encoding.decode(self.matrices[idx * self.frame_size:(idx + 1) * self.frame_size], self.count)
+
+        return self.matrices[idx * self.frame_len:(idx + 1) * self.frame_len]
+
+    def frame_pose(self, idx):
+        """
+        Gets a frame in the same OrderedDict() structure as deserialize_pose().
+
+        Args:
+            idx: int, Frame index, not frame time
+
+        Returns: OrderedDict()
+
+        """
+
+        matrices = self.frame_matrices(idx)
+        pose_data = OrderedDict()
+        for i, name in enumerate(self.names):
+            pose_data[name] = {"matrix": list(matrices[i * MATRIX_LEN:(i + 1) * MATRIX_LEN])}
+
+        return pose_data
@@ -6,4 +6,75 @@ CLIPBOARD  = Path(os.path.dirname(__file__), "Clipboard.json")
 LOG_FILE   = Path(os.path.dirname(__file__), f"{TOOL_NAME}.log")
 POSE_DIR   = Path(os.path.dirname(__file__), "poses")
 IMG_DIR    = Path(os.path.dirname(__file__), "data", "images")
-MIRROR_MAP = {'x': 0, 'y': 1, 'z': 2}
\ No newline at end of file
+THUMB_DIR  = Path(os.path.dirname(__file__), "data", "thumbnails")
+MIRROR_MAP = {'x': 0, 'y': 1, 'z': 2}
+
+# Local axes negated on mirrored controls to keep them right-handed, see symmetry.MirrorRules
+MIRROR_FLIP = "world"
+
+# Pose file formats. The binary format is picked by extension unless a format is passed explicitly.
+FORMAT_JSON   = "json"
+FORMAT_BINARY = "binary"
+BINARY_EXT    = ".pose"
+CLIP_EXT      = ".clip"
+
+# Matrix encodings for binary pose and clip files, see quantize.py. Encoded files reproduce every matrix element
+# within QUANT_TOLERANCE, or are stored as float64. Steps are the fixed-point resolution in scene units.
+ENCODING_FLOAT64       = "float64"
+ENCODING_FLOAT32       = "float32"
+ENCODING_FIXED         = "fixed"
+POSE_ENCODING          = ENCODING_FLOAT64
+QUANT_TOLERANCE        = 1e-4
+QUANT_TRANSLATION_STEP = 1e-4
+QUANT_SCALE_STEP       = 1e-5
+
+# Number of parsed poses kept in memory for repeated pastes
+POSE_CACHE_SIZE = 32
+
+# Number of frames buffered in memory before a clip being captured is written to disk
+CLIP_CHUNK_FRAMES = 32
+
+# Pose library database, kept with the poses it indexes. Poses stored inside it get a filepath starting with
+# LIBRARY_PREFIX. A new library imports the poses of LEGACY_DB, the database shipped in the package, without
+# changing it.
+POSE_DB        = Path(POSE_DIR, "library.db")
+LEGACY_DB      = Path(os.path.dirname(__file__), "test.db")
+LIBRARY_PREFIX = "library:"
+
+# Sharing the library and pose folders between sessions. DB_JOURNAL_MODE should be "DELETE" for databases opened
+# from several machines over a network mount, where WAL's shared memory index doesn't work.
+DB_JOURNAL_MODE = "WAL"
+DB_BUSY_TIMEOUT = 30.0
+LOCK_NAME       = ".posey.lock"
+LOCK_TIMEOUT    = 30.0
+
+# Poses written to the library per transaction by batch imports, see cli.py
+BATCH_SIZE = 500
+
+# Largest matrix element difference treated as unchanged when storing delta poses
+DELTA_TOLERANCE = 1e-5
+
+
+# Pose similarity search, see similarity.py. Features are measured from the first of SIMILARITY_ROOTS found in a pose.
+SIMILARITY_ROOTS              = ("root", "cog", "hips", "hip", "pelvis")
+SIMILARITY_TRANSLATION_WEIGHT = 1.0
+SIMILARITY_MIN_SHARED         = 0.5
+
+# Thumbnails are pre-scaled to these square sizes and cached on disk and in memory
+THUMB_SIZES       = (64, 128)
+THUMB_CACHE_LIMIT = 512
+
+# Benchmarks in bench.py. A run is a regression when a median is more than BENCH_THRESHOLD slower than the baseline.
+BENCH_BASELINE  = Path(os.path.dirname(__file__), "data", "bench_baseline.json")
+BENCH_SIZES     = (10, 100, 1000, 10000)
+BENCH_THRESHOLD = 0.25
+
+# Environment variables. POSEY_BACKEND picks the backend by name, POSEY_DEBUG reloads the GUI modules on _build(),
+# POSEY_TIMINGS turns on LOG_TIMINGS.
+BACKEND_ENV = "POSEY_BACKEND"
+DEBUG_ENV   = "POSEY_DEBUG"
+TIMINGS_ENV = "POSEY_TIMINGS"
+
+# Append copy and paste phase timings to LOG_FILE as JSON lines, see instrument.py. Opt in, since the log grows with
+# every copy and paste. Hooks registered with instrument.add_hook() are called either way.
+LOG_TIMINGS = bool(os.environ.get(TIMINGS_ENV))
@@ -2,17 +2,140 @@
 Module containing Posey's GUI
 """
 
-import sys
-from pathlib import Path
-from PySide2 import QtGui, QtWidgets, QtCore
+import getpass
+from PySide2 import QtWidgets, QtCore
 from . import const
+from . import backends
+from .thumbnails import ThumbnailCache
 
-# TODO: This is a little redundant since we do the same thing in __init__.py
-app_name = Path(sys.argv[0]).stem.lower()
-if app_name == "maya":
-    from .app_maya import Posey
-else:
-    from .app_stubin import Posey
+
+class PoseLibraryModel(QtCore.QAbstractListModel):
+    """
+    List model over the pose library. Rows are fetched a page at a time as the view scrolls, and filtering runs
+    as a library query so only matching rows are ever loaded.
+    """
+
+    RecordRole = QtCore.Qt.UserRole + 1
+
+    def __init__(self, library, thumbnails, page_size=100, parent=None):
+        super(PoseLibraryModel, self).__init__(parent)
+
+        self.library = library
+        self.thumbnails = thumbnails
+        self.page_size = page_size
+        self.icon_size = const.THUMB_SIZES[-1]
+
+        self.filter_text = ""
+        self.records = []
+        self.rows_by_path = {}
+        self.total = self.library.count()
+
+        self.thumbnails.thumbnail_ready.connect(self.on_thumbnail_ready)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.records)
+
+    def canFetchMore(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return False
+        return len(self.records) < self.total
+
+    def fetchMore(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return
+
+        records = self.library.search(self.filter_text, limit=self.page_size, offset=len(self.records))
+        if not records:
+            self.total = len(self.records)
+            return
+
+        start = len(self.records)
+        self.beginInsertRows(QtCore.QModelIndex(), start, start + len(records) - 1)
+        for row, record in enumerate(records, start):
+            self.rows_by_path[record.filepath] = row
+        self.records.extend(records)
+        self.endInsertRows()
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.records):
+            return None
+
+        record = self.records[index.row()]
+        if role == QtCore.Qt.DisplayRole:
+            return record.name
+        if role == QtCore.Qt.DecorationRole:
+            # Only called for visible items, so thumbnails are requested as they scroll into view
+            return self.thumbnails.get(record.filepath, self.icon_size, pose_hash=record.content_hash)
+        if role == QtCore.Qt.ToolTipRole:
+            return f"{record.name}\nAuthor: {record.author}\nTags: {', '.join(record.tags)}"
+        if role == self.RecordRole:
+            return record
+
+        return None
+
+    def set_filter(self, text):
+        """
+        Filters the model with a library search. Rows are reloaded lazily by the view.
+
+        Args:
+            text: str, The search text
+
+        Returns: None
+
+        """
+
+        self.beginResetModel()
+        self.filter_text = text.strip()
+        self.records = []
+        self.rows_by_path = {}
+        self.total = self.library.count(self.filter_text)
+        self.endResetModel()
+
+    def refresh(self):
+        """
+        Reloads the model, e.g. after poses were added to the library.
+
+        Returns: None
+
+        """
+
+        self.set_filter(self.filter_text)
+
+    def on_thumbnail_ready(self, pose_path, size, pixmap):
+        row = self.rows_by_path.get(pose_path)
+        if row is None or size != self.icon_size:
+            return
+
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [QtCore.Qt.DecorationRole])
+
+
+class ScanJob(QtCore.QRunnable):
+    """
+    Scans the pose folder on a worker thread. SQLite connections can't be used from other threads, so the job opens
+    its own connection to the library.
+    """
+
+    def __init__(self, db_path, root, finished):
+        super(ScanJob, self).__init__()
+        self.db_path = db_path
+        self.root = root
+        self.finished = finished
+
+    def run(self):
+        from . import library
+        from . import scanner
+
+        result = None
+        try:
+            with library.PoseLibrary(self.db_path) as lib:
+                result = scanner.scan(lib, root=self.root)
+        except Exception as e:
+            print(f"Could not scan {self.root}: {e}")
+
+        self.finished(result)
 
 
 class PoseyWinTemplate(QtWidgets.QWidget):
@@ -20,10 +143,18 @@ class PoseyWinTemplate(QtWidgets.QWidget):
     Class containing UI elements and connections.
     """
 
-    def __init__(self):
+    # Emitted from the writer thread when a copy has been written. Delivered on the main thread.
+    copy_finished = QtCore.Signal(bool)
+
+    # Emitted from the scan thread with a scanner.ScanResult, or None if the scan failed
+    scan_finished = QtCore.Signal(object)
+
+    def __init__(self, backend=""):
         super(PoseyWinTemplate, self).__init__(parent=self.get_parent_window())
 
-        self.posey = Posey()
+        self.posey = backends.create(backend)
+        self.library = self.posey.get_library()
+        self.thumbnails = ThumbnailCache(parent=self)
 
         # Window Settings
         self.setWindowFlags(QtCore.Qt.Window)  # Ensures GUI appears as a window
@@ -43,12 +174,24 @@ class PoseyWinTemplate(QtWidgets.QWidget):
         self.tab_widget.addTab(self.tab_temp, "Temp")
 
         self.tab_lib = QtWidgets.QWidget()
-        self.layout_tab_lib = QtWidgets.QGridLayout()
+        self.layout_tab_lib = QtWidgets.QVBoxLayout()
 
         self.tab_lib.setLayout(self.layout_tab_lib)
         self.tab_widget.addTab(self.tab_lib, "Library")
 
         self.layout_main.addWidget(self.tab_widget)
+        self.tab_widget.currentChanged.connect(self.on_tab_changed)
+
+        # Status
+        self.label_status = QtWidgets.QLabel()
+        self.layout_main.addWidget(self.label_status)
+        self.copy_finished.connect(self.on_copy_finished)
+
+        # Pose folder scans, one at a time
+        self.scan_pool = QtCore.QThreadPool()
+        self.scan_pool.setMaxThreadCount(1)
+        self.scanning = False
+        self.scan_finished.connect(self.on_scan_finished)
 
         ### Tab Temp ###
 
@@ -69,11 +212,61 @@ class PoseyWinTemplate(QtWidgets.QWidget):
         self.copy_paste_layout.addWidget(self.btn_copy)
         self.copy_paste_layout.addWidget(self.btn_paste)
 
+        # Blend. Dragging previews a partial paste of the clipboard, releasing keys it.
+        self.label_blend = QtWidgets.QLabel("Blend")
+
+        self.slider_blend = QtWidgets.QSlider(QtCore.Qt.Horizontal)
+        self.slider_blend.setRange(0, 100)
+        self.slider_blend.sliderPressed.connect(self.on_blend_start)
+        self.slider_blend.valueChanged.connect(self.on_blend_changed)
+        self.slider_blend.sliderReleased.connect(self.on_blend_end)
+
+        # Coalesce slider updates to at most one write per display frame
+        self.timer_blend = QtCore.QTimer(self)
+        self.timer_blend.setSingleShot(True)
+        self.timer_blend.setInterval(16)
+        self.timer_blend.timeout.connect(self.on_blend_preview)
+        self.blend = None
+
+        self.blend_layout = QtWidgets.QHBoxLayout()
+        self.blend_layout.addWidget(self.label_blend)
+        self.blend_layout.addWidget(self.slider_blend)
+
         self.layout_tab_temp.addWidget(self.line_ref_obj)
         self.layout_tab_temp.addLayout(self.copy_paste_layout)
+        self.layout_tab_temp.addLayout(self.blend_layout)
 
         ### Tab Library ###
 
+        # Search
+        self.line_search = QtWidgets.QLineEdit()
+        self.line_search.setPlaceholderText("Search poses and tags")
+        self.line_search.textChanged.connect(self.on_search_changed)
+
+        # Wait for typing to pause before querying the library
+        self.timer_search = QtCore.QTimer(self)
+        self.timer_search.setSingleShot(True)
+        self.timer_search.setInterval(150)
+        self.timer_search.timeout.connect(self.on_search)
+
+        # Pose grid. Only visible items are laid out and drawn.
+        self.model_lib = PoseLibraryModel(self.library, self.thumbnails, parent=self)
+
+        self.list_lib = QtWidgets.QListView()
+        self.list_lib.setViewMode(QtWidgets.QListView.IconMode)
+        self.list_lib.setResizeMode(QtWidgets.QListView.Adjust)
+        self.list_lib.setMovement(QtWidgets.QListView.Static)
+        self.list_lib.setUniformItemSizes(True)
+        self.list_lib.setLayoutMode(QtWidgets.QListView.Batched)
+        self.list_lib.setBatchSize(200)
+        self.list_lib.setIconSize(QtCore.QSize(const.THUMB_SIZES[-1], const.THUMB_SIZES[-1]))
+        self.list_lib.setGridSize(QtCore.QSize(const.THUMB_SIZES[-1] + 16, const.THUMB_SIZES[-1] + 32))
+        self.list_lib.setModel(self.model_lib)
+        self.list_lib.doubleClicked.connect(self.on_paste_lib)
+
+        self.layout_tab_lib.addWidget(self.line_search)
+        self.layout_tab_lib.addWidget(self.list_lib)
+
         # Actions
         self.action_copy  = QtWidgets.QAction("Copy")
         self.action_copy.triggered.connect(self.on_copy)
@@ -102,27 +295,77 @@ class PoseyWinTemplate(QtWidgets.QWidget):
 
 
     def on_copy(self):
-        # Create icon in grid view
-        i = 0
-        while i <= 15:
-            label = QtWidgets.QLabel()
-            label.setMinimumSize(32, 32)
-            label.setMaximumSize(128, 128)
-            pixmap = QtGui.QPixmap(str(Path(const.IMG_DIR, "placeholder.jpg").resolve()))
-            #label.resize(150, 150)
-            label.setPixmap(pixmap.scaled(label.size(), QtCore.Qt.KeepAspectRatio))
-
-            # Check how many rows there are
-            # Check how many items are in current row
-            # If number of items < max items, add to row
-            # Else, create new row
-            children = self.layout_tab_lib.children()
-            if children:
-                last_item_pos = self.layout_tab_lib.getItemPosition(len(children) - 1)
-                print(last_item_pos)
-
-            self.layout_tab_lib.addWidget(label)
-            i += 1
+        """
+        Copy pose from selected objects into the pose library
+
+        Returns: bool
+
+        """
+
+        name, ok = QtWidgets.QInputDialog.getText(self, const.TOOL_NAME, "Pose name:")
+        name = name.strip()
+        if not ok or not name:
+            return False
+
+        pose_id = self.posey.copy_to_library(name, author=getpass.getuser())
+        if pose_id is None:
+            return False
+
+        self.model_lib.refresh()
+
+        return True
+
+
+    def on_tab_changed(self, index):
+        """
+        Picks up pose files added, changed or deleted on disk when the Library tab is shown. The scan runs in the
+        background, so a slow pose folder doesn't block the DCC.
+
+        Returns: bool
+
+        """
+
+        if self.tab_widget.widget(index) is not self.tab_lib or self.scanning:
+            return False
+
+        self.scanning = True
+        self.scan_pool.start(ScanJob(self.library.db_path, str(const.POSE_DIR), self.scan_finished.emit))
+
+        return True
+
+
+    def on_scan_finished(self, result):
+        self.scanning = False
+        if result is None or not (result.added or result.updated or result.removed):
+            return
+
+        self.model_lib.refresh()
+        self.label_status.setText(f"Library: {result.added} added, {result.updated} updated, "
+                                  f"{result.removed} removed")
+
+
+    def on_search_changed(self, text):
+        self.timer_search.start()
+
+
+    def on_search(self):
+        self.model_lib.set_filter(self.line_search.text())
+
+
+    def on_paste_lib(self, index):
+        """
+        Paste the double-clicked library pose to selected objects
+
+        Returns: bool
+
+        """
+
+        record = index.data(PoseLibraryModel.RecordRole)
+        if not record:
+            return False
+
+        result = self.posey.paste(filepath=record.filepath, by_name=True, ref_obj=self.line_ref_obj.text(), mirror="")
+        return result
 
 
     def on_copy_temp(self):
@@ -133,7 +376,62 @@ class PoseyWinTemplate(QtWidgets.QWidget):
 
         """
 
-        result = self.posey.copy(filepath="")
+        self.label_status.setText("Copying...")
+        result = self.posey.copy(filepath="", callback=self.emit_copy_finished)
+        if not result:
+            self.label_status.setText("Nothing copied")
+            return False
+
+        return True
+
+
+    def emit_copy_finished(self, future):
+        self.copy_finished.emit(future.exception() is None and bool(future.result()))
+
+
+    def on_copy_finished(self, result):
+        self.label_status.setText("Pose copied" if result else "Could not write pose")
+
+
+    def on_blend_start(self):
+        """
+        Start blending the clipboard pose onto selected objects
+
+        Returns: bool
+
+        """
+
+        self.blend = self.posey.begin_blend(filepath="", by_name=True, ref_obj=self.line_ref_obj.text(), mirror="")
+        if self.blend:
+            self.blend.apply(self.slider_blend.value() / 100.0)
+
+        return self.blend is not None
+
+
+    def on_blend_changed(self, value):
+        if self.blend and not self.timer_blend.isActive():
+            self.timer_blend.start()
+
+
+    def on_blend_preview(self):
+        if self.blend:
+            self.blend.apply(self.slider_blend.value() / 100.0)
+
+
+    def on_blend_end(self):
+        """
+        Key the blended pose
+
+        Returns: bool
+
+        """
+
+        self.timer_blend.stop()
+        if not self.blend:
+            return False
+
+        result = self.blend.commit(self.slider_blend.value() / 100.0)
+        self.blend = None
         return result
 
 
@@ -149,14 +447,17 @@ class PoseyWinTemplate(QtWidgets.QWidget):
         return result
 
 
-def build():
+def build(backend=""):
     """
 
+    Args:
+        backend: str, Name of the backend to use. Detected from the running application if not provided.
+
     Returns: MainWindow object
 
     """
 
-    win = PoseyWinTemplate()
+    win = PoseyWinTemplate(backend)
     win.show()
 
     return win
@@ -25,9 +25,12 @@ class PoseyWin(PoseyWinTemplate):
             return None
 
 
-def build():
+def build(backend="maya"):
     """
 
+    Args:
+        backend: str, Name of the backend to use
+
     Returns: MainWindow object
 
     """
@@ -37,7 +40,7 @@ def build():
     #     win.setObjectName("")
     #     del win
 
-    win = PoseyWin()
+    win = PoseyWin(backend)
     #win.setObjectName(const.TOOL_NAME)
     win.show()
 
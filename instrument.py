@@ -0,0 +1,170 @@
+"""
+Phase timings for copy and paste
+
+Every copy and paste records how long each phase took along with control counts. Finished records are passed to
+every function registered with add_hook(), e.g. to forward them to a studio's metrics service, and appended to
+const.LOG_FILE as one JSON object per line when const.LOG_TIMINGS is on (set POSEY_TIMINGS):
+
+    {"operation": "paste", "time": 1718000000.0, "total": 0.0123,
+     "phases": {"selection": 0.0001, "io": 0.0004, "deserialize": 0.002, "resolve": 0.0006, "math": 0.003,
+                "write": 0.005, "key": 0.0011},
+     "counts": {"selected": 120, "controls": 120, "matched": 118, "unmatched": 2}, "filepath": "..."}
+
+Phases run more than once during an operation, like paste_clip() pasting every frame, are added up.
+"""
+
+import json
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+
+from . import const
+
+PHASES = ("selection", "capture", "serialize", "io", "deserialize", "resolve", "math", "write", "key")
+
+hooks = []
+log_lock = threading.Lock()
+
+
+def add_hook(func):
+    """
+    Registers a function called with every finished timing record.
+
+    Args:
+        func: callable, Takes the record dict. Called on whichever thread finished the operation.
+
+    Returns: None
+
+    """
+
+    if func not in hooks:
+        hooks.append(func)
+
+
+def remove_hook(func):
+    """
+    Args:
+        func: callable, A function passed to add_hook()
+
+    Returns: None
+
+    """
+
+    if func in hooks:
+        hooks.remove(func)
+
+
+def emit(record):
+    """
+    Writes a timing record to the log file and passes it to the hooks. Failures are reported but never interrupt
+    the copy or paste being timed.
+
+    Args:
+        record: dict, From Timings.record()
+
+    Returns: None
+
+    """
+
+    if const.LOG_TIMINGS:
+        try:
+            with log_lock, open(const.LOG_FILE, "a", encoding="utf-8") as log_file:
+                log_file.write(json.dumps(record) + "\n")
+        except OSError as e:
+            print(f"Could not write timings to {const.LOG_FILE}: {e}")
+
+    for hook in list(hooks):
+        try:
+            hook(record)
+        except Exception as e:
+            print(f"Timing hook {hook} failed: {e}")
+
+
+def phase(timings, name):
+    """
+    Times a phase if timings are being recorded.
+
+    Args:
+        timings: Timings, The operation being timed, or None
+        name: str, One of PHASES
+
+    Returns: context manager
+
+    """
+
+    return timings.phase(name) if timings is not None else nullcontext()
+
+
+class Timings:
+    """
+    Phase timings and control counts of a single copy or paste.
+
+    Args:
+        operation: str, e.g. "copy" or "paste"
+        info: Extra values stored in the record, e.g. the filepath
+    """
+
+    def __init__(self, operation, **info):
+        self.operation = operation
+        self.info = info
+        self.phases = {}
+        self.counts = {}
+        self.finished = False
+
+        self.time = time.time()
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name, value):
+        """
+        Records a count, e.g. the number of controls. Counts recorded more than once are added up.
+
+        Args:
+            name: str, What was counted
+            value: int, The count
+
+        Returns: None
+
+        """
+
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def record(self):
+        """
+        Returns: dict, JSON serializable timing record
+
+        """
+
+        record = {"operation": self.operation,
+                  "time": self.time,
+                  "total": time.perf_counter() - self.start,
+                  "phases": dict(self.phases),
+                  "counts": dict(self.counts)}
+        record.update(self.info)
+
+        return record
+
+    def finish(self, **info):
+        """
+        Ends the operation and emits its record. Only the first call has any effect.
+
+        Args:
+            info: Extra values stored in the record, e.g. the result
+
+        Returns: None
+
+        """
+
+        if self.finished:
+            return
+
+        self.finished = True
+        self.info.update(info)
+        emit(self.record())
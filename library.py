@@ -0,0 +1,930 @@
+"""
+SQLite backed pose library
+
+Stores pose metadata (name, file, author, character, tags and timestamps) and answers paged, tag filtered and
+full-text searches. Poses can either stay in their pose files with the database only indexing them, or be stored
+in the database itself.
+
+Poses stored in the database are split into per-control matrix blocks, addressed by a hash of their contents, so a
+matrix shared by any number of poses is stored once. A pose can also be stored as a delta against a base pose,
+typically the rig's default pose, keeping only the controls that differ from it.
+
+The database is shared by every open DCC session. It runs in WAL mode so readers never wait for a writer, and
+writers take the write lock up front and wait up to const.DB_BUSY_TIMEOUT for each other. WAL relies on shared
+memory between the processes using the database, so databases on network mounts accessed from several machines
+should set const.DB_JOURNAL_MODE to "DELETE".
+"""
+
+import os
+import time
+import uuid
+import struct
+import sqlite3
+import hashlib
+from pathlib import Path
+from contextlib import contextmanager
+from collections import namedtuple, OrderedDict
+
+from . import const
+from . import pose_io
+from . import similarity
+
+SCHEMA_VERSION = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS characters(
+    id           INTEGER PRIMARY KEY,
+    name         TEXT NOT NULL UNIQUE,
+    base_pose_id INTEGER REFERENCES poses(id) ON DELETE SET NULL
+);
+
+CREATE TABLE IF NOT EXISTS poses(
+    id           INTEGER PRIMARY KEY,
+    name         TEXT NOT NULL,
+    filepath     TEXT NOT NULL UNIQUE,
+    author       TEXT NOT NULL DEFAULT '',
+    character_id INTEGER REFERENCES characters(id) ON DELETE SET NULL,
+    content_hash TEXT NOT NULL DEFAULT '',
+    created      REAL NOT NULL,
+    modified     REAL NOT NULL,
+    base_id      INTEGER REFERENCES poses(id) ON DELETE RESTRICT
+);
+
+CREATE TABLE IF NOT EXISTS tags(
+    id       INTEGER PRIMARY KEY,
+    name     TEXT NOT NULL UNIQUE COLLATE NOCASE
+);
+
+CREATE TABLE IF NOT EXISTS pose_tags(
+    pose_id  INTEGER NOT NULL REFERENCES poses(id) ON DELETE CASCADE,
+    tag_id   INTEGER NOT NULL REFERENCES tags(id) ON DELETE CASCADE,
+    PRIMARY KEY(pose_id, tag_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_poses_name      ON poses(name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_poses_modified  ON poses(modified);
+CREATE INDEX IF NOT EXISTS idx_poses_character ON poses(character_id, modified);
+CREATE INDEX IF NOT EXISTS idx_poses_author    ON poses(author);
+CREATE INDEX IF NOT EXISTS idx_poses_hash      ON poses(content_hash);
+CREATE INDEX IF NOT EXISTS idx_pose_tags_tag   ON pose_tags(tag_id, pose_id);
+"""
+
+# Content addressed matrix storage for poses kept in the database. Control names are stored once in controls.
+# Every control of a pose has a row in position order. Delta poses leave block_hash NULL for controls they take from
+# their base pose.
+BLOCK_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks(
+    hash     BLOB PRIMARY KEY,
+    matrix   BLOB NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS controls(
+    id       INTEGER PRIMARY KEY,
+    name     TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS pose_blocks(
+    pose_id    INTEGER NOT NULL REFERENCES poses(id) ON DELETE CASCADE,
+    position   INTEGER NOT NULL,
+    control_id INTEGER NOT NULL REFERENCES controls(id),
+    block_hash BLOB REFERENCES blocks(hash),
+    PRIMARY KEY(pose_id, position)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_pose_blocks_hash ON pose_blocks(block_hash);
+CREATE INDEX IF NOT EXISTS idx_poses_base       ON poses(base_id);
+"""
+
+MATRIX_FMT = "<16d"
+
+# Pose files seen by the last scan of a pose folder, see scanner.py. Modification times are in nanoseconds.
+FILES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files(
+    filepath     TEXT PRIMARY KEY,
+    mtime        INTEGER NOT NULL,
+    size         INTEGER NOT NULL,
+    content_hash TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Similarity search features per pose, see similarity.py. Saving a pose again gives its features a new id, so
+# indexes only have to read the rows after the last id they've seen.
+FEATURE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pose_features(
+    id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    pose_id   INTEGER NOT NULL UNIQUE REFERENCES poses(id) ON DELETE CASCADE,
+    controls  TEXT NOT NULL,
+    features  BLOB NOT NULL
+);
+"""
+
+# The search table's rowid is the pose id
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS pose_search USING fts5(name, tags, character, author);
+"""
+
+SELECT_POSES = """
+SELECT poses.id, poses.name, poses.filepath, poses.author, IFNULL(characters.name, ''),
+       IFNULL((SELECT group_concat(tags.name, ',') FROM pose_tags JOIN tags ON tags.id = pose_tags.tag_id
+               WHERE pose_tags.pose_id = poses.id), ''),
+       poses.content_hash, poses.created, poses.modified
+FROM poses LEFT JOIN characters ON characters.id = poses.character_id
+"""
+
+PoseRecord = namedtuple("PoseRecord", ["id", "name", "filepath", "author", "character", "tags", "content_hash",
+                                       "created", "modified"])
+
+
+def _to_record(row):
+    row = list(row)
+    row[5] = tuple(row[5].split(",")) if row[5] else ()
+    return PoseRecord(*row)
+
+
+def pack_matrix(matrix):
+    """
+    Packs a matrix into a block and its content address.
+
+    Args:
+        matrix: sequence, 16 floats
+
+    Returns: tuple(bytes, bytes), hash and block
+
+    """
+
+    block = struct.pack(MATRIX_FMT, *matrix)
+    return hashlib.sha1(block).digest(), block
+
+
+def matrices_differ(a, b, tolerance):
+    """
+    Args:
+        a: sequence, 16 floats
+        b: sequence, 16 floats
+        tolerance: float, Largest difference of any element considered equal
+
+    Returns: bool
+
+    """
+
+    return any(abs(x - y) > tolerance for x, y in zip(a, b))
+
+
+def fts_query(text):
+    """
+    Converts free text into an FTS5 query where every word has to prefix-match.
+
+    Args:
+        text: str, The search text
+
+    Returns: str
+
+    """
+
+    words = [word.replace('"', '""') for word in text.split()]
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def create_database(db_path, legacy_path=const.LEGACY_DB):
+    """
+    Creates the folder of a new library database and seeds it with a copy of the legacy database, if there is one.
+    The legacy file is opened read-only, so it's never migrated in place. PoseLibrary.migrate() upgrades the copy.
+
+    Args:
+        db_path: str, The new database
+        legacy_path: str, The database shipped in the package
+
+    Returns: bool, True if the legacy database was copied
+
+    """
+
+    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+
+    # Sessions starting at the same time take turns, so only the first one copies
+    with pose_io.folder_lock(db_path):
+        if os.path.exists(db_path) or not os.path.exists(legacy_path):
+            return False
+
+        source = sqlite3.connect(f"{Path(legacy_path).resolve().as_uri()}?mode=ro", uri=True)
+        try:
+            target = sqlite3.connect(db_path)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+        finally:
+            source.close()
+
+    return True
+
+
+class PoseLibrary:
+    """
+    Pose library stored in an SQLite database. A single connection is kept open and reused, and the SQL statements
+    are constant strings so sqlite3's statement cache prepares each of them once.
+    """
+
+    def __init__(self, db_path=""):
+        self.db_path = str(db_path or const.POSE_DB)
+        if not db_path and not os.path.exists(self.db_path):
+            create_database(self.db_path)
+
+        self.connection = sqlite3.connect(self.db_path, timeout=const.DB_BUSY_TIMEOUT, cached_statements=256)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+
+        self.journal_mode = self.connection.execute(f"PRAGMA journal_mode = {const.DB_JOURNAL_MODE}").fetchone()[0]
+        if self.journal_mode == "wal":
+            # Commits in WAL mode stay durable against application crashes without syncing every transaction
+            self.connection.execute("PRAGMA synchronous = NORMAL")
+
+        self.has_fts = False
+
+        # Depth of nested transaction() calls
+        self.savepoints = 0
+
+        self.migrate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Closes the database connection.
+
+        Returns: None
+
+        """
+
+        self.connection.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs a write transaction, committing it when the block exits or rolling it back on an exception.
+
+        The write lock is taken straight away with BEGIN IMMEDIATE. A deferred transaction would start out reading
+        and have to upgrade its lock later, which fails without waiting if another session wrote in the meantime.
+        Nested calls join the transaction already in progress through a savepoint, so a nested block that raises is
+        undone even when the caller catches the exception and carries on.
+
+        Returns: context manager
+
+        """
+
+        if self.connection.in_transaction:
+            savepoint = f"nested_{self.savepoints}"
+            self.savepoints += 1
+            self.connection.execute(f"SAVEPOINT {savepoint}")
+            try:
+                yield
+            except BaseException:
+                self.connection.execute(f"ROLLBACK TO {savepoint}")
+                raise
+            finally:
+                self.connection.execute(f"RELEASE {savepoint}")
+                self.savepoints -= 1
+            return
+
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.connection.rollback()
+            raise
+
+        self.connection.commit()
+
+    def _script(self, script):
+        # executescript() would commit the transaction in progress, so statements are run one at a time
+        for statement in script.split(";"):
+            if statement.strip():
+                self.connection.execute(statement)
+
+    def _has_table(self, name):
+        return self.connection.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone() is not None
+
+    def migrate(self):
+        """
+        Creates the schema, upgrading the original bare pose(name, filepath, author) table if it's there.
+        Up to date databases are only read, so opening the library doesn't wait for other sessions' writes.
+
+        Returns: None
+
+        """
+
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            self.has_fts = self._has_table("pose_search")
+            return
+
+        with self.transaction():
+            # Another session may have migrated the database while this one waited for the lock
+            version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                self.has_fts = self._has_table("pose_search")
+                return
+
+            legacy = self._has_table("pose")
+
+            self._script(SCHEMA)
+
+            try:
+                self._script(FTS_SCHEMA)
+                self.has_fts = True
+            except sqlite3.OperationalError:
+                # SQLite built without FTS5. Searches fall back to LIKE.
+                self.has_fts = False
+
+            # Version 1 databases are missing the delta pose columns
+            if "base_id" not in self._columns("poses"):
+                self.connection.execute(
+                    "ALTER TABLE poses ADD COLUMN base_id INTEGER REFERENCES poses(id) ON DELETE RESTRICT")
+            if "base_pose_id" not in self._columns("characters"):
+                self.connection.execute(
+                    "ALTER TABLE characters ADD COLUMN base_pose_id INTEGER REFERENCES poses(id) ON DELETE SET NULL")
+            self._script(BLOCK_SCHEMA)
+            self._upgrade_pose_blocks()
+            self._script(FEATURE_SCHEMA)
+            self._script(FILES_SCHEMA)
+
+            if version < 1 and legacy:
+                for name, filepath, author in self.connection.execute(
+                        "SELECT name, filepath, author FROM pose").fetchall():
+                    self._add_pose(name or "", filepath, author=author or "")
+                self.connection.execute("DROP TABLE pose")
+
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _upgrade_pose_blocks(self):
+        # Before version 5 block_hash couldn't be NULL and delta poses only had rows for the controls they changed.
+        # They loaded as their base pose's controls followed by their own new ones, so that's the order they get.
+        if not any(row[1] == "block_hash" and row[3] for row in self.connection.execute(
+                "PRAGMA table_info(pose_blocks)")):
+            return
+
+        owned = {}
+        for pose_id, control_id, block_hash in self.connection.execute(
+                "SELECT pose_id, control_id, block_hash FROM pose_blocks ORDER BY pose_id, position"):
+            owned.setdefault(pose_id, OrderedDict())[control_id] = block_hash
+        bases = dict(self.connection.execute("SELECT id, base_id FROM poses WHERE base_id IS NOT NULL"))
+
+        orders = {}
+
+        def control_order(pose_id):
+            if pose_id not in orders:
+                order = list(control_order(bases[pose_id])) if pose_id in bases else []
+                inherited = set(order)
+                orders[pose_id] = order + [control_id for control_id in owned.get(pose_id, ())
+                                           if control_id not in inherited]
+            return orders[pose_id]
+
+        self.connection.execute("DROP TABLE pose_blocks")
+        self._script(BLOCK_SCHEMA)
+        self.connection.executemany(
+            "INSERT INTO pose_blocks(pose_id, position, control_id, block_hash) VALUES (?, ?, ?, ?)",
+            [(pose_id, position, control_id, owned.get(pose_id, {}).get(control_id))
+             for pose_id in sorted(set(owned) | set(bases))
+             for position, control_id in enumerate(control_order(pose_id))])
+
+    def _columns(self, table):
+        return {row[1] for row in self.connection.execute(f"PRAGMA table_info({table})")}
+
+    def _character_id(self, character):
+        if not character:
+            return None
+
+        self.connection.execute("INSERT OR IGNORE INTO characters(name) VALUES (?)", (character,))
+        return self.connection.execute("SELECT id FROM characters WHERE name = ?", (character,)).fetchone()[0]
+
+    def _set_tags(self, pose_id, tags):
+        tags = sorted({tag.strip() for tag in tags if tag.strip()}, key=str.lower)
+
+        self.connection.execute("DELETE FROM pose_tags WHERE pose_id = ?", (pose_id,))
+        self.connection.executemany("INSERT OR IGNORE INTO tags(name) VALUES (?)", [(tag,) for tag in tags])
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO pose_tags(pose_id, tag_id) SELECT ?, id FROM tags WHERE name = ?",
+            [(pose_id, tag) for tag in tags])
+
+    def _update_search(self, pose_id):
+        if not self.has_fts:
+            return
+
+        record = self.get_pose(pose_id)
+        self.connection.execute("DELETE FROM pose_search WHERE rowid = ?", (pose_id,))
+        self.connection.execute("INSERT INTO pose_search(rowid, name, tags, character, author) VALUES (?, ?, ?, ?, ?)",
+                                (pose_id, record.name, " ".join(record.tags), record.character, record.author))
+
+    def _add_pose(self, name, filepath, author="", character="", tags=(), content_hash=""):
+        now = time.time()
+        character_id = self._character_id(character)
+
+        self.connection.execute(
+            "INSERT INTO poses(name, filepath, author, character_id, content_hash, created, modified) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(filepath) DO UPDATE SET name = excluded.name, author = excluded.author, "
+            "character_id = excluded.character_id, content_hash = excluded.content_hash, modified = excluded.modified",
+            (name, str(filepath), author, character_id, content_hash, now, now))
+        pose_id = self.connection.execute("SELECT id FROM poses WHERE filepath = ?", (str(filepath),)).fetchone()[0]
+
+        self._set_tags(pose_id, tags)
+        self._update_search(pose_id)
+
+        return pose_id
+
+    def add_pose(self, name, filepath, author="", character="", tags=(), content_hash=""):
+        """
+        Adds a pose to the library. If the file is already in the library its entry is updated.
+
+        Args:
+            name: str, Display name of the pose
+            filepath: str, The pose file
+            author: str, Who saved the pose
+            character: str, The character or rig the pose belongs to
+            tags: list, Searchable tags
+            content_hash: str, Hash of the pose file's contents
+
+        Returns: int, The pose id
+
+        """
+
+        with self.transaction():
+            return self._add_pose(name, filepath, author=author, character=character, tags=tags,
+                                  content_hash=content_hash)
+
+    def set_tags(self, pose_id, tags):
+        """
+        Replaces the tags of a pose.
+
+        Args:
+            pose_id: int, The pose id
+            tags: list, The new tags
+
+        Returns: None
+
+        """
+
+        with self.transaction():
+            self._set_tags(pose_id, tags)
+            self.connection.execute("UPDATE poses SET modified = ? WHERE id = ?", (time.time(), pose_id))
+            self._update_search(pose_id)
+
+    def remove_pose(self, pose_id):
+        """
+        Removes a pose from the library. Pose files are left on disk. Poses used as the base of delta poses can't be
+        removed and raise sqlite3.IntegrityError.
+
+        Args:
+            pose_id: int, The pose id
+
+        Returns: bool, True if the pose was in the library
+
+        """
+
+        with self.transaction():
+            hashes = [row[0] for row in self.connection.execute(
+                "SELECT block_hash FROM pose_blocks WHERE pose_id = ? AND block_hash IS NOT NULL", (pose_id,))]
+
+            # Raises for delta bases before anything else is touched
+            removed = self.connection.execute("DELETE FROM poses WHERE id = ?", (pose_id,)).rowcount > 0
+
+            if self.has_fts:
+                self.connection.execute("DELETE FROM pose_search WHERE rowid = ?", (pose_id,))
+
+            # Drop blocks no other pose shares
+            self.connection.executemany(
+                "DELETE FROM blocks WHERE hash = ? AND NOT EXISTS "
+                "(SELECT 1 FROM pose_blocks WHERE pose_blocks.block_hash = blocks.hash)", [(h,) for h in hashes])
+
+            return removed
+
+    def store_pose(self, name, pose_data, author="", character="", tags=(), base_id=None, delta=False,
+                   tolerance=const.DELTA_TOLERANCE):
+        """
+        Stores a pose in the database. Each control's matrix is stored as a content addressed block, so matrices
+        already in the library aren't stored again.
+
+        With delta, only the matrices of controls that differ from the base pose by more than the tolerance are
+        stored, the rest are taken from the base pose when loading. The base defaults to the character's base pose,
+        see set_base_pose(). A delta pose still loads with exactly its own controls in their original order.
+
+        Args:
+            name: str, Display name of the pose
+            pose_data: OrderedDict(), The pose data from get_pose_data()
+            author: str, Who saved the pose
+            character: str, The character or rig the pose belongs to
+            tags: list, Searchable tags
+            base_id: int, Pose to store the delta against
+            delta: bool, Store only the controls that differ from the base pose
+            tolerance: float, Largest matrix element difference treated as unchanged
+
+        Returns: int, The pose id
+
+        """
+
+        with self.transaction():
+            if delta and base_id is None and character:
+                row = self.connection.execute("SELECT base_pose_id FROM characters WHERE name = ?",
+                                              (character,)).fetchone()
+                base_id = row[0] if row else None
+
+            base = self.load_pose(base_id) if delta and base_id is not None else OrderedDict()
+            if not delta:
+                base_id = None
+
+            entries = []
+            content = hashlib.sha1()
+            for name_key, obj_info in pose_data.items():
+                matrix = obj_info["matrix"]
+                block_hash, block = pack_matrix(matrix)
+                content.update(name_key.encode("utf-8") + block_hash)
+
+                if name_key in base and not matrices_differ(matrix, base[name_key]["matrix"], tolerance):
+                    # Inherited from the base pose
+                    entries.append((name_key, None, None))
+                else:
+                    entries.append((name_key, block_hash, block))
+
+            filepath = f"{const.LIBRARY_PREFIX}{uuid.uuid4().hex}"
+            pose_id = self._add_pose(name, filepath, author=author, character=character, tags=tags,
+                                     content_hash=content.hexdigest())
+            self.connection.execute("UPDATE poses SET base_id = ? WHERE id = ?", (base_id, pose_id))
+
+            self.connection.executemany("INSERT OR IGNORE INTO blocks(hash, matrix) VALUES (?, ?)",
+                                        [(block_hash, block) for _, block_hash, block in entries if block])
+            self.connection.executemany("INSERT OR IGNORE INTO controls(name) VALUES (?)",
+                                        [(name_key,) for name_key, _, _ in entries])
+            self.connection.executemany(
+                "INSERT INTO pose_blocks(pose_id, position, control_id, block_hash) "
+                "SELECT ?, ?, id, ? FROM controls WHERE name = ?",
+                [(pose_id, position, block_hash, name_key)
+                 for position, (name_key, block_hash, _) in enumerate(entries)])
+
+            self.set_features(pose_id, pose_data)
+
+        return pose_id
+
+    def set_features(self, pose_id, pose_data):
+        """
+        Stores the similarity search features of a pose, replacing any it had.
+
+        Args:
+            pose_id: int, The pose id
+            pose_data: OrderedDict(), The full pose, including the controls of its base pose if it's a delta
+
+        Returns: None
+
+        """
+
+        self.store_features(pose_id, *similarity.pack_features(*similarity.pose_features(pose_data)))
+
+    def store_features(self, pose_id, controls, features):
+        """
+        Stores similarity search features already packed with similarity.pack_features(), e.g. by a worker process.
+
+        Args:
+            pose_id: int, The pose id
+            controls: str, Packed control names
+            features: bytes, Packed features
+
+        Returns: None
+
+        """
+
+        with self.transaction():
+            self.connection.execute("DELETE FROM pose_features WHERE pose_id = ?", (pose_id,))
+            self.connection.execute("INSERT INTO pose_features(pose_id, controls, features) VALUES (?, ?, ?)",
+                                    (pose_id, controls, features))
+
+    def feature_rows(self, after=0):
+        """
+        Gets similarity search features saved after the given id.
+
+        Args:
+            after: int, The last feature id already read
+
+        Returns: list of (feature id, pose id, controls, features)
+
+        """
+
+        return self.connection.execute("SELECT id, pose_id, controls, features FROM pose_features WHERE id > ? "
+                                       "ORDER BY id", (after,)).fetchall()
+
+    def feature_count(self):
+        """
+        Returns: int, Number of poses with similarity search features
+
+        """
+
+        return self.connection.execute("SELECT count(*) FROM pose_features").fetchone()[0]
+
+    def feature_pose_ids(self):
+        """
+        Returns: list, Ids of the poses with similarity search features
+
+        """
+
+        return [row[0] for row in self.connection.execute("SELECT pose_id FROM pose_features")]
+
+    def poses_without_features(self):
+        """
+        Returns: list of (pose id, filepath), poses missing similarity search features
+
+        """
+
+        return self.connection.execute(
+            "SELECT poses.id, poses.filepath FROM poses LEFT JOIN pose_features ON pose_features.pose_id = poses.id "
+            "WHERE pose_features.pose_id IS NULL ORDER BY poses.id").fetchall()
+
+    def load_pose(self, pose_id):
+        """
+        Loads a pose stored with store_pose(). Delta poses take the matrices they didn't store from their base pose.
+
+        Args:
+            pose_id: int, The pose id
+
+        Returns: OrderedDict(), The pose's controls in the order they were stored
+
+        """
+
+        row = self.connection.execute("SELECT base_id FROM poses WHERE id = ?", (pose_id,)).fetchone()
+        if row is None:
+            return OrderedDict()
+
+        rows = self.connection.execute(
+            "SELECT controls.name, blocks.matrix FROM pose_blocks "
+            "JOIN controls ON controls.id = pose_blocks.control_id "
+            "LEFT JOIN blocks ON blocks.hash = pose_blocks.block_hash "
+            "WHERE pose_blocks.pose_id = ? ORDER BY pose_blocks.position", (pose_id,)).fetchall()
+
+        inherits = row[0] is not None and any(block is None for _, block in rows)
+        base = self.load_pose(row[0]) if inherits else OrderedDict()
+
+        pose_data = OrderedDict()
+        for control, block in rows:
+            if block is not None:
+                pose_data[control] = {"matrix": list(struct.unpack(MATRIX_FMT, block))}
+            elif control in base:
+                pose_data[control] = base[control]
+
+        return pose_data
+
+    def load_filepath(self, filepath):
+        """
+        Loads a pose stored in the database by its library path.
+
+        Args:
+            filepath: str, Library path starting with const.LIBRARY_PREFIX
+
+        Returns: OrderedDict()
+
+        """
+
+        row = self.connection.execute("SELECT id FROM poses WHERE filepath = ?", (str(filepath),)).fetchone()
+        return self.load_pose(row[0]) if row else OrderedDict()
+
+    def set_base_pose(self, character, pose_id):
+        """
+        Sets the pose delta poses of a character are stored against, typically its default pose.
+
+        Args:
+            character: str, The character
+            pose_id: int, The base pose
+
+        Returns: None
+
+        """
+
+        with self.transaction():
+            character_id = self._character_id(character)
+            self.connection.execute("UPDATE characters SET base_pose_id = ? WHERE id = ?", (pose_id, character_id))
+
+    def storage_stats(self):
+        """
+        Reports how much matrix data is shared between poses stored in the database.
+
+        Returns: dict, "blocks" stored, "references" to them and "bytes" used by blocks
+
+        """
+
+        blocks, size = self.connection.execute("SELECT count(*), IFNULL(sum(length(matrix)), 0) FROM blocks").fetchone()
+        references = self.connection.execute("SELECT count(block_hash) FROM pose_blocks").fetchone()[0]
+
+        return {"blocks": blocks, "references": references, "bytes": size}
+
+    def get_pose(self, pose_id):
+        """
+        Gets a single pose.
+
+        Args:
+            pose_id: int, The pose id
+
+        Returns: PoseRecord or None
+
+        """
+
+        row = self.connection.execute(SELECT_POSES + "WHERE poses.id = ?", (pose_id,)).fetchone()
+        return _to_record(row) if row else None
+
+    def manifest(self, folder=""):
+        """
+        Gets what the last scan saw of the pose files in a folder.
+
+        Args:
+            folder: str, Only return files in this folder or below it. Returns every file if empty.
+
+        Returns: dict, filepath to (mtime in nanoseconds, size, content hash)
+
+        """
+
+        if not folder:
+            rows = self.connection.execute("SELECT filepath, mtime, size, content_hash FROM files")
+        else:
+            prefix = folder.rstrip("/\\") + os.sep
+            rows = self.connection.execute("SELECT filepath, mtime, size, content_hash FROM files "
+                                           "WHERE substr(filepath, 1, ?) = ?", (len(prefix), prefix))
+
+        return {filepath: (mtime, size, content_hash) for filepath, mtime, size, content_hash in rows}
+
+    def update_manifest(self, entries):
+        """
+        Records the pose files seen by a scan.
+
+        Args:
+            entries: list of (filepath, mtime in nanoseconds, size, content hash)
+
+        Returns: None
+
+        """
+
+        with self.transaction():
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO files(filepath, mtime, size, content_hash) VALUES (?, ?, ?, ?)", entries)
+
+    def remove_manifest(self, filepaths):
+        """
+        Forgets pose files that were deleted.
+
+        Args:
+            filepaths: list, The deleted files
+
+        Returns: None
+
+        """
+
+        with self.transaction():
+            self.connection.executemany("DELETE FROM files WHERE filepath = ?", [(str(path),) for path in filepaths])
+
+    def filepaths(self):
+        """
+        Lists the file of every pose, including the library paths of poses stored in the database.
+
+        Returns: list of (pose id, filepath)
+
+        """
+
+        return self.connection.execute("SELECT id, filepath FROM poses ORDER BY id").fetchall()
+
+    def set_content_hash(self, pose_id, content_hash):
+        """
+        Updates the content hash of a pose, which thumbnails are named after.
+
+        Args:
+            pose_id: int, The pose id
+            content_hash: str, Hash of the pose file's contents
+
+        Returns: None
+
+        """
+
+        with self.transaction():
+            self.connection.execute("UPDATE poses SET content_hash = ? WHERE id = ?", (content_hash, pose_id))
+
+    def content_hashes(self):
+        """
+        Returns: set, The content hash of every pose
+
+        """
+
+        return {row[0] for row in self.connection.execute("SELECT DISTINCT content_hash FROM poses")}
+
+    def rebuild_search(self):
+        """
+        Rebuilds the full-text search table from the poses table.
+
+        Returns: None
+
+        """
+
+        if not self.has_fts:
+            return
+
+        with self.transaction():
+            self.connection.execute("DELETE FROM pose_search")
+            for (pose_id,) in self.connection.execute("SELECT id FROM poses").fetchall():
+                self._update_search(pose_id)
+
+    def find_filepath(self, filepath):
+        """
+        Gets the pose stored in the given file.
+
+        Args:
+            filepath: str, The pose file
+
+        Returns: PoseRecord or None
+
+        """
+
+        row = self.connection.execute(SELECT_POSES + "WHERE poses.filepath = ?", (str(filepath),)).fetchone()
+        return _to_record(row) if row else None
+
+    def _where(self, text="", tags=(), character="", author=""):
+        clauses = []
+        params = []
+
+        # Whitespace alone would make an empty FTS query, which is a syntax error
+        text = text.strip()
+        if text and self.has_fts:
+            clauses.append("poses.id IN (SELECT rowid FROM pose_search WHERE pose_search MATCH ?)")
+            params.append(fts_query(text))
+        elif text:
+            for word in text.split():
+                clauses.append("(poses.name LIKE ? OR poses.id IN (SELECT pose_id FROM pose_tags JOIN tags "
+                               "ON tags.id = pose_tags.tag_id WHERE tags.name LIKE ?))")
+                params.extend([f"%{word}%", f"{word}%"])
+
+        tags = list(tags)
+        if tags:
+            placeholders = ", ".join("?" * len(tags))
+            clauses.append(f"poses.id IN (SELECT pose_id FROM pose_tags JOIN tags ON tags.id = pose_tags.tag_id "
+                           f"WHERE tags.name IN ({placeholders}) GROUP BY pose_id HAVING count(*) = ?)")
+            params.extend(tags + [len(tags)])
+
+        if character:
+            clauses.append("characters.name = ?")
+            params.append(character)
+
+        if author:
+            clauses.append("poses.author = ?")
+            params.append(author)
+
+        where = ("WHERE " + " AND ".join(clauses) + " ") if clauses else ""
+        return where, params
+
+    def search(self, text="", tags=(), character="", author="", limit=50, offset=0):
+        """
+        Searches the library, newest poses first. Text is matched against names, tags, characters and authors,
+        every given tag has to be present, and character and author have to match exactly.
+
+        Args:
+            text: str, Words to search for. Each word matches as a prefix.
+            tags: list, Tags the poses need to have
+            character: str, Only return poses for this character
+            author: str, Only return poses by this author
+            limit: int, Page size
+            offset: int, Number of results to skip
+
+        Returns: list of PoseRecord
+
+        """
+
+        where, params = self._where(text=text, tags=tags, character=character, author=author)
+
+        # Page the matching ids first so tags are only gathered for the rows being returned
+        rows = self.connection.execute(
+            SELECT_POSES + "WHERE poses.id IN (SELECT poses.id FROM poses LEFT JOIN characters ON characters.id = "
+            "poses.character_id " + where + "ORDER BY poses.modified DESC, poses.id DESC LIMIT ? OFFSET ?) "
+            "ORDER BY poses.modified DESC, poses.id DESC", params + [limit, offset]).fetchall()
+
+        return [_to_record(row) for row in rows]
+
+    def count(self, text="", tags=(), character="", author=""):
+        """
+        Counts the poses search() would return without paging.
+
+        Returns: int
+
+        """
+
+        where, params = self._where(text=text, tags=tags, character=character, author=author)
+        return self.connection.execute(
+            "SELECT count(*) FROM poses LEFT JOIN characters ON characters.id = poses.character_id " + where,
+            params).fetchone()[0]
+
+    def tags(self):
+        """
+        Returns: list, Every tag in use
+
+        """
+
+        return [row[0] for row in self.connection.execute(
+            "SELECT DISTINCT tags.name FROM tags JOIN pose_tags ON pose_tags.tag_id = tags.id ORDER BY tags.name")]
+
+    def characters(self):
+        """
+        Returns: list, Every character in the library
+
+        """
+
+        return [row[0] for row in self.connection.execute("SELECT name FROM characters ORDER BY name")]
@@ -2,13 +2,20 @@
 Copy and Paste poses
 """
 
+import os
 import sys
-import json
 from pathlib import Path
 from collections import OrderedDict
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 
 from . import const
+from . import instrument
+from . import pose_io
+from . import pose_math
+from . import plans
+from . import resolve
+from . import symmetry
 
 
 class PoseyTemplate(ABC):
@@ -18,36 +25,421 @@ class PoseyTemplate(ABC):
     """
 
     def __init__(self):
-        pass
+        # Renaming rules used to match scene controls to pose entries
+        self.name_rules = resolve.NameRules()
+        self.name_indices = resolve.NameIndexCache()
 
-    def copy(self, filepath=""):
+        # Left/right pairing used by mirrored pastes, see symmetry.py
+        self.mirror_rules = symmetry.MirrorRules()
+        self.mirror_maps = symmetry.MirrorMapCache()
+
+        # Resolved pastes reused while the same rig and selection are pasted onto, see plans.py
+        self.paste_plans = plans.PastePlanCache()
+
+        # Opened on first use by get_library() and get_similarity()
+        self.library = None
+        self.similarity = None
+
+        # Timings of the copy or paste in progress, see instrument.py
+        self.timings = None
+
+    def copy(self, filepath="", fmt="", callback=None, encoding=""):
         """
         Copies the pose of the current selection to the specified file. If no filepath is
         provided, the clipboard will be used.
 
+        The pose is captured straight away, and serialization and file I/O happen on a background thread.
+        The returned future resolves to serialize_pose()'s result once the file is written.
+
+        Args:
+            filepath: str, The file to write to
+            fmt: str, const.FORMAT_JSON or const.FORMAT_BINARY. Picked from the file extension if not provided.
+            callback: callable, Called with the future once the write is done. Runs on the writer thread.
+            encoding: str, Matrix encoding of binary files, see quantize.py. Defaults to const.POSE_ENCODING.
+
+        Returns: concurrent.futures.Future, or False if nothing was copied
+
+        """
+
+        if not filepath:
+            filepath = const.CLIPBOARD
+
+        # The operation only ends once the file is written, so timings are finished by the writer
+        timings = instrument.Timings("copy", filepath=str(filepath))
+        with self.timed(timings, finish=False):
+            # Get selection
+            with self.phase("selection"):
+                sel = self.get_selection()
+            if not sel:
+                timings.finish(result=False)
+                return False
+
+            # Get pose data from selection
+            with self.phase("capture"):
+                pose = self.get_pose_data(sel)
+            if not pose:
+                timings.finish(result=False)
+                return False
+
+            self.count("selected", len(sel))
+            self.count("controls", len(pose))
+
+        # Write to file in the background
+        future = pose_io.background_writer().submit(filepath, self.serialize_pose, pose, filepath, fmt, timings,
+                                                    encoding)
+        future.add_done_callback(lambda done: timings.finish(result=not done.exception() and done.result()))
+        if callback:
+            future.add_done_callback(callback)
+
+        return future
+
+    @contextmanager
+    def timed(self, timings, finish=True):
+        """
+        Makes timings the operation in progress, so phase() and count() record into it.
+
+        Args:
+            timings: instrument.Timings, The operation being timed
+            finish: bool, Emit the timings when the block exits
+
+        Returns: context manager yielding timings
+
+        """
+
+        previous = self.timings
+        self.timings = timings
+        try:
+            yield timings
+        finally:
+            self.timings = previous
+            if finish:
+                timings.finish()
+
+    def phase(self, name):
+        """
+        Times a phase of the operation in progress. Does nothing outside a timed operation.
+
+        Args:
+            name: str, One of instrument.PHASES
+
+        Returns: context manager
+
+        """
+
+        return instrument.phase(self.timings, name)
+
+    def count(self, name, value):
+        """
+        Records a count, e.g. the number of controls, for the operation in progress.
+
+        Args:
+            name: str, What was counted
+            value: int, The count
+
+        Returns: None
+
+        """
+
+        if self.timings is not None:
+            self.timings.count(name, value)
+
+    def get_library(self):
+        """
+        Gets the pose library, opening it on first use.
+
+        Returns: library.PoseLibrary
+
+        """
+
+        if self.library is None:
+            # SQLite is only loaded by sessions using the library
+            from . import library
+            self.library = library.PoseLibrary()
+
+        return self.library
+
+    def scan_library(self, root="", workers=1):
+        """
+        Adds new and changed pose files in a folder to the library and removes deleted ones. Only files whose
+        modification time or size changed since the last scan are read.
+
+        Args:
+            root: str, The pose folder. Defaults to const.POSE_DIR.
+            workers: int, Processes used to parse changed files
+
+        Returns: scanner.ScanResult
+
+        """
+
+        from . import scanner
+
+        return scanner.scan(self.get_library(), root=root or const.POSE_DIR, workers=workers)
+
+    def get_similarity(self):
+        """
+        Gets the similarity index of the pose library, creating it on first use. Needs NumPy.
+
+        Returns: similarity.SimilarityIndex
+
+        """
+
+        if self.similarity is None:
+            from . import similarity
+            self.similarity = similarity.SimilarityIndex(self.get_library())
+
+        return self.similarity
+
+    def find_similar(self, pose_id=None, count=10):
+        """
+        Finds the library poses closest to a pose in the library, or to the current selection's pose if no pose
+        is given.
+
+        Args:
+            pose_id: int, The library pose to compare against
+            count: int, Number of poses to return
+
+        Returns: list of (library.PoseRecord, distance), closest first
+
+        """
+
+        index = self.get_similarity()
+
+        if pose_id is not None:
+            results = index.query_pose(pose_id, count=count)
+        else:
+            sel = self.get_selection()
+            if not sel:
+                print("Could not find similar poses. Nothing has been selected")
+                return []
+            results = index.query(self.get_pose_data(sel), count=count)
+
+        library = self.get_library()
+        return [(library.get_pose(result_id), distance) for result_id, distance in results]
+
+    def copy_to_library(self, name, author="", character="", tags=(), delta=False, base_id=None):
+        """
+        Copies the pose of the current selection into the pose library database. Matrices already in the library
+        aren't stored again, and with delta only the controls that differ from the base pose are stored.
+
+        Args:
+            name: str, Display name of the pose
+            author: str, Who saved the pose
+            character: str, The character or rig the pose belongs to
+            tags: list, Searchable tags
+            delta: bool, Store only the controls that differ from the base pose
+            base_id: int, Pose to store the delta against. Defaults to the character's base pose.
+
+        Returns: int, The pose id, or None if nothing was copied
+
+        """
+
+        with self.timed(instrument.Timings("copy_to_library", name=name)):
+            with self.phase("selection"):
+                sel = self.get_selection()
+            if not sel:
+                return None
+
+            with self.phase("capture"):
+                pose = self.get_pose_data(sel)
+            if not pose:
+                return None
+
+            self.count("controls", len(pose))
+            with self.phase("io"):
+                return self.get_library().store_pose(name, pose, author=author, character=character, tags=tags,
+                                                     base_id=base_id, delta=delta)
+
+    def copy_clip(self, filepath, start, end, step=1, encoding=""):
+        """
+        Captures the selection over a frame range and streams it to a clip file one chunk of frames at a time.
+
+        Args:
+            filepath: str, The clip file to write
+            start: float, First frame
+            end: float, Last frame, inclusive
+            step: float, Frame increment
+            encoding: str, Matrix encoding, see quantize.py. Defaults to const.POSE_ENCODING.
+
         Returns: bool
 
+        Raises:
+            ValueError: A frame's capture is missing controls captured on the first frame. The clip isn't written.
+
         """
 
-        # Get selection
-        sel = self.get_selection()
-        if not sel:
-            return False
+        from . import clip
 
-        # Get pose data from selection
-        pose = self.get_pose_data(sel)
-        if not pose:
+        if step <= 0:
+            print("Could not copy clip. Step has to be greater than 0")
             return False
 
-        # Write to file
-        self.serialize_pose(pose)
+        with self.timed(instrument.Timings("copy_clip", filepath=str(filepath))):
+            with self.phase("selection"):
+                sel = self.get_selection()
+            if not sel:
+                return False
+
+            current_frame = self.get_frame()
+            writer = None
+            completed = False
+            try:
+                frame = start
+                while frame <= end:
+                    with self.phase("capture"):
+                        pose = self.get_pose_data_at(sel, frame)
+                    if not pose:
+                        return False
+
+                    # Names are taken from the first frame
+                    with self.phase("io"):
+                        if writer is None:
+                            writer = clip.ClipWriter(filepath, list(pose), encoding=encoding)
+
+                        missing = [name for name in writer.names if name not in pose]
+                        if missing:
+                            raise ValueError(f"Could not copy clip. Frame {frame} is missing {len(missing)} "
+                                             f"control(s) captured on frame {start}: {', '.join(missing[:10])}")
+
+                        writer.add_frame(frame, [value for name in writer.names for value in pose[name]["matrix"]])
+
+                    self.count("frames", 1)
+                    frame += step
+
+                completed = True
+
+            finally:
+                if writer is not None:
+                    with self.phase("io"):
+                        if completed:
+                            writer.close()
+                        else:
+                            writer.abort()
+
+                # get_pose_data_at() may have changed frames
+                self.set_frame(current_frame)
+
+            if writer is not None:
+                self.count("controls", len(writer.names))
+
+            return writer is not None
+
+    def paste_clip(self, filepath, offset=0.0, stride=1, by_name=True, ref_obj='', mirror=''):
+        """
+        Pastes a clip to the current selection, keying one frame at a time. Frames are read from the memory-mapped
+        clip as they're pasted.
 
-        return True
+        Args:
+            filepath: str, The clip file
+            offset: float, Added to each recorded frame time to get the frame it's pasted on
+            stride: int, Paste every nth recorded frame
+            by_name: bool, Determines whether the pose will be pasted by name or selection order
+            ref_obj: str, Name of the object to paste pose relative to. This is typically the hip control.
+            mirror: str, the axis on which to mirror the pose over
+
+        Returns: bool
+
+        """
+
+        from . import clip
+
+        with self.timed(instrument.Timings("paste_clip", filepath=str(filepath))):
+            with self.phase("selection"):
+                selection = self.get_selection()
+            if not selection:
+                print("Could not paste clip. Nothing has been selected")
+                return False
+
+            if mirror and mirror.lower() not in list(const.MIRROR_MAP):
+                print("Invalid mirror kwarg passed. Accepts 'x', 'y', or 'z'")
+                return False
+
+            self.count("selected", len(selection))
+
+            current_frame = self.get_frame()
+            result = False
+            try:
+                with clip.ClipReader(filepath) as reader, self.paste_session(selection):
+                    for idx in range(0, len(reader), max(1, int(stride))):
+                        self.set_frame(reader.frames[idx] + offset)
+                        with self.phase("deserialize"):
+                            pose_data = reader.frame_pose(idx)
+
+                        self.count("frames", 1)
+                        result = self.paste_dcc(selection, pose_data, by_name=by_name, ref_obj=ref_obj,
+                                                mirror=mirror) or result
+            finally:
+                self.set_frame(current_frame)
+
+            return result
+
+    @contextmanager
+    def paste_session(self, selection):
+        """
+        Wraps pasting many poses in a row, e.g. every frame of a clip, so a DCC can set up once what it otherwise
+        sets up for every paste, like an undo step.
+
+        TODO: Override per DCC where pastes have setup worth sharing
+
+        Args:
+            selection: list, The objects being pasted to
+
+        Returns: context manager
+
+        """
+
+        yield
+
+    def get_frame(self):
+        """
+        Gets the current frame
+
+        TODO: Needs to be overridden per DCC
+
+        Returns: float
+
+        """
+
+        raise NotImplementedError("Frame access isn't supported in this DCC")
+
+    def set_frame(self, frame):
+        """
+        Sets the current frame
+
+        TODO: Needs to be overridden per DCC
+
+        Args:
+            frame: float, The frame to go to
+
+        Returns: None
+
+        """
+
+        raise NotImplementedError("Frame access isn't supported in this DCC")
+
+    def get_pose_data_at(self, sel, frame):
+        """
+        Gets pose data at the given frame. DCCs that can evaluate other frames without changing the current one
+        should override this.
+
+        Args:
+            sel: list, The objects to get pose data from.
+            frame: float, The frame to capture
+
+        Returns: OrderedDict()
+
+        """
+
+        self.set_frame(frame)
+        return self.get_pose_data(sel)
 
     def deserialize_pose(self, filepath=""):
         """
         Converts the pose in the specified file into an OrderedDict(). If no filepath is specified,
-        the clipboard will be used.
+        the clipboard will be used. The file format is detected from the file contents, and poses stored
+        in the library database are loaded from there.
+
+        Parsed poses are cached until the file changes, so the returned pose is shared and should be
+        treated as read-only.
 
         Returns: OrderedDict()
 
@@ -56,10 +448,29 @@ class PoseyTemplate(ABC):
         if not filepath:
             filepath = const.CLIPBOARD
 
-        pose_data = OrderedDict()
-        with open(filepath, "r", encoding="ascii") as pose_file:
-            pose_data = json.loads(pose_file.read(), object_pairs_hook=OrderedDict)
+        if str(filepath).startswith(const.LIBRARY_PREFIX):
+            with self.phase("io"):
+                return self.get_library().load_filepath(filepath)
+
+        with self.phase("io"):
+            # Make sure a copy still being written has landed
+            pose_io.background_writer().wait(filepath)
 
+            cache = pose_io.pose_cache()
+            pose_data = cache.get(filepath)
+            if pose_data is not None:
+                self.count("cached", 1)
+                return pose_data
+
+            with open(filepath, "rb") as pose_file:
+                # Stat before reading, so a write landing meanwhile leaves the cached pose stale instead of current
+                stat = os.fstat(pose_file.fileno())
+                buffer = pose_file.read()
+
+        with self.phase("deserialize"):
+            pose_data = pose_io.decode_pose(buffer)
+
+        cache.put(filepath, pose_data, stat)
         return pose_data
 
     @abstractmethod
@@ -96,7 +507,8 @@ class PoseyTemplate(ABC):
         Pastes the specified pose to the current selection. If no filepath is specified,
         the clipboard will be used.
 
-        TODO: Switch mirror axis to mirror plane
+        When mirroring, left and right controls trade poses using self.mirror_rules.
+
         TODO: Switch prints() to logs
 
         Args:
@@ -109,26 +521,31 @@ class PoseyTemplate(ABC):
 
         """
 
-        # Get selection
-        selection = self.get_selection()
-        if not selection:
-            print("Could not paste pose. Nothing has been selected")
-            return False
+        with self.timed(instrument.Timings("paste", filepath=str(filepath or const.CLIPBOARD))):
+            # Get selection
+            with self.phase("selection"):
+                selection = self.get_selection()
+            if not selection:
+                print("Could not paste pose. Nothing has been selected")
+                return False
 
-        # Mirror check
-        if mirror and mirror.lower() not in list(const.MIRROR_MAP):
-            print("Invalid mirror kwarg passed. Accepts 'x', 'y', or 'z'")
-            return False
+            # Mirror check
+            if mirror and mirror.lower() not in list(const.MIRROR_MAP):
+                print("Invalid mirror kwarg passed. Accepts 'x', 'y', or 'z'")
+                return False
 
-        # Get pose data
-        pose_data = self.deserialize_pose(filepath=filepath)
-        if not pose_data:
-            print("Clipboard is empty. Please select an object and copy the pose again.")
-            return False
+            # Get pose data
+            pose_data = self.deserialize_pose(filepath=filepath)
+            if not pose_data:
+                print("Clipboard is empty. Please select an object and copy the pose again.")
+                return False
+
+            self.count("selected", len(selection))
+            self.count("controls", len(pose_data))
 
-        # Perform DCC specific paste
-        result = self.paste_dcc(selection, pose_data, by_name=by_name, ref_obj=ref_obj, mirror=mirror)
-        return result
+            # Perform DCC specific paste
+            result = self.paste_dcc(selection, pose_data, by_name=by_name, ref_obj=ref_obj, mirror=mirror)
+            return result
 
     @abstractmethod
     def paste_dcc(self, selection, pose_data, by_name=True, ref_obj='', mirror=''):
@@ -150,13 +567,278 @@ class PoseyTemplate(ABC):
 
         return False
 
-    def serialize_pose(self, pose_data, filepath=""):
+    def resolve_names(self, selection, pose_data, by_name=True, skip=()):
+        """
+        Matches the selected objects to entries in the pose using self.name_rules. The lookup index is built once
+        per pose and reused for following pastes.
+
+        Args:
+            selection: list, Selected objects to paste to
+            pose_data: OrderedDict(), The pose to paste
+            by_name: bool, Determines whether the pose will be pasted by name or selection order
+            skip: list, Objects to leave out, e.g. the reference object
+
+        Returns: resolve.Resolution
+
+        """
+
+        with self.phase("resolve"):
+            index = self.name_indices.get(list(pose_data), self.name_rules)
+            resolution = index.resolve(selection, by_name=by_name, skip=skip)
+
+        self.count("matched", len(resolution.matches))
+        self.count("unmatched", len(resolution.unmatched))
+        return resolution
+
+    def source_keys(self, pose_data, keys, mirror=''):
+        """
+        Gets the pose entries to take the matched entries' matrices from. When mirroring, each entry takes the
+        matrix of its opposite side counterpart, so a left control gets the mirrored pose of the right one and vice
+        versa. Controls without a counterpart, like the spine, are mirrored onto themselves.
+
+        Args:
+            pose_data: OrderedDict(), The pose to paste
+            keys: list, Pose entries matched by resolve_names()
+            mirror: str, the axis on which to mirror the pose over
+
+        Returns: list of pose keys
+
+        """
+
+        if not mirror:
+            return list(keys)
+
+        with self.phase("resolve"):
+            mirror_map = self.mirror_maps.get(list(pose_data), self.mirror_rules)
+            sources = [mirror_map.source(key) for key in keys]
+
+        self.count("swapped", sum(1 for key, source in zip(keys, sources) if key != source))
+        return sources
+
+    def source_matrices(self, pose_data, keys, mirror=''):
+        """
+        Gets the saved matrices to paste onto the matched pose entries, see source_keys().
+
+        Args:
+            pose_data: OrderedDict(), The pose to paste
+            keys: list, Pose entries matched by resolve_names()
+            mirror: str, the axis on which to mirror the pose over
+
+        Returns: list of 16 float rows
+
+        """
+
+        return [pose_data[key]["matrix"] for key in self.source_keys(pose_data, keys, mirror)]
+
+    def get_paste_plan(self, selection, pose_data, by_name=True, ref_obj='', mirror=''):
+        """
+        Gets the resolved names, reference object and mirror pairs for a paste. Plans are cached by the pose's keys,
+        the selection and the options, so pasting again onto the same rig skips resolving, whichever pose is pasted.
+
+        Args:
+            selection: list, Selected objects to paste to
+            pose_data: OrderedDict(), The pose to paste
+            by_name: bool, Determines whether the pose will be pasted by name or selection order
+            ref_obj: str, Name of the object to paste pose relative to. This is typically the hip control.
+            mirror: str, the axis on which to mirror the pose over
+
+        Returns: plans.PastePlan
+
+        """
+
+        # Mirror pairs don't depend on the axis
+        key = (tuple(pose_data), tuple(selection), by_name, ref_obj, bool(mirror), self.name_rules.key(),
+               self.mirror_rules.key() if mirror else None)
+
+        with self.phase("resolve"):
+            plan = self.paste_plans.get(key)
+            if plan is not None and not self.plan_valid(plan):
+                plan = None
+
+        if plan is not None:
+            self.count("cached_plan", 1)
+            self.count("matched", len(plan.targets))
+            self.count("unmatched", len(plan.resolution.unmatched))
+            if mirror:
+                self.count("swapped", sum(1 for (_, key), source in zip(plan.resolution.matches, plan.sources)
+                                          if key != source))
+            return plan
+
+        ref_key = None
+        ref_handle = None
+        if ref_obj:
+            ref_key = self.name_indices.get(list(pose_data), self.name_rules).lookup(ref_obj)
+            ref_handle = (self.resolve_handles([ref_obj]) or [None])[0]
+
+        resolution = self.resolve_names(selection, pose_data, by_name=by_name, skip=(ref_obj,))
+        sources = self.source_keys(pose_data, [key for _, key in resolution.matches], mirror)
+
+        with self.phase("resolve"):
+            targets = [obj for obj, _ in resolution.matches]
+            plan = plans.PastePlan(resolution, sources, ref_key=ref_key, handles=self.resolve_handles(targets),
+                                   ref_handle=ref_handle)
+            self.paste_plans.add(key, plan)
+
+        return plan
+
+    def resolve_handles(self, objs):
+        """
+        Looks up scene handles of objects once for a paste plan, so pasting again doesn't look them up by name. DCCs
+        overriding this must clear self.paste_plans whenever the handles could go stale.
+
+        Args:
+            objs: list, Object names
+
+        Returns: list, One handle per object, or None to keep using names
+
+        """
+
+        return None
+
+    def plan_valid(self, plan):
+        """
+        Checks whether a cached plan's handles still point at the nodes it was built for.
+
+        Args:
+            plan: plans.PastePlan, The cached plan
+
+        Returns: bool
+
+        """
+
+        return True
+
+    def get_world_matrices(self, objs):
+        """
+        Gets the current world space matrices of objects. DCCs should override this if get_pose_data() can't be
+        used, e.g. when short names aren't unique.
+
+        Args:
+            objs: list, The objects to query
+
+        Returns: list of 16 float rows
+
+        """
+
+        return [obj_info["matrix"] for obj_info in self.get_pose_data(objs).values()]
+
+    def set_world_matrices(self, objs, matrices, preview=False):
+        """
+        Sets world space matrices of objects.
+
+        TODO: Needs to be overridden per DCC
+
+        Args:
+            objs: list, Objects to set
+            matrices: sequence, 16 float world space matrix per object
+            preview: bool, Write without keying or recording undo, for interactive previews
+
+        Returns: None
+
+        """
+
+        raise NotImplementedError("Setting matrices isn't supported in this DCC")
+
+    def set_blend_matrices(self, objs, matrices, preview=False):
+        """
+        Sets world space matrices written by a PoseBlend. DCCs that prepare the rig for a paste in paste_dcc(), like
+        releasing solvers that pull on the controls, should do the same here.
+
+        Args:
+            objs: list, Objects to set
+            matrices: sequence, 16 float world space matrix per object
+            preview: bool, See set_world_matrices()
+
+        Returns: None
+
+        """
+
+        self.set_world_matrices(objs, matrices, preview=preview)
+
+    def begin_blend(self, filepath="", by_name=True, ref_obj='', mirror=''):
+        """
+        Starts an interactive blend from the selection's current pose towards the specified pose. If no filepath is
+        specified, the clipboard will be used. The pose is resolved, offset and decomposed once here so the returned
+        PoseBlend can be applied at interactive rates.
+
+        Args:
+            filepath: str, The file containing the pose
+            by_name: bool, Determines whether the pose will be pasted by name or selection order
+            ref_obj: str, Name of the object to paste pose relative to. This is typically the hip control.
+            mirror: str, the axis on which to mirror the pose over
+
+        Returns: PoseBlend or None
+
+        """
+
+        selection = self.get_selection()
+        if not selection:
+            print("Could not blend pose. Nothing has been selected")
+            return None
+
+        if mirror and mirror.lower() not in list(const.MIRROR_MAP):
+            print("Invalid mirror kwarg passed. Accepts 'x', 'y', or 'z'")
+            return None
+
+        pose_data = self.deserialize_pose(filepath=filepath)
+        if not pose_data:
+            print("Clipboard is empty. Please select an object and copy the pose again.")
+            return None
+
+        plan = self.get_paste_plan(selection, pose_data, by_name=by_name, ref_obj=ref_obj, mirror=mirror)
+
+        saved_ref_matrix = None
+        curr_ref_matrix = None
+        if ref_obj:
+            if plan.ref_key is None:
+                print("Could not find reference object in pose file. Please select it and save the pose again")
+                return None
+
+            saved_ref_matrix = pose_data[plan.ref_key]["matrix"]
+            curr_ref_matrix = list(self.get_world_matrices([ref_obj])[0])
+
+        if plan.resolution.unmatched:
+            print(plan.resolution.report())
+        if not plan:
+            return None
+
+        pose_matrices = self.compute_paste_matrices(plan.source_matrices(pose_data), saved_ref_matrix=saved_ref_matrix,
+                                                    curr_ref_matrix=curr_ref_matrix, mirror=mirror)
+
+        return PoseBlend(self, plan.targets, self.get_world_matrices(plan.targets), pose_matrices)
+
+    def compute_paste_matrices(self, matrices, saved_ref_matrix=None, curr_ref_matrix=None, mirror=''):
+        """
+        Computes the world space matrices to paste for a batch of saved matrices in one pass. Offsetting by the
+        reference object and mirroring are applied here so each DCC only has to write the results. Mirrored matrices
+        have the local axes named by self.mirror_rules.flip negated.
+
+        Args:
+            matrices: sequence, The saved matrices as an (N, 4, 4) array, 16 float rows or N * 16 flat floats
+            saved_ref_matrix: list, The reference object's matrix from the pose file
+            curr_ref_matrix: list, The reference object's current matrix
+            mirror: str, the axis on which to mirror the pose over
+
+        Returns: sequence of 16 float rows, one per saved matrix
+
+        """
+
+        with self.phase("math"):
+            return pose_math.batch_paste(matrices, saved_ref_matrix=saved_ref_matrix,
+                                         curr_ref_matrix=curr_ref_matrix, mirror=mirror,
+                                         flip=self.mirror_rules.flip if mirror else '')
+
+    def serialize_pose(self, pose_data, filepath="", fmt="", timings=None, encoding=""):
         """
         Writes pose to the specified file. If no filepath is provided, the clipboard will be used.
+        The file is replaced atomically, so readers see either the old or the new pose.
 
         Args:
             pose_data: OrderedDict(), The pose data from get_pose_data()
             filepath: str, The file to write to
+            fmt: str, const.FORMAT_JSON or const.FORMAT_BINARY. Picked from the file extension if not provided.
+            timings: instrument.Timings, The copy being timed. Passed explicitly since this runs on the writer thread.
+            encoding: str, Matrix encoding of binary files, see quantize.py. Defaults to const.POSE_ENCODING.
 
         Returns: bool
 
@@ -165,12 +847,98 @@ class PoseyTemplate(ABC):
         if not filepath:
             filepath = const.CLIPBOARD
 
-        with open(filepath, "w", encoding="ascii") as pose_file:
-            json_obj = json.dumps(pose_data)
-            pose_file.write(json_obj)
+        if not fmt:
+            fmt = pose_io.format_from_path(filepath)
+
+        cache = pose_io.pose_cache()
+        cache.invalidate(filepath)
+
+        with instrument.phase(timings, "serialize"):
+            data = pose_io.encode_pose(pose_data, fmt, encoding)
+
+        with instrument.phase(timings, "io"):
+            stat = pose_io.atomic_write(filepath, data)
+
+        # The next paste of this file can use the pose as it was written, unless it was quantized. Cached against
+        # the written file's stat, so a file another session replaced it with since isn't mistaken for this one.
+        if fmt != const.FORMAT_BINARY or (encoding or const.POSE_ENCODING) == const.ENCODING_FLOAT64:
+            cache.put(filepath, pose_data, stat)
+        return True
+
+
+class PoseBlend:
+    """
+    Blend between the current pose of some controls and a pasted pose, created by PoseyTemplate.begin_blend().
+    Both poses are decomposed into translation, rotation and scale up front, so apply() only interpolates and writes.
+
+    Args:
+        posey: PoseyTemplate, The DCC to write to
+        targets: list, Controls being blended
+        current_matrices: sequence, The controls' world matrices before blending
+        pose_matrices: sequence, The world matrices being blended towards
+    """
+
+    def __init__(self, posey, targets, current_matrices, pose_matrices):
+        self.posey = posey
+        self.targets = targets
+        self.current_matrices = current_matrices
+
+        self.current = pose_math.decompose(current_matrices)
+        self.pose = pose_math.decompose(pose_matrices)
+
+    def matrices(self, weight):
+        """
+        Computes the blended world matrices.
+
+        Args:
+            weight: float or sequence, 0 keeps the current pose, 1 is the full pose. Pass one weight per target for
+                    a partial paste.
+
+        Returns: sequence of 16 float rows
+
+        """
+
+        return pose_math.blend_decomposed(self.current, self.pose, weight)
+
+    def apply(self, weight):
+        """
+        Previews the blend without keying or recording undo.
+
+        Args:
+            weight: float or sequence, See matrices()
+
+        Returns: None
+
+        """
+
+        self.posey.set_blend_matrices(self.targets, self.matrices(weight), preview=True)
+
+    def commit(self, weight):
+        """
+        Writes and keys the blend as a single undoable change from the pose the blend started with.
+
+        Args:
+            weight: float or sequence, See matrices()
+
+        Returns: bool
+
+        """
+
+        self.cancel()
+        self.posey.set_blend_matrices(self.targets, self.matrices(weight))
 
         return True
 
+    def cancel(self):
+        """
+        Restores the pose the blend started with.
+
+        Returns: None
+
+        """
+
+        self.posey.set_blend_matrices(self.targets, self.current_matrices, preview=True)
+
 
 ### FUNCTIONAL ###
 
@@ -0,0 +1,132 @@
+"""
+Parallel reading of pose files
+
+Shared by the batch commands in cli.py and the library scanner in scanner.py. Reading, hashing, parsing and
+building similarity features runs on a process pool, while callers write the results to the library from the main
+process in batches.
+"""
+
+import os
+import struct
+import hashlib
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from . import const
+from . import pose_io
+from . import similarity
+
+POSE_EXTS = (".json", const.BINARY_EXT)
+
+# Files handed to a worker process at a time
+CHUNK_SIZE = 64
+
+
+def find_files(paths, exts=POSE_EXTS):
+    """
+    Finds the pose files in files and folders.
+
+    Args:
+        paths: list, Files and folders. Folders are searched recursively.
+        exts: list, File extensions to look for in folders
+
+    Returns: list of (Path, Path), each file and the folder it was found in
+
+    """
+
+    files = []
+    for path in paths:
+        path = Path(path)
+        if path.is_file():
+            files.append((path, path.parent))
+            continue
+
+        for folder, dirs, names in os.walk(path):
+            dirs.sort()
+            for name in sorted(names):
+                if name.lower().endswith(exts):
+                    files.append((Path(folder, name), path))
+
+    return files
+
+
+def run(func, items, workers=None):
+    """
+    Calls a function on every item, fanned out over a process pool.
+
+    Args:
+        func: callable, A module level function, so it can be sent to the workers
+        items: list, Arguments for func
+        workers: int, Number of processes. Defaults to the number of CPUs, 1 runs everything in this process.
+
+    Returns: iterator, The results in the order of items
+
+    """
+
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(items) < 2:
+        yield from map(func, items)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(items))) as executor:
+        yield from executor.map(func, items, chunksize=CHUNK_SIZE)
+
+
+def load_file(filepath, keep_pose=False, features=True):
+    """
+    Reads, hashes, validates and extracts the similarity features of a pose file. Runs in a worker process.
+
+    Args:
+        filepath: str, The pose file
+        keep_pose: bool, Return the pose data too. Left out otherwise to save sending it between processes.
+        features: bool, Build the pose's similarity features
+
+    Returns: dict, "filepath", "problems", and "hash", "features" and "pose" for valid files
+
+    """
+
+    result = {"filepath": str(filepath), "problems": []}
+
+    try:
+        with open(filepath, "rb") as pose_file:
+            buffer = pose_file.read()
+        pose_data = pose_io.decode_pose(buffer)
+    except (OSError, ValueError, struct.error) as e:
+        result["problems"].append(str(e))
+        return result
+
+    result["problems"] = pose_io.validate_pose(pose_data)
+    if result["problems"]:
+        return result
+
+    # Same as pose_io.content_hash(), without reading the file again
+    result["hash"] = hashlib.sha1(buffer).hexdigest()
+    if features:
+        result["features"] = similarity.pack_features(*similarity.pose_features(pose_data))
+    if keep_pose:
+        result["pose"] = pose_data
+
+    return result
+
+
+def batches(results, size=const.BATCH_SIZE):
+    """
+    Groups results so each group can be written to the library in one transaction.
+
+    Args:
+        results: iterator
+        size: int, Results per group
+
+    Returns: iterator of lists
+
+    """
+
+    batch = []
+    for result in results:
+        batch.append(result)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
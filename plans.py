@@ -0,0 +1,107 @@
+"""
+Paste plans
+
+Before writing anything, a paste matches the selection to the pose's entries, looks up the reference object, pairs
+mirrored controls and finds the scene nodes to write. None of that depends on the pose's matrices, so it's compiled
+into a PastePlan once and reused while the same rig and selection are pasted onto, whichever pose is pasted:
+
+    key             the pose's keys, the selection, the paste options and the naming and mirror rules
+    names           always valid, since they only depend on the key
+    handles         scene nodes resolved by the DCC, e.g. Maya DAG paths. The DCC clears the cache when the scene
+                    changes in a way that could make them stale, like opening a scene or renaming, reparenting or
+                    deleting nodes.
+"""
+
+from collections import OrderedDict
+
+
+class PastePlan:
+    """
+    Everything a paste needs besides the pose's matrices.
+
+    Attributes:
+        resolution: resolve.Resolution, The selection matched to the pose
+        targets: list, Scene nodes to paste to in selection order
+        sources: list, Pose key to take each target's matrix from, the opposite side's when mirroring
+        ref_key: str, The reference object's pose key, None if it isn't in the pose
+        handles: list, DCC handles of the targets, or None to look them up by name
+        ref_handle: DCC handle of the reference object, or None
+    """
+
+    def __init__(self, resolution, sources, ref_key=None, handles=None, ref_handle=None):
+        self.resolution = resolution
+        self.targets = [obj for obj, _ in resolution.matches]
+        self.sources = sources
+        self.ref_key = ref_key
+        self.handles = handles
+        self.ref_handle = ref_handle
+
+    def __bool__(self):
+        return bool(self.targets)
+
+    def source_matrices(self, pose_data):
+        """
+        Args:
+            pose_data: OrderedDict(), The pose to paste. Must have the keys the plan was built for.
+
+        Returns: list of 16 float rows, one per target
+
+        """
+
+        return [pose_data[key]["matrix"] for key in self.sources]
+
+
+class PastePlanCache:
+    """
+    Keeps the most recently used paste plans.
+
+    Args:
+        limit: int, Number of plans kept
+    """
+
+    def __init__(self, limit=16):
+        self.limit = limit
+        self.plans = OrderedDict()
+
+    def __len__(self):
+        return len(self.plans)
+
+    def get(self, key):
+        """
+        Args:
+            key: tuple, See PoseyTemplate.get_paste_plan()
+
+        Returns: PastePlan or None
+
+        """
+
+        plan = self.plans.get(key)
+        if plan is not None:
+            self.plans.move_to_end(key)
+
+        return plan
+
+    def add(self, key, plan):
+        """
+        Args:
+            key: tuple, See PoseyTemplate.get_paste_plan()
+            plan: PastePlan, The plan to keep
+
+        Returns: None
+
+        """
+
+        self.plans[key] = plan
+        self.plans.move_to_end(key)
+        while len(self.plans) > self.limit:
+            self.plans.popitem(last=False)
+
+    def clear(self, *args):
+        """
+        Drops every plan. Extra arguments are ignored so this can be registered as a DCC callback directly.
+
+        Returns: None
+
+        """
+
+        self.plans.clear()
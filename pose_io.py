@@ -0,0 +1,691 @@
+"""
+Reading and writing pose files
+
+Poses can be stored as JSON (the interchange format) or as a compact binary file. The binary layout is:
+
+    header    struct HEADER_FMT: magic, version, flags, control count, name table size, matrix block offset
+    params    version 2 only, the matrix encoding's quantize.PARAMS_FMT parameters
+    names     utf-8 control names separated by NUL bytes
+    padding   zero bytes up to an 8 byte boundary
+    matrices  count * 16 little-endian float64 values, one row major 4x4 matrix per control
+
+Keeping the matrices in one contiguous block means the file can be memory-mapped and read without copying.
+Version 2 files store the matrix block in one of the compact encodings in quantize.py, named by the header flags,
+and are decoded on load.
+
+Files are written to a temporary file next to the destination and renamed over it, so a crash mid-write never
+leaves a truncated pose behind and readers never need a lock. Writers in a folder shared by several sessions take
+an advisory lock on the folder's const.LOCK_NAME file first. BackgroundWriter moves that work off the DCC's main
+thread.
+"""
+
+import os
+import sys
+import json
+import math
+import mmap
+import struct
+import time
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from collections import OrderedDict
+
+from . import const
+from . import quantize
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+MAGIC      = b"PSYB"
+VERSION    = 2
+HEADER_FMT = "<4sHHIIQ"
+HEADER_LEN = struct.calcsize(HEADER_FMT)
+MATRIX_LEN = 16
+
+
+def format_from_path(filepath):
+    """
+    Picks a pose format from the file extension.
+
+    Args:
+        filepath: str, The pose file
+
+    Returns: str
+
+    """
+
+    if Path(filepath).suffix.lower() == const.BINARY_EXT:
+        return const.FORMAT_BINARY
+
+    return const.FORMAT_JSON
+
+
+def detect_format(filepath):
+    """
+    Detects the format of an existing pose file by checking its magic bytes.
+
+    Args:
+        filepath: str, The pose file
+
+    Returns: str
+
+    """
+
+    with open(filepath, "rb") as pose_file:
+        magic = pose_file.read(len(MAGIC))
+
+    if magic == MAGIC:
+        return const.FORMAT_BINARY
+
+    return const.FORMAT_JSON
+
+
+class FileLock:
+    """
+    Advisory lock shared between processes, held on a lock file. Only other FileLocks wait for it.
+
+    Args:
+        path: str, The lock file. Created if needed and left in place afterwards.
+        timeout: float, Seconds to wait for the lock before raising TimeoutError
+    """
+
+    def __init__(self, path, timeout=const.LOCK_TIMEOUT):
+        self.path = str(path)
+        self.timeout = timeout
+        self.file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def _try_lock(self):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+
+        return True
+
+    def acquire(self):
+        """
+        Returns: None
+
+        """
+
+        self.file = open(self.path, "a+b")
+
+        deadline = time.monotonic() + self.timeout
+        delay = 0.001
+        while not self._try_lock():
+            if time.monotonic() > deadline:
+                self.file.close()
+                self.file = None
+                raise TimeoutError(f"Timed out waiting for lock {self.path}")
+
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+    def release(self):
+        """
+        Returns: None
+
+        """
+
+        if self.file is None:
+            return
+
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+
+        self.file.close()
+        self.file = None
+
+
+def folder_lock(filepath, timeout=const.LOCK_TIMEOUT):
+    """
+    Gets the lock guarding writes to the folder a file is in.
+
+    Args:
+        filepath: str, A file in the folder
+        timeout: float, Seconds to wait for the lock
+
+    Returns: FileLock
+
+    """
+
+    return FileLock(Path(filepath).parent / const.LOCK_NAME, timeout=timeout)
+
+
+def atomic_write(filepath, data, mode="wb", encoding=None, lock=True):
+    """
+    Writes a file by writing a temporary file in the same directory and renaming it over the destination.
+
+    Args:
+        filepath: str, The file to write
+        data: bytes or str, The file contents
+        mode: str, "wb" or "w"
+        encoding: str, Text encoding when mode is "w"
+        lock: bool, Hold the folder's lock while the file is moved into place, so sessions sharing the folder
+                    take turns
+
+    Returns: os.stat_result, The written file's, taken before it was moved into place
+
+    """
+
+    filepath = Path(filepath)
+    fd, tmp_path = tempfile.mkstemp(dir=str(filepath.parent), prefix=f".{filepath.name}.", suffix=".tmp")
+    try:
+        with open(fd, mode, encoding=encoding) as tmp_file:
+            tmp_file.write(data)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+            stat = os.fstat(tmp_file.fileno())
+
+        if lock:
+            with folder_lock(filepath):
+                os.replace(tmp_path, str(filepath))
+        else:
+            os.replace(tmp_path, str(filepath))
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    return stat
+
+
+def encode_pose(pose_data, fmt=const.FORMAT_JSON, encoding=""):
+    """
+    Encodes pose data into the contents of a pose file.
+
+    Args:
+        pose_data: OrderedDict(), The pose data from get_pose_data()
+        fmt: str, const.FORMAT_JSON or const.FORMAT_BINARY
+        encoding: str, Matrix encoding of binary files, see quantize.py. Defaults to const.POSE_ENCODING.
+
+    Returns: bytes
+
+    """
+
+    if fmt == const.FORMAT_BINARY:
+        names = list(pose_data)
+        return pack_binary(names, [value for name in names for value in pose_data[name]["matrix"]],
+                           encoding=encoding)
+
+    return json.dumps(pose_data).encode("ascii")
+
+
+def decode_pose(buffer):
+    """
+    Decodes the contents of a pose file in either format, detected from its magic bytes.
+
+    Args:
+        buffer: bytes-like, The contents of a pose file
+
+    Returns: OrderedDict()
+
+    """
+
+    if bytes(buffer[:len(MAGIC)]) == MAGIC:
+        return pose_from_block(*unpack_binary(buffer))
+
+    return json.loads(bytes(buffer).decode("ascii"), object_pairs_hook=OrderedDict)
+
+
+def read_pose(filepath):
+    """
+    Reads a pose file in either format.
+
+    Args:
+        filepath: str, The pose file
+
+    Returns: OrderedDict()
+
+    """
+
+    with open(filepath, "rb") as pose_file:
+        return decode_pose(pose_file.read())
+
+
+def content_hash(filepath):
+    """
+    Hashes the contents of a file.
+
+    Args:
+        filepath: str, The file to hash
+
+    Returns: str
+
+    """
+
+    digest = hashlib.sha1()
+    with open(filepath, "rb") as pose_file:
+        for chunk in iter(lambda: pose_file.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def validate_pose(pose_data):
+    """
+    Checks that a pose has the structure get_pose_data() produces.
+
+    Args:
+        pose_data: dict, A decoded pose
+
+    Returns: list, Problems found, empty if the pose is valid
+
+    """
+
+    if not isinstance(pose_data, dict):
+        return ["Pose isn't a mapping of control names"]
+
+    if not pose_data:
+        return ["Pose has no controls"]
+
+    problems = []
+    for name, obj_info in pose_data.items():
+        matrix = obj_info.get("matrix") if isinstance(obj_info, dict) else None
+        if not isinstance(matrix, (list, tuple)) or len(matrix) != MATRIX_LEN:
+            problems.append(f"{name}: matrix doesn't have {MATRIX_LEN} values")
+        elif not all(isinstance(value, (int, float)) and math.isfinite(value) for value in matrix):
+            problems.append(f"{name}: matrix has values that aren't finite numbers")
+
+    return problems
+
+
+def write_json(filepath, pose_data):
+    """
+    Writes pose data to a JSON file.
+
+    Args:
+        filepath: str, The file to write to
+        pose_data: OrderedDict(), The pose data from get_pose_data()
+
+    Returns: bool
+
+    """
+
+    atomic_write(filepath, encode_pose(pose_data, const.FORMAT_JSON))
+
+    return True
+
+
+def read_json(filepath):
+    """
+    Reads pose data from a JSON file.
+
+    Args:
+        filepath: str, The pose file
+
+    Returns: OrderedDict()
+
+    """
+
+    with open(filepath, "r", encoding="ascii") as pose_file:
+        return json.loads(pose_file.read(), object_pairs_hook=OrderedDict)
+
+
+def pack_binary(names, matrices, encoding="", tolerance=const.QUANT_TOLERANCE):
+    """
+    Packs control names and their matrices into the binary pose layout.
+
+    Args:
+        names: list, Control names
+        matrices: list, Flat sequence of len(names) * 16 floats
+        encoding: str, Matrix encoding, see quantize.py. Defaults to const.POSE_ENCODING.
+        tolerance: float, Largest matrix element error allowed by the encoding before float64 is used instead
+
+    Returns: bytes
+
+    """
+
+    if len(matrices) != len(names) * MATRIX_LEN:
+        raise ValueError(f"Expected {len(names) * MATRIX_LEN} matrix values, got {len(matrices)}")
+
+    block_encoding, matrix_block = quantize.encode_checked(matrices, encoding or const.POSE_ENCODING, tolerance)
+    params = block_encoding.params()
+
+    # Plain float64 files stay readable by version 1 readers
+    version = VERSION if params else 1
+
+    name_table = b"\0".join(name.encode("utf-8") for name in names)
+    matrix_offset = HEADER_LEN + len(params) + len(name_table)
+    padding = -matrix_offset % 8
+    matrix_offset += padding
+
+    header = struct.pack(HEADER_FMT, MAGIC, version, block_encoding.flags if params else 0, len(names),
+                         len(name_table), matrix_offset)
+
+    return b"".join((header, params, name_table, b"\0" * padding, matrix_block))
+
+
+def unpack_binary(buffer):
+    """
+    Splits a binary pose buffer into control names and a flat view over its matrices. When the platform is
+    little-endian the float64 matrices are a memoryview over the buffer itself, so no data is copied. Encoded
+    matrices are decoded into a list.
+
+    Args:
+        buffer: bytes-like, The contents of a binary pose file
+
+    Returns: tuple(list, sequence)
+
+    """
+
+    view = memoryview(buffer)
+    if len(view) < HEADER_LEN:
+        raise ValueError("Pose file is truncated")
+
+    magic, version, flags, count, names_len, matrix_offset = struct.unpack_from(HEADER_FMT, view)
+    if magic != MAGIC:
+        raise ValueError("Not a binary pose file")
+    if version > VERSION:
+        raise ValueError(f"Unsupported binary pose version {version}")
+
+    encoding, params_len = quantize.Encoding(), 0
+    if version >= 2:
+        encoding, params_len = quantize.Encoding.from_header(flags, view, HEADER_LEN)
+
+    matrix_end = matrix_offset + count * encoding.record_size
+    if len(view) < matrix_end:
+        raise ValueError("Pose file is truncated")
+
+    names_start = HEADER_LEN + params_len
+    name_table = bytes(view[names_start:names_start + names_len])
+    names = [name.decode("utf-8") for name in name_table.split(b"\0")] if count else []
+
+    if encoding.kind != quantize.FLOAT64:
+        matrices = encoding.decode(view[matrix_offset:matrix_end], count)
+    elif sys.byteorder == "little":
+        matrices = view[matrix_offset:matrix_end].cast("d")
+    else:
+        matrices = struct.unpack_from(f"<{count * MATRIX_LEN}d", view, matrix_offset)
+
+    return names, matrices
+
+
+def write_binary(filepath, pose_data, encoding=""):
+    """
+    Writes pose data to a binary pose file. Only the "matrix" entry of each control is stored.
+
+    Args:
+        filepath: str, The file to write to
+        pose_data: OrderedDict(), The pose data from get_pose_data()
+        encoding: str, Matrix encoding, see quantize.py. Defaults to const.POSE_ENCODING.
+
+    Returns: bool
+
+    """
+
+    atomic_write(filepath, encode_pose(pose_data, const.FORMAT_BINARY, encoding))
+
+    return True
+
+
+def read_binary_block(filepath, use_mmap=True):
+    """
+    Reads a binary pose file into control names and a flat matrix sequence without building per-control dicts.
+    With use_mmap the file is memory-mapped and the returned matrices reference the mapping directly.
+
+    Args:
+        filepath: str, The pose file
+        use_mmap: bool, Memory-map the file instead of reading it
+
+    Returns: tuple(list, sequence)
+
+    """
+
+    with open(filepath, "rb") as pose_file:
+        if not use_mmap:
+            return unpack_binary(pose_file.read())
+
+        try:
+            buffer = mmap.mmap(pose_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped
+            raise ValueError("Pose file is truncated")
+
+    return unpack_binary(buffer)
+
+
+def read_binary(filepath, use_mmap=False):
+    """
+    Reads a binary pose file into the same OrderedDict() structure as the JSON format.
+
+    Args:
+        filepath: str, The pose file
+        use_mmap: bool, Memory-map the file instead of reading it
+
+    Returns: OrderedDict()
+
+    """
+
+    return pose_from_block(*read_binary_block(filepath, use_mmap=use_mmap))
+
+
+def pose_from_block(names, matrices):
+    """
+    Builds the OrderedDict() pose structure from control names and a flat matrix sequence.
+
+    Args:
+        names: list, Control names
+        matrices: sequence, Flat len(names) * 16 floats
+
+    Returns: OrderedDict()
+
+    """
+
+    pose_data = OrderedDict()
+    for i, name in enumerate(names):
+        pose_data[name] = {"matrix": list(matrices[i * MATRIX_LEN:(i + 1) * MATRIX_LEN])}
+
+    return pose_data
+
+
+class BackgroundWriter:
+    """
+    Runs pose writes on a single background thread, in the order they were submitted. Readers call wait() first
+    so they never see a file that's still being written.
+    """
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{const.TOOL_NAME}Writer")
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def submit(self, filepath, func, *args, **kwargs):
+        """
+        Queues a write.
+
+        Args:
+            filepath: str, The file being written, used by wait()
+            func: callable, Does the writing
+            *args: Passed to func
+            **kwargs: Passed to func
+
+        Returns: concurrent.futures.Future
+
+        """
+
+        key = str(Path(filepath).resolve())
+        future = self.executor.submit(func, *args, **kwargs)
+
+        with self.lock:
+            self.pending[key] = future
+        future.add_done_callback(lambda done: self._discard(key, done))
+
+        return future
+
+    def _discard(self, key, future):
+        with self.lock:
+            if self.pending.get(key) is future:
+                del self.pending[key]
+
+    def wait(self, filepath=None):
+        """
+        Blocks until queued writes are done.
+
+        Args:
+            filepath: str, Only wait for writes to this file
+
+        Returns: None
+
+        """
+
+        with self.lock:
+            if filepath is None:
+                futures = list(self.pending.values())
+            else:
+                future = self.pending.get(str(Path(filepath).resolve()))
+                futures = [future] if future else []
+
+        for future in futures:
+            # Errors are reported to whoever submitted the write
+            future.exception()
+
+
+_writer = None
+
+
+def background_writer():
+    """
+    Gets the writer shared by every Posey instance, so writes to the same file stay in order.
+
+    Returns: BackgroundWriter
+
+    """
+
+    global _writer
+    if _writer is None:
+        _writer = BackgroundWriter()
+
+    return _writer
+
+
+class PoseCache:
+    """
+    Bounded LRU of parsed poses keyed by path and validated against the file's mtime and size, so pasting the
+    same pose repeatedly skips disk and parsing. Cached poses are shared, treat them as read-only.
+
+    Args:
+        limit: int, Number of poses kept
+    """
+
+    def __init__(self, limit=const.POSE_CACHE_SIZE):
+        self.limit = limit
+        self.poses = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _stat(filepath):
+        stat = os.stat(filepath)
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, filepath):
+        """
+        Gets a parsed pose if the file hasn't changed since it was cached.
+
+        Args:
+            filepath: str, The pose file
+
+        Returns: OrderedDict() or None
+
+        """
+
+        key = str(Path(filepath).resolve())
+        with self.lock:
+            entry = self.poses.get(key)
+        if entry is None:
+            return None
+
+        try:
+            if self._stat(key) != entry[0]:
+                self.invalidate(key)
+                return None
+        except OSError:
+            self.invalidate(key)
+            return None
+
+        with self.lock:
+            if key in self.poses:
+                self.poses.move_to_end(key)
+
+        return entry[1]
+
+    def put(self, filepath, pose_data, stat):
+        """
+        Caches a parsed pose against the mtime and size of the file it was read from or written to.
+
+        Args:
+            filepath: str, The pose file
+            pose_data: OrderedDict(), The parsed pose
+            stat: os.stat_result, os.fstat() of the file taken before reading it, or what atomic_write() returned.
+                  Stating the path afterwards could pair the old contents with a newer file's stat.
+
+        Returns: None
+
+        """
+
+        key = str(Path(filepath).resolve())
+        stat = stat.st_mtime_ns, stat.st_size
+
+        with self.lock:
+            self.poses[key] = (stat, pose_data)
+            self.poses.move_to_end(key)
+            while len(self.poses) > self.limit:
+                self.poses.popitem(last=False)
+
+    def invalidate(self, filepath=None):
+        """
+        Drops a cached pose, or every cached pose if no filepath is given.
+
+        Args:
+            filepath: str, The pose file
+
+        Returns: None
+
+        """
+
+        with self.lock:
+            if filepath is None:
+                self.poses.clear()
+            else:
+                self.poses.pop(str(Path(filepath).resolve()), None)
+
+
+_cache = None
+
+
+def pose_cache():
+    """
+    Gets the parsed pose cache shared by every Posey instance.
+
+    Returns: PoseCache
+
+    """
+
+    global _cache
+    if _cache is None:
+        _cache = PoseCache()
+
+    return _cache
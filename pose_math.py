@@ -0,0 +1,504 @@
+"""
+DCC agnostic matrix math used when pasting poses
+
+Matrices are row major 4x4 matrices stored as 16 floats, the same layout Maya's worldMatrix uses, and are
+multiplied as row vectors (child * parent). Batched functions accept any of a flat sequence of N * 16 floats,
+a list of 16 float rows or an (N, 4, 4) / (N, 16) array. NumPy is used when it's available, otherwise the
+pure-Python fallback gives the same results.
+"""
+
+import math
+
+from . import const
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+IDENTITY = (1.0, 0.0, 0.0, 0.0,
+            0.0, 1.0, 0.0, 0.0,
+            0.0, 0.0, 1.0, 0.0,
+            0.0, 0.0, 0.0, 1.0)
+
+
+def has_numpy():
+    """
+    Returns: bool, True if NumPy is available
+
+    """
+
+    return numpy is not None
+
+
+def multiply(a, b):
+    """
+    Multiplies two row major 4x4 matrices.
+
+    Args:
+        a: sequence, 16 floats
+        b: sequence, 16 floats
+
+    Returns: list
+
+    """
+
+    return [a[r * 4] * b[c] + a[r * 4 + 1] * b[4 + c] + a[r * 4 + 2] * b[8 + c] + a[r * 4 + 3] * b[12 + c]
+            for r in range(4) for c in range(4)]
+
+
+def inverse(m):
+    """
+    Inverts a 4x4 matrix using cofactor expansion.
+
+    Args:
+        m: sequence, 16 floats
+
+    Returns: list
+
+    """
+
+    inv = [0.0] * 16
+    inv[0] = (m[5] * m[10] * m[15] - m[5] * m[11] * m[14] - m[9] * m[6] * m[15]
+              + m[9] * m[7] * m[14] + m[13] * m[6] * m[11] - m[13] * m[7] * m[10])
+    inv[4] = (-m[4] * m[10] * m[15] + m[4] * m[11] * m[14] + m[8] * m[6] * m[15]
+              - m[8] * m[7] * m[14] - m[12] * m[6] * m[11] + m[12] * m[7] * m[10])
+    inv[8] = (m[4] * m[9] * m[15] - m[4] * m[11] * m[13] - m[8] * m[5] * m[15]
+              + m[8] * m[7] * m[13] + m[12] * m[5] * m[11] - m[12] * m[7] * m[9])
+    inv[12] = (-m[4] * m[9] * m[14] + m[4] * m[10] * m[13] + m[8] * m[5] * m[14]
+               - m[8] * m[6] * m[13] - m[12] * m[5] * m[10] + m[12] * m[6] * m[9])
+    inv[1] = (-m[1] * m[10] * m[15] + m[1] * m[11] * m[14] + m[9] * m[2] * m[15]
+              - m[9] * m[3] * m[14] - m[13] * m[2] * m[11] + m[13] * m[3] * m[10])
+    inv[5] = (m[0] * m[10] * m[15] - m[0] * m[11] * m[14] - m[8] * m[2] * m[15]
+              + m[8] * m[3] * m[14] + m[12] * m[2] * m[11] - m[12] * m[3] * m[10])
+    inv[9] = (-m[0] * m[9] * m[15] + m[0] * m[11] * m[13] + m[8] * m[1] * m[15]
+              - m[8] * m[3] * m[13] - m[12] * m[1] * m[11] + m[12] * m[3] * m[9])
+    inv[13] = (m[0] * m[9] * m[14] - m[0] * m[10] * m[13] - m[8] * m[1] * m[14]
+               + m[8] * m[2] * m[13] + m[12] * m[1] * m[10] - m[12] * m[2] * m[9])
+    inv[2] = (m[1] * m[6] * m[15] - m[1] * m[7] * m[14] - m[5] * m[2] * m[15]
+              + m[5] * m[3] * m[14] + m[13] * m[2] * m[7] - m[13] * m[3] * m[6])
+    inv[6] = (-m[0] * m[6] * m[15] + m[0] * m[7] * m[14] + m[4] * m[2] * m[15]
+              - m[4] * m[3] * m[14] - m[12] * m[2] * m[7] + m[12] * m[3] * m[6])
+    inv[10] = (m[0] * m[5] * m[15] - m[0] * m[7] * m[13] - m[4] * m[1] * m[15]
+               + m[4] * m[3] * m[13] + m[12] * m[1] * m[7] - m[12] * m[3] * m[5])
+    inv[14] = (-m[0] * m[5] * m[14] + m[0] * m[6] * m[13] + m[4] * m[1] * m[14]
+               - m[4] * m[2] * m[13] - m[12] * m[1] * m[6] + m[12] * m[2] * m[5])
+    inv[3] = (-m[1] * m[6] * m[11] + m[1] * m[7] * m[10] + m[5] * m[2] * m[11]
+              - m[5] * m[3] * m[10] - m[9] * m[2] * m[7] + m[9] * m[3] * m[6])
+    inv[7] = (m[0] * m[6] * m[11] - m[0] * m[7] * m[10] - m[4] * m[2] * m[11]
+              + m[4] * m[3] * m[10] + m[8] * m[2] * m[7] - m[8] * m[3] * m[6])
+    inv[11] = (-m[0] * m[5] * m[11] + m[0] * m[7] * m[9] + m[4] * m[1] * m[11]
+               - m[4] * m[3] * m[9] - m[8] * m[1] * m[7] + m[8] * m[3] * m[5])
+    inv[15] = (m[0] * m[5] * m[10] - m[0] * m[6] * m[9] - m[4] * m[1] * m[10]
+               + m[4] * m[2] * m[9] + m[8] * m[1] * m[6] - m[8] * m[2] * m[5])
+
+    det = m[0] * inv[0] + m[1] * inv[4] + m[2] * inv[8] + m[3] * inv[12]
+    if det == 0:
+        raise ValueError("Matrix is singular and can't be inverted")
+
+    return [value / det for value in inv]
+
+
+def reflection(axis):
+    """
+    Builds a matrix that mirrors across the given axis.
+
+    Args:
+        axis: str, 'x', 'y' or 'z'
+
+    Returns: list
+
+    """
+
+    result = list(IDENTITY)
+    idx = const.MIRROR_MAP[axis.lower()]
+    result[idx * 4 + idx] = -1.0
+
+    return result
+
+
+def flip_matrix(flip, mirror):
+    """
+    Builds the matrix that negates local axes of mirrored controls, see symmetry.MirrorRules.
+
+    Args:
+        flip: str, "world", "behavior", "x", "y", "z" or ""
+        mirror: str, the axis the pose is mirrored over
+
+    Returns: list, or None if nothing is flipped
+
+    """
+
+    if not flip or not mirror:
+        return None
+
+    if flip == "world":
+        return reflection(mirror)
+
+    if flip == "behavior":
+        result = list(IDENTITY)
+        for idx in range(3):
+            result[idx * 4 + idx] = -1.0
+        return result
+
+    return reflection(flip)
+
+
+def to_rows(matrices):
+    """
+    Normalizes a batch of matrices into a list of 16 float rows for the pure-Python path.
+
+    Args:
+        matrices: sequence, Flat N * 16 floats, 16 float rows or an (N, 4, 4) array
+
+    Returns: list
+
+    """
+
+    if numpy is not None and isinstance(matrices, numpy.ndarray):
+        return matrices.reshape(-1, 16).tolist()
+
+    if not len(matrices):
+        return []
+
+    if isinstance(matrices[0], (int, float)):
+        return [list(matrices[i:i + 16]) for i in range(0, len(matrices), 16)]
+
+    return [list(row) for row in matrices]
+
+
+def batch_multiply(matrices, matrix, use_numpy=True):
+    """
+    Multiplies every matrix of a batch by the same matrix, e.g. to move local matrices into their parent's space.
+
+    Args:
+        matrices: sequence, The batch. See module docstring for accepted layouts.
+        matrix: sequence, 16 floats multiplied on the right of every matrix
+        use_numpy: bool, Use NumPy if it's available
+
+    Returns: (N, 16) numpy.ndarray or list of 16 float rows
+
+    """
+
+    if use_numpy and numpy is not None:
+        batch = numpy.asarray(matrices, dtype=numpy.float64).reshape(-1, 4, 4)
+        return (batch @ numpy.asarray(matrix, dtype=numpy.float64).reshape(4, 4)).reshape(-1, 16)
+
+    return [multiply(row, matrix) for row in to_rows(matrices)]
+
+
+def paste_post_matrix(saved_ref_matrix=None, curr_ref_matrix=None, mirror=''):
+    """
+    Collapses the reference offset and reflection into the single matrix every saved matrix is multiplied by.
+
+        result = saved * inverse(saved_ref) * reflection * curr_ref
+
+    Args:
+        saved_ref_matrix: sequence, The reference object's matrix from the pose file
+        curr_ref_matrix: sequence, The reference object's current matrix
+        mirror: str, the axis on which to mirror the pose over
+
+    Returns: list, or None if the pose is pasted unchanged
+
+    """
+
+    post = None
+    if saved_ref_matrix is not None:
+        post = inverse(saved_ref_matrix)
+
+    if mirror:
+        post = reflection(mirror) if post is None else multiply(post, reflection(mirror))
+
+    if saved_ref_matrix is not None:
+        post = multiply(post, curr_ref_matrix)
+
+    return post
+
+
+def batch_paste(matrices, saved_ref_matrix=None, curr_ref_matrix=None, mirror='', use_numpy=True, flip=''):
+    """
+    Computes the pasted matrix of every saved matrix in a single pass. Mirrored matrices also have their local axes
+    flipped so they stay right-handed:
+
+        result = flip * saved * inverse(saved_ref) * reflection * curr_ref
+
+    Args:
+        matrices: sequence, The saved matrices. See module docstring for accepted layouts.
+        saved_ref_matrix: sequence, The reference object's matrix from the pose file
+        curr_ref_matrix: sequence, The reference object's current matrix
+        mirror: str, the axis on which to mirror the pose over
+        use_numpy: bool, Use NumPy if it's available
+        flip: str, Local axes to negate when mirroring, see flip_matrix()
+
+    Returns: (N, 16) numpy.ndarray or list of 16 float rows
+
+    """
+
+    if (saved_ref_matrix is None) != (curr_ref_matrix is None):
+        raise ValueError("Both the saved and current reference matrices are needed to paste relative to an object")
+
+    post = paste_post_matrix(saved_ref_matrix, curr_ref_matrix, mirror)
+    pre = flip_matrix(flip, mirror)
+
+    if use_numpy and numpy is not None:
+        batch = numpy.asarray(matrices, dtype=numpy.float64).reshape(-1, 4, 4)
+        if pre is not None:
+            batch = numpy.asarray(pre, dtype=numpy.float64).reshape(4, 4) @ batch
+        if post is not None:
+            batch = batch @ numpy.asarray(post, dtype=numpy.float64).reshape(4, 4)
+        return batch.reshape(-1, 16)
+
+    rows = to_rows(matrices)
+    if pre is not None:
+        rows = [multiply(pre, row) for row in rows]
+    if post is None:
+        return rows
+
+    return [multiply(row, post) for row in rows]
+
+
+def decompose_matrix(m):
+    """
+    Splits a matrix into translation, rotation quaternion (x, y, z, w) and scale. Shear is ignored and negative
+    determinants are put into the x scale.
+
+    Args:
+        m: sequence, 16 floats
+
+    Returns: tuple(list, list, list)
+
+    """
+
+    rows = [m[0:3], m[4:7], m[8:11]]
+    scale = [math.sqrt(sum(value * value for value in row)) for row in rows]
+
+    det = (rows[0][0] * (rows[1][1] * rows[2][2] - rows[1][2] * rows[2][1])
+           - rows[0][1] * (rows[1][0] * rows[2][2] - rows[1][2] * rows[2][0])
+           + rows[0][2] * (rows[1][0] * rows[2][1] - rows[1][1] * rows[2][0]))
+    if det < 0:
+        scale[0] = -scale[0]
+
+    r = [[value / scale[i] if scale[i] else 0.0 for value in row] for i, row in enumerate(rows)]
+
+    # Row vector matrices are the transpose of the usual column vector rotation, hence r[col][row] below
+    trace = r[0][0] + r[1][1] + r[2][2]
+    if trace > 0:
+        k = 0.5 / math.sqrt(trace + 1.0)
+        quat = [(r[1][2] - r[2][1]) * k, (r[2][0] - r[0][2]) * k, (r[0][1] - r[1][0]) * k, 0.25 / k]
+    elif r[0][0] > r[1][1] and r[0][0] > r[2][2]:
+        k = 2.0 * math.sqrt(max(1.0 + r[0][0] - r[1][1] - r[2][2], 0.0))
+        quat = [0.25 * k, (r[1][0] + r[0][1]) / k, (r[2][0] + r[0][2]) / k, (r[1][2] - r[2][1]) / k]
+    elif r[1][1] > r[2][2]:
+        k = 2.0 * math.sqrt(max(1.0 + r[1][1] - r[0][0] - r[2][2], 0.0))
+        quat = [(r[1][0] + r[0][1]) / k, 0.25 * k, (r[2][1] + r[1][2]) / k, (r[2][0] - r[0][2]) / k]
+    else:
+        k = 2.0 * math.sqrt(max(1.0 + r[2][2] - r[0][0] - r[1][1], 0.0))
+        quat = [(r[2][0] + r[0][2]) / k, (r[2][1] + r[1][2]) / k, 0.25 * k, (r[0][1] - r[1][0]) / k]
+
+    return list(m[12:15]), quat, scale
+
+
+def compose_matrix(translation, quat, scale):
+    """
+    Builds a matrix from translation, rotation quaternion (x, y, z, w) and scale.
+
+    Args:
+        translation: sequence, 3 floats
+        quat: sequence, 4 floats
+        scale: sequence, 3 floats
+
+    Returns: list
+
+    """
+
+    x, y, z, w = quat
+    rows = [[1 - 2 * (y * y + z * z), 2 * (x * y + z * w), 2 * (x * z - y * w)],
+            [2 * (x * y - z * w), 1 - 2 * (x * x + z * z), 2 * (y * z + x * w)],
+            [2 * (x * z + y * w), 2 * (y * z - x * w), 1 - 2 * (x * x + y * y)]]
+
+    result = []
+    for row, axis_scale in zip(rows, scale):
+        result.extend([value * axis_scale for value in row] + [0.0])
+    result.extend(list(translation) + [1.0])
+
+    return result
+
+
+def slerp(q0, q1, weight):
+    """
+    Spherically interpolates between two unit quaternions along the shortest path.
+
+    Args:
+        q0: sequence, 4 floats
+        q1: sequence, 4 floats
+        weight: float, 0 returns q0, 1 returns q1
+
+    Returns: list
+
+    """
+
+    dot = sum(a * b for a, b in zip(q0, q1))
+    if dot < 0:
+        q1 = [-value for value in q1]
+        dot = -dot
+
+    if dot > 0.9995:
+        # Nearly identical, a normalized lerp is accurate and avoids dividing by sin(0)
+        result = [a + (b - a) * weight for a, b in zip(q0, q1)]
+        length = math.sqrt(sum(value * value for value in result))
+        return [value / length for value in result]
+
+    theta = math.acos(min(dot, 1.0))
+    sin_theta = math.sin(theta)
+    s0 = math.sin((1.0 - weight) * theta) / sin_theta
+    s1 = math.sin(weight * theta) / sin_theta
+
+    return [a * s0 + b * s1 for a, b in zip(q0, q1)]
+
+
+def _weights(weight, count):
+    if isinstance(weight, (int, float)):
+        return [float(weight)] * count
+    return [float(value) for value in weight]
+
+
+def decompose(matrices, use_numpy=True):
+    """
+    Decomposes a batch of matrices. Decompose once and reuse the result when blending repeatedly.
+
+    Args:
+        matrices: sequence, The matrices. See module docstring for accepted layouts.
+        use_numpy: bool, Use NumPy if it's available
+
+    Returns: tuple, (translations, quaternions, scales) as (N, 3), (N, 4), (N, 3) arrays or lists of rows
+
+    """
+
+    if use_numpy and numpy is not None:
+        batch = numpy.asarray(matrices, dtype=numpy.float64).reshape(-1, 4, 4)
+        translation = batch[:, 3, :3].copy()
+        basis = batch[:, :3, :3]
+
+        scale = numpy.linalg.norm(basis, axis=2)
+        scale[numpy.linalg.det(basis) < 0, 0] *= -1
+        safe_scale = numpy.where(scale == 0, 1.0, scale)
+        r = basis / safe_scale[:, :, None]
+
+        # Evaluate every branch of the scalar version and pick the stable one per matrix
+        r00, r01, r02 = r[:, 0, 0], r[:, 0, 1], r[:, 0, 2]
+        r10, r11, r12 = r[:, 1, 0], r[:, 1, 1], r[:, 1, 2]
+        r20, r21, r22 = r[:, 2, 0], r[:, 2, 1], r[:, 2, 2]
+        trace = r00 + r11 + r22
+
+        candidates = numpy.empty((4, len(batch), 4))
+        k = 0.5 / numpy.sqrt(numpy.maximum(trace + 1.0, 1e-12))
+        candidates[0] = numpy.stack([(r12 - r21) * k, (r20 - r02) * k, (r01 - r10) * k, 0.25 / k], axis=1)
+        k = 2.0 * numpy.sqrt(numpy.maximum(1.0 + r00 - r11 - r22, 1e-12))
+        candidates[1] = numpy.stack([0.25 * k, (r10 + r01) / k, (r20 + r02) / k, (r12 - r21) / k], axis=1)
+        k = 2.0 * numpy.sqrt(numpy.maximum(1.0 + r11 - r00 - r22, 1e-12))
+        candidates[2] = numpy.stack([(r10 + r01) / k, 0.25 * k, (r21 + r12) / k, (r20 - r02) / k], axis=1)
+        k = 2.0 * numpy.sqrt(numpy.maximum(1.0 + r22 - r00 - r11, 1e-12))
+        candidates[3] = numpy.stack([(r20 + r02) / k, (r21 + r12) / k, 0.25 * k, (r01 - r10) / k], axis=1)
+
+        branch = numpy.where(trace > 0, 0, numpy.where((r00 > r11) & (r00 > r22), 1, numpy.where(r11 > r22, 2, 3)))
+        quat = candidates[branch, numpy.arange(len(batch))]
+
+        return translation, quat, scale
+
+    decomposed = [decompose_matrix(row) for row in to_rows(matrices)]
+    return ([item[0] for item in decomposed], [item[1] for item in decomposed], [item[2] for item in decomposed])
+
+
+def compose(translations, quats, scales, use_numpy=True):
+    """
+    Builds a batch of matrices from the output of decompose().
+
+    Args:
+        translations: sequence, (N, 3)
+        quats: sequence, (N, 4)
+        scales: sequence, (N, 3)
+        use_numpy: bool, Use NumPy if it's available
+
+    Returns: (N, 16) numpy.ndarray or list of 16 float rows
+
+    """
+
+    if use_numpy and numpy is not None:
+        t = numpy.asarray(translations, dtype=numpy.float64).reshape(-1, 3)
+        q = numpy.asarray(quats, dtype=numpy.float64).reshape(-1, 4)
+        s = numpy.asarray(scales, dtype=numpy.float64).reshape(-1, 3)
+        x, y, z, w = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+
+        batch = numpy.zeros((len(q), 4, 4))
+        batch[:, 0, :3] = numpy.stack([1 - 2 * (y * y + z * z), 2 * (x * y + z * w), 2 * (x * z - y * w)], axis=1)
+        batch[:, 1, :3] = numpy.stack([2 * (x * y - z * w), 1 - 2 * (x * x + z * z), 2 * (y * z + x * w)], axis=1)
+        batch[:, 2, :3] = numpy.stack([2 * (x * z + y * w), 2 * (y * z - x * w), 1 - 2 * (x * x + y * y)], axis=1)
+        batch[:, :3, :3] *= s[:, :, None]
+        batch[:, 3, :3] = t
+        batch[:, 3, 3] = 1.0
+
+        return batch.reshape(-1, 16)
+
+    return [compose_matrix(t, q, s) for t, q, s in zip(translations, quats, scales)]
+
+
+def blend_decomposed(source, target, weight, use_numpy=True):
+    """
+    Interpolates two decompose() results. Translation and scale are interpolated linearly and rotation with slerp.
+
+    Args:
+        source: tuple, decompose() result returned at weight 0
+        target: tuple, decompose() result returned at weight 1
+        weight: float or sequence, Blend weight, either one for all controls or one per control
+        use_numpy: bool, Use NumPy if it's available
+
+    Returns: (N, 16) numpy.ndarray or list of 16 float rows
+
+    """
+
+    if use_numpy and numpy is not None:
+        t0, q0, s0 = (numpy.asarray(item, dtype=numpy.float64) for item in source)
+        t1, q1, s1 = (numpy.asarray(item, dtype=numpy.float64) for item in target)
+        w = numpy.broadcast_to(numpy.asarray(weight, dtype=numpy.float64), (len(q0),))[:, None]
+
+        dot = numpy.sum(q0 * q1, axis=1, keepdims=True)
+        q1 = numpy.where(dot < 0, -q1, q1)
+        dot = numpy.abs(dot)
+
+        theta = numpy.arccos(numpy.clip(dot, -1.0, 1.0))
+        sin_theta = numpy.sin(theta)
+        close = dot > 0.9995
+        safe_sin = numpy.where(close, 1.0, sin_theta)
+        k0 = numpy.where(close, 1.0 - w, numpy.sin((1.0 - w) * theta) / safe_sin)
+        k1 = numpy.where(close, w, numpy.sin(w * theta) / safe_sin)
+        quat = q0 * k0 + q1 * k1
+        quat /= numpy.linalg.norm(quat, axis=1, keepdims=True)
+
+        return compose(t0 + (t1 - t0) * w, quat, s0 + (s1 - s0) * w)
+
+    weights = _weights(weight, len(source[1]))
+    translations, quats, scales = [], [], []
+    for t0, q0, s0, t1, q1, s1, w in zip(*source, *target, weights):
+        translations.append([a + (b - a) * w for a, b in zip(t0, t1)])
+        quats.append(slerp(q0, q1, w))
+        scales.append([a + (b - a) * w for a, b in zip(s0, s1)])
+
+    return compose(translations, quats, scales, use_numpy=False)
+
+
+def batch_blend(source, target, weight, use_numpy=True):
+    """
+    Blends two batches of matrices.
+
+    Args:
+        source: sequence, Matrices returned at weight 0. See module docstring for accepted layouts.
+        target: sequence, Matrices returned at weight 1
+        weight: float or sequence, Blend weight, either one for all controls or one per control
+        use_numpy: bool, Use NumPy if it's available
+
+    Returns: (N, 16) numpy.ndarray or list of 16 float rows
+
+    """
+
+    return blend_decomposed(decompose(source, use_numpy=use_numpy), decompose(target, use_numpy=use_numpy), weight,
+                            use_numpy=use_numpy)
@@ -0,0 +1,305 @@
+"""
+Compact translation, rotation and scale encodings for matrix blocks
+
+Binary pose and clip files store 16 float64s per control by default. Most of that is redundant, so their matrix
+blocks can instead hold one fixed size record per control:
+
+    float32   translation 3 float32, quaternion 4 float32, scale 3 float32                  40 bytes, 28 without scale
+    fixed     translation 3 int32 in steps of translation_step, quaternion 3 int16 plus the
+              index of the dropped component, scale 3 int32 in steps of scale_step         32 bytes, 20 without scale
+
+The fixed encoding stores the three smallest quaternion components, which always lie within +-1/sqrt(2), and
+rebuilds the largest from the unit length. Scale is left out when every control's scale is 1.
+
+Shear and zero scale can't be represented, and float32 or fixed-point translations lose precision far from the
+origin, so encoded blocks are decoded again and compared against the original matrices. Blocks whose error exceeds
+the tolerance are stored as float64 instead, see encode_checked().
+"""
+
+import math
+import struct
+
+from . import const
+from . import pose_math
+
+FLOAT64 = 0
+FLOAT32 = 1
+FIXED   = 2
+KINDS   = {const.ENCODING_FLOAT64: FLOAT64, const.ENCODING_FLOAT32: FLOAT32, const.ENCODING_FIXED: FIXED}
+
+KIND_MASK  = 0xff
+HAS_SCALE  = 0x100
+PARAMS_FMT = "<dd"
+PARAMS_LEN = struct.calcsize(PARAMS_FMT)
+MATRIX_LEN = 16
+
+# The smallest three components of a unit quaternion are within +-1/sqrt(2), scaled to fill an int16
+QUAT_RANGE = 32767 * math.sqrt(2)
+INT32_MAX  = 2 ** 31 - 1
+
+
+def max_error(a, b):
+    """
+    Args:
+        a: sequence, Flat matrix values
+        b: sequence, Flat matrix values
+
+    Returns: float, Largest difference between any two elements
+
+    """
+
+    return max((abs(x - y) for x, y in zip(a, b)), default=0.0)
+
+
+def needs_scale(scales, tolerance=const.QUANT_TOLERANCE):
+    """
+    Args:
+        scales: sequence, (N, 3) scales from pose_math.decompose()
+        tolerance: float, Largest difference from 1 treated as unscaled
+
+    Returns: bool, True if any control is scaled
+
+    """
+
+    return any(abs(value - 1.0) > tolerance for scale in scales for value in scale)
+
+
+class Encoding:
+    """
+    How the matrices of a block are stored.
+
+    Args:
+        kind: int, FLOAT64, FLOAT32 or FIXED
+        has_scale: bool, Store scale. Controls are loaded with a scale of 1 otherwise.
+        translation_step: float, Smallest translation difference the fixed encoding can store
+        scale_step: float, Smallest scale difference the fixed encoding can store
+    """
+
+    def __init__(self, kind=FLOAT64, has_scale=True, translation_step=const.QUANT_TRANSLATION_STEP,
+                 scale_step=const.QUANT_SCALE_STEP):
+        self.kind = kind
+        self.has_scale = has_scale or kind == FLOAT64
+        self.translation_step = translation_step
+        self.scale_step = scale_step
+
+        if kind == FLOAT64:
+            self.record = struct.Struct("<16d")
+        elif kind == FLOAT32:
+            self.record = struct.Struct("<10f" if self.has_scale else "<7f")
+        elif kind == FIXED:
+            self.record = struct.Struct("<3i4h3i" if self.has_scale else "<3i4h")
+        else:
+            raise ValueError(f"Unknown matrix encoding {kind}")
+
+    @classmethod
+    def from_name(cls, name, has_scale=True):
+        """
+        Args:
+            name: str, const.ENCODING_FLOAT64, const.ENCODING_FLOAT32 or const.ENCODING_FIXED
+            has_scale: bool, Store scale
+
+        Returns: Encoding
+
+        """
+
+        if name not in KINDS:
+            raise ValueError(f"Unknown matrix encoding '{name}'. Accepts {', '.join(KINDS)}")
+
+        return cls(KINDS[name], has_scale=has_scale)
+
+    @classmethod
+    def from_header(cls, flags, buffer, offset):
+        """
+        Reads the encoding of a block from a file header.
+
+        Args:
+            flags: int, The header's flags
+            buffer: bytes-like, The file contents
+            offset: int, Where the encoding parameters start
+
+        Returns: tuple(Encoding, int), the encoding and the size of its parameters
+
+        """
+
+        kind = flags & KIND_MASK
+        if kind == FLOAT64:
+            return cls(), 0
+
+        translation_step, scale_step = struct.unpack_from(PARAMS_FMT, buffer, offset)
+        return cls(kind, bool(flags & HAS_SCALE), translation_step, scale_step), PARAMS_LEN
+
+    @property
+    def flags(self):
+        return self.kind | (HAS_SCALE if self.has_scale else 0)
+
+    @property
+    def record_size(self):
+        return self.record.size
+
+    def params(self):
+        """
+        Returns: bytes, Parameters written after the file header. Empty for float64 blocks.
+
+        """
+
+        if self.kind == FLOAT64:
+            return b""
+
+        return struct.pack(PARAMS_FMT, self.translation_step, self.scale_step)
+
+    def encode(self, matrices):
+        """
+        Encodes a block of matrices.
+
+        Args:
+            matrices: sequence, Flat N * 16 floats or 16 float rows
+
+        Returns: bytes
+
+        """
+
+        if self.kind == FLOAT64:
+            rows = pose_math.to_rows(matrices)
+            return struct.pack(f"<{len(rows) * MATRIX_LEN}d", *(value for row in rows for value in row))
+
+        return self.encode_decomposed(*decompose(matrices))
+
+    def encode_decomposed(self, translations, quats, scales):
+        """
+        Encodes a block of matrices already split by decompose().
+
+        Args:
+            translations: list, (N, 3)
+            quats: list, (N, 4)
+            scales: list, (N, 3)
+
+        Returns: bytes
+
+        """
+
+        pack = self.record.pack
+        records = []
+
+        if self.kind == FLOAT32:
+            for t, q, s in zip(translations, quats, scales):
+                records.append(pack(*t, *q, *s) if self.has_scale else pack(*t, *q))
+            return b"".join(records)
+
+        t_step = self.translation_step
+        s_step = self.scale_step
+        for t, q, s in zip(translations, quats, scales):
+            # Drop the largest component, flipping the quaternion so the dropped one is positive
+            idx = max(range(4), key=lambda i: abs(q[i]))
+            sign = -1.0 if q[idx] < 0 else 1.0
+            small = [round(sign * q[i] * QUAT_RANGE) for i in range(4) if i != idx]
+
+            fixed_t = [round(value / t_step) for value in t]
+            if self.has_scale:
+                fixed_s = [round(value / s_step) for value in s]
+                if max(abs(value) for value in fixed_t + fixed_s) > INT32_MAX:
+                    raise OverflowError("Translation or scale too large for fixed-point encoding")
+                records.append(pack(*fixed_t, *small, idx, *fixed_s))
+            else:
+                if max(abs(value) for value in fixed_t) > INT32_MAX:
+                    raise OverflowError("Translation too large for fixed-point encoding")
+                records.append(pack(*fixed_t, *small, idx))
+
+        return b"".join(records)
+
+    def decode(self, buffer, count):
+        """
+        Decodes a block of matrices.
+
+        Args:
+            buffer: bytes-like, The encoded block
+            count: int, Number of matrices in the block
+
+        Returns: list, Flat count * 16 floats
+
+        """
+
+        if self.kind == FLOAT64:
+            return list(struct.unpack_from(f"<{count * MATRIX_LEN}d", buffer))
+
+        size = count * self.record_size
+        translations, quats, scales = [], [], []
+
+        for values in self.record.iter_unpack(buffer[:size]):
+            if self.kind == FLOAT32:
+                translations.append(values[0:3])
+                quats.append(values[3:7])
+                scales.append(values[7:10] if self.has_scale else (1.0, 1.0, 1.0))
+                continue
+
+            t_step = self.translation_step
+            translations.append([value * t_step for value in values[0:3]])
+
+            small = [value / QUAT_RANGE for value in values[3:6]]
+            small.insert(values[6], math.sqrt(max(0.0, 1.0 - sum(value * value for value in small))))
+            quats.append(small)
+
+            if self.has_scale:
+                s_step = self.scale_step
+                scales.append([value * s_step for value in values[7:10]])
+            else:
+                scales.append((1.0, 1.0, 1.0))
+
+        matrices = pose_math.compose(translations, quats, scales)
+        if isinstance(matrices, list):
+            return [value for row in matrices for value in row]
+
+        return matrices.reshape(-1).tolist()
+
+
+def decompose(matrices):
+    """
+    Splits matrices into translation, rotation and scale lists.
+
+    Args:
+        matrices: sequence, Flat N * 16 floats or 16 float rows
+
+    Returns: tuple(list, list, list)
+
+    """
+
+    translations, quats, scales = pose_math.decompose(matrices)
+    if not isinstance(translations, list):
+        return translations.tolist(), quats.tolist(), scales.tolist()
+
+    return translations, quats, scales
+
+
+def encode_checked(matrices, name=const.POSE_ENCODING, tolerance=const.QUANT_TOLERANCE):
+    """
+    Encodes a block of matrices, falling back to float64 if the encoded block doesn't reproduce every matrix
+    element within the tolerance.
+
+    Args:
+        matrices: sequence, Flat N * 16 floats or 16 float rows
+        name: str, The preferred encoding, e.g. const.ENCODING_FIXED
+        tolerance: float, Largest allowed difference of any matrix element after decoding
+
+    Returns: tuple(Encoding, bytes)
+
+    """
+
+    rows = pose_math.to_rows(matrices)
+    encoding = Encoding.from_name(name)
+
+    if encoding.kind != FLOAT64:
+        decomposed = decompose(rows)
+        encoding = Encoding.from_name(name, has_scale=needs_scale(decomposed[2], tolerance))
+
+        try:
+            data = encoding.encode_decomposed(*decomposed)
+        except (OverflowError, struct.error):
+            data = None
+
+        if data is not None:
+            flat = [value for row in rows for value in row]
+            if max_error(flat, encoding.decode(data, len(rows))) <= tolerance:
+                return encoding, data
+
+        encoding = Encoding()
+
+    return encoding, encoding.encode(rows)
@@ -0,0 +1,285 @@
+"""
+Matching scene controls to pose entries
+
+A NameIndex is built once per pose and answers lookups in constant time, so resolving a whole selection is linear
+in its size. Controls that can't be matched are collected into a Resolution report instead of being warned about
+one at a time.
+"""
+
+from collections import OrderedDict
+
+
+def split_name(name):
+    """
+    Splits a node name into its namespace and short name, dropping any DAG path.
+
+        "|grp|charA:face:L_eye" -> ("charA:face", "L_eye")
+
+    Args:
+        name: str, Node name
+
+    Returns: tuple(str, str)
+
+    """
+
+    namespace, _, short = name.rpartition('|')[-1].rpartition(':')
+    return namespace, short
+
+
+def short_name(name):
+    """
+    Strips the DAG path and namespace from a node name. This is the key controls are stored under in pose files.
+
+    Args:
+        name: str, Node name
+
+    Returns: str
+
+    """
+
+    return split_name(name)[1]
+
+
+class NameRules:
+    """
+    Rules for matching differently named rigs.
+
+    Args:
+        namespaces: dict, Scene namespace to pose namespace, for poses that kept their namespaces
+        prefixes: list, (scene prefix, pose prefix) pairs substituted on the short name, e.g. ("Hero_", "Dummy_")
+    """
+
+    def __init__(self, namespaces=None, prefixes=None):
+        self.namespaces = dict(namespaces or {})
+        self.prefixes = list(prefixes or [])
+
+    def key(self):
+        """
+        Returns: tuple, Hashable form of the rules used for caching
+
+        """
+
+        return tuple(sorted(self.namespaces.items())), tuple(self.prefixes)
+
+    def substitute(self, short):
+        """
+        Applies the first matching prefix substitution.
+
+        Args:
+            short: str, Name without namespace
+
+        Returns: str
+
+        """
+
+        for scene_prefix, pose_prefix in self.prefixes:
+            if short.startswith(scene_prefix):
+                return pose_prefix + short[len(scene_prefix):]
+
+        return short
+
+    def candidates(self, name):
+        """
+        Lists the pose keys a scene node could be stored under, best match first.
+
+        Args:
+            name: str, Scene node name
+
+        Returns: list
+
+        """
+
+        namespace, short = split_name(name)
+        substituted = self.substitute(short)
+
+        candidates = []
+        if namespace:
+            pose_namespace = self.namespaces.get(namespace, namespace)
+            candidates.append(f"{pose_namespace}:{substituted}")
+            if substituted != short:
+                candidates.append(f"{pose_namespace}:{short}")
+
+        candidates.append(substituted)
+        if substituted != short:
+            candidates.append(short)
+
+        return candidates
+
+
+class Resolution:
+    """
+    Result of resolving a selection against a pose.
+
+    Attributes:
+        matches: list, (scene node, pose key) pairs in selection order
+        unmatched: list, Scene nodes with no pose entry
+        unused: list, Pose keys nothing was matched to
+    """
+
+    def __init__(self, matches, unmatched, unused):
+        self.matches = matches
+        self.unmatched = unmatched
+        self.unused = unused
+
+    def __bool__(self):
+        return bool(self.matches)
+
+    def report(self, limit=10):
+        """
+        Summarizes the unmatched controls in a single message.
+
+        Args:
+            limit: int, Maximum number of names listed
+
+        Returns: str
+
+        """
+
+        if not self.unmatched:
+            return ""
+
+        names = ", ".join(self.unmatched[:limit])
+        if len(self.unmatched) > limit:
+            names += f" and {len(self.unmatched) - limit} more"
+
+        return f"Pose info not found for {len(self.unmatched)} object(s): {names}. Skipping."
+
+
+class NameIndex:
+    """
+    Lookup table from scene node names to the keys of a pose.
+
+    Args:
+        pose_names: list, The pose's keys in order
+        rules: NameRules, Extra renaming rules
+    """
+
+    def __init__(self, pose_names, rules=None):
+        self.pose_names = list(pose_names)
+        self.rules = rules or NameRules()
+        self.keys = set(self.pose_names)
+
+        # Poses saved with namespaces can still be found by short name as long as the short name is unique
+        self.by_short_name = {}
+        ambiguous = set()
+        for key in self.pose_names:
+            short = short_name(key)
+            if short == key:
+                continue
+            if short in self.by_short_name:
+                ambiguous.add(short)
+            self.by_short_name[short] = key
+
+        for short in ambiguous:
+            del self.by_short_name[short]
+
+    def lookup(self, name):
+        """
+        Finds the pose key for a scene node.
+
+        Args:
+            name: str, Scene node name
+
+        Returns: str or None
+
+        """
+
+        candidates = self.rules.candidates(name)
+        for candidate in candidates:
+            if candidate in self.keys:
+                return candidate
+
+        for candidate in candidates:
+            if candidate in self.by_short_name:
+                return self.by_short_name[candidate]
+
+        return None
+
+    def resolve(self, selection, by_name=True, skip=()):
+        """
+        Matches every selected node to a pose entry.
+
+        Args:
+            selection: list, Scene nodes to paste to
+            by_name: bool, Match by name, or by selection order if False
+            skip: list, Nodes left out of the result, e.g. the reference object. They still count towards the
+                  selection order.
+
+        Returns: Resolution
+
+        """
+
+        skip = set(skip)
+        matches = []
+        unmatched = []
+
+        if by_name:
+            for obj in selection:
+                if obj in skip:
+                    continue
+                key = self.lookup(obj)
+                if key is None:
+                    unmatched.append(obj)
+                else:
+                    matches.append((obj, key))
+
+        else:
+            for idx, obj in enumerate(selection):
+                if obj in skip:
+                    continue
+                if idx < len(self.pose_names):
+                    matches.append((obj, self.pose_names[idx]))
+                else:
+                    unmatched.append(obj)
+
+        used = {key for _, key in matches}
+        unused = [key for key in self.pose_names if key not in used]
+
+        return Resolution(matches, unmatched, unused)
+
+
+class NameIndexCache:
+    """
+    Keeps the most recently used NameIndex objects so pasting the same pose onto the same rig doesn't rebuild them.
+
+    Args:
+        limit: int, Number of indices kept
+    """
+
+    def __init__(self, limit=16):
+        self.limit = limit
+        self.indices = OrderedDict()
+
+    def get(self, pose_names, rules=None):
+        """
+        Gets the index for a pose, building it if needed.
+
+        Args:
+            pose_names: list, The pose's keys in order
+            rules: NameRules, Extra renaming rules
+
+        Returns: NameIndex
+
+        """
+
+        rules = rules or NameRules()
+        key = (tuple(pose_names), rules.key())
+
+        index = self.indices.get(key)
+        if index is None:
+            index = NameIndex(pose_names, rules)
+            self.indices[key] = index
+            while len(self.indices) > self.limit:
+                self.indices.popitem(last=False)
+        else:
+            self.indices.move_to_end(key)
+
+        return index
+
+    def clear(self):
+        """
+        Returns: None
+
+        """
+
+        self.indices.clear()
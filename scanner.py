@@ -0,0 +1,170 @@
+"""
+Incremental indexing of a pose folder
+
+The library database keeps a manifest of every pose file found in const.POSE_DIR with its modification time, size
+and content hash. A scan only stats the folder tree and compares against the manifest:
+
+    new files                  parsed and added to the library
+    changed size               parsed again
+    changed mtime only         hashed, and parsed again only if the contents changed
+    missing files              removed from the library
+
+So refreshing the Library tab costs one stat per file plus work proportional to what changed. Files that fail to
+parse are recorded with an empty hash and skipped until they change again.
+"""
+
+import os
+import sqlite3
+from pathlib import Path
+from collections import namedtuple
+
+from . import const
+from . import parallel
+from . import pose_io
+
+ScanResult = namedtuple("ScanResult", ["added", "updated", "removed", "unchanged", "failed"])
+
+# Files in pose folders that aren't poses
+SKIP_NAMES = {const.CLIPBOARD.name, const.LOCK_NAME}
+
+
+def stat_tree(root, exts=parallel.POSE_EXTS):
+    """
+    Finds the pose files below a folder along with their modification time and size. os.scandir() gets file types
+    from the directory listing, so only pose files are stat'ed.
+
+    Args:
+        root: str, The folder
+        exts: list, Pose file extensions
+
+    Returns: dict, filepath to (mtime in nanoseconds, size)
+
+    """
+
+    found = {}
+    folders = [str(root)]
+
+    while folders:
+        try:
+            entries = os.scandir(folders.pop())
+        except OSError:
+            continue
+
+        with entries:
+            for entry in entries:
+                # Hidden files include the temporary files of writes in progress
+                if entry.name.startswith(".") or entry.name in SKIP_NAMES:
+                    continue
+
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append(entry.path)
+                elif entry.name.lower().endswith(exts):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    found[entry.path] = (stat.st_mtime_ns, stat.st_size)
+
+    return found
+
+
+def hash_file(filepath):
+    """
+    Hashes a pose file. Runs in a worker process.
+
+    Args:
+        filepath: str, The pose file
+
+    Returns: str, or "" if it can't be read
+
+    """
+
+    try:
+        return pose_io.content_hash(filepath)
+    except OSError:
+        return ""
+
+
+def scan(lib, root=const.POSE_DIR, workers=1):
+    """
+    Brings the library up to date with the pose files in a folder.
+
+    Args:
+        lib: library.PoseLibrary, The library to update
+        root: str, The pose folder
+        workers: int, Processes used to hash and parse changed files. Defaults to parsing in this process, which is safe
+                 inside a DCC.
+
+    Returns: ScanResult, counts of added, updated, removed and unchanged poses, and (filepath, problems) per file
+             that failed to parse. Files touched without changing their contents count as unchanged.
+
+    """
+
+    root = str(Path(root).resolve())
+    found = stat_tree(root)
+    manifest = lib.manifest(root)
+
+    changed = [path for path, stat in found.items() if manifest.get(path, (None, None))[:2] != stat]
+    deleted = [path for path in manifest if path not in found]
+    unchanged = len(found) - len(changed)
+
+    # Indexed files that kept their size may only have been touched. Hashing is much cheaper than parsing.
+    touched = [path for path in changed if path in manifest and manifest[path][1] == found[path][1]
+               and manifest[path][2]]
+    same = set()
+    for path, content_hash in zip(touched, parallel.run(hash_file, touched, workers)):
+        if content_hash == manifest[path][2]:
+            same.add(path)
+
+    if same:
+        with lib.transaction():
+            lib.update_manifest([(path, *found[path], manifest[path][2]) for path in same])
+        unchanged += len(same)
+        changed = [path for path in changed if path not in same]
+
+    added = 0
+    updated = 0
+    failed = []
+
+    for batch in parallel.batches(zip(changed, parallel.run(parallel.load_file, changed, workers))):
+        with lib.transaction():
+            entries = []
+            for path, result in batch:
+                mtime, size = found[path]
+                if result["problems"]:
+                    failed.append((path, result["problems"]))
+                    entries.append((path, mtime, size, ""))
+                    continue
+
+                entries.append((path, mtime, size, result["hash"]))
+
+                record = lib.find_filepath(path)
+                if record is None:
+                    pose_id = lib.add_pose(Path(path).stem, path, content_hash=result["hash"])
+                    added += 1
+                elif record.content_hash != result["hash"]:
+                    # Keep the name, tags and author given in the library
+                    pose_id = record.id
+                    lib.set_content_hash(pose_id, result["hash"])
+                    updated += 1
+                else:
+                    # Already in the library with these contents, e.g. imported with the CLI
+                    unchanged += 1
+                    continue
+
+                lib.store_features(pose_id, *result["features"])
+
+            lib.update_manifest(entries)
+
+    removed = 0
+    with lib.transaction():
+        for path in deleted:
+            record = lib.find_filepath(path)
+            try:
+                if record is not None and lib.remove_pose(record.id):
+                    removed += 1
+            except sqlite3.IntegrityError:
+                failed.append((path, ["Deleted but still used as the base of delta poses"]))
+        lib.remove_manifest(deleted)
+
+    return ScanResult(added, updated, removed, unchanged, failed)
@@ -0,0 +1,429 @@
+"""
+Finding library poses similar to a pose
+
+Every pose saved to the library gets a feature vector, stored in the database next to it. Each control contributes
+FEATURE_SIZE values taken from its matrix relative to the pose's root control:
+
+    the first two rows of its rotation, with scale removed      6 values
+    its translation divided by the pose's average control distance from the root, so big and small characters
+    compare the same                                             3 values
+
+Poses are compared over the controls they share. The distance is the mean squared difference per shared control,
+so poses of differently sized rigs can still be ranked, and poses sharing less than SIMILARITY_MIN_SHARED of the
+query's controls are left out.
+
+A SimilarityIndex keeps the feature vectors of poses with the same controls, typically every pose of one rig, in a
+FeatureBlock of poses by that rig's controls. Queries only compare against blocks sharing enough of the query's
+controls, and a library of many rigs doesn't need an array as wide as all their controls together. Refreshing only
+reads the rows saved since the last refresh, so poses saved by this or any other session are picked up without
+rebuilding the index.
+"""
+
+import math
+import struct
+
+from . import const
+from . import pose_math
+from .resolve import short_name
+
+numpy = pose_math.numpy
+
+FEATURE_SIZE = 9
+TRANSLATION  = slice(6, 9)
+
+
+def find_root(names, roots=const.SIMILARITY_ROOTS):
+    """
+    Picks the control a pose's features are measured from.
+
+    Args:
+        names: list, The pose's keys
+        roots: list, Lower case root control names in order of preference. Names are matched exactly first, then
+               as part of a control name, e.g. "hips" matches "Hips_ctrl".
+
+    Returns: str, The root control, or the pose's first control if none matched
+
+    """
+
+    shorts = [(short_name(name).lower(), name) for name in names]
+
+    for root in roots:
+        for short, name in shorts:
+            if short == root:
+                return name
+
+    for root in roots:
+        for short, name in shorts:
+            if root in short:
+                return name
+
+    return names[0]
+
+
+def normalize(vector):
+    length = math.sqrt(sum(value * value for value in vector))
+    return [value / length for value in vector] if length else [0.0] * len(vector)
+
+
+def pose_features(pose_data, roots=const.SIMILARITY_ROOTS):
+    """
+    Builds the feature vector of a pose. Doesn't need NumPy, so poses can be saved without it.
+
+    Args:
+        pose_data: OrderedDict(), The pose
+        roots: list, Root control names, see find_root()
+
+    Returns: tuple(list, list), the control names and FEATURE_SIZE floats per control
+
+    """
+
+    names = list(pose_data)
+    if not names:
+        return [], []
+
+    root = find_root(names, roots)
+    root_inverse = pose_math.inverse(pose_data[root]["matrix"])
+    relative = pose_math.to_rows(pose_math.batch_multiply([pose_data[name]["matrix"] for name in names],
+                                                          root_inverse))
+
+    distances = [math.sqrt(sum(value * value for value in matrix[12:15])) for matrix in relative]
+    scale = sum(distances) / max(len(distances) - 1, 1) or 1.0
+
+    values = []
+    for matrix in relative:
+        values.extend(normalize(matrix[0:3]))
+        values.extend(normalize(matrix[4:7]))
+        values.extend(value / scale for value in matrix[12:15])
+
+    return names, values
+
+
+def pack_features(names, values):
+    """
+    Args:
+        names: list, Control names from pose_features()
+        values: list, Features from pose_features()
+
+    Returns: tuple(str, bytes), the names and features as stored in the database
+
+    """
+
+    return "\n".join(names), struct.pack(f"<{len(values)}f", *values)
+
+
+def unpack_features(controls, blob):
+    """
+    Args:
+        controls: str, Names stored by pack_features()
+        blob: bytes, Features stored by pack_features()
+
+    Returns: tuple(list, list)
+
+    """
+
+    names = controls.split("\n") if controls else []
+    return names, list(struct.unpack(f"<{len(blob) // 4}f", blob))
+
+
+class FeatureBlock:
+    """
+    The weighted feature vectors of every indexed pose with the same controls. Rows are allocated ahead, so adding
+    poses one at a time doesn't copy the block each time.
+
+    Args:
+        names: tuple, The control names, sorted
+    """
+
+    def __init__(self, names):
+        self.names = names
+        self.columns = {name: column for column, name in enumerate(names)}
+
+        # pose id -> row, and row -> pose id
+        self.rows = {}
+        self.pose_ids = []
+
+        self.features = numpy.zeros((0, len(names), FEATURE_SIZE), dtype=numpy.float32)
+
+        # Squared length of each control's features
+        self.norms = numpy.zeros((0, len(names)), dtype=numpy.float32)
+
+    def __len__(self):
+        return len(self.pose_ids)
+
+    def set(self, pose_id, features):
+        """
+        Adds or updates a pose.
+
+        Args:
+            pose_id: int, The pose id
+            features: numpy.ndarray, Weighted features, one row per control in the order of names
+
+        Returns: None
+
+        """
+
+        row = self.rows.get(pose_id)
+        if row is None:
+            row = len(self.pose_ids)
+            if row == self.features.shape[0]:
+                capacity = max(row * 2, 16)
+                features_grown = numpy.zeros((capacity,) + self.features.shape[1:], dtype=numpy.float32)
+                norms_grown = numpy.zeros((capacity,) + self.norms.shape[1:], dtype=numpy.float32)
+                features_grown[:row] = self.features
+                norms_grown[:row] = self.norms
+                self.features, self.norms = features_grown, norms_grown
+
+            self.rows[pose_id] = row
+            self.pose_ids.append(pose_id)
+
+        self.features[row] = features
+        self.norms[row] = (features ** 2).sum(axis=-1)
+
+    def remove(self, pose_id):
+        """
+        Removes a pose by moving the last row into its place.
+
+        Args:
+            pose_id: int, The pose id
+
+        Returns: None
+
+        """
+
+        row = self.rows.pop(pose_id)
+        last = len(self.pose_ids) - 1
+        if row != last:
+            self.features[row] = self.features[last]
+            self.norms[row] = self.norms[last]
+            self.pose_ids[row] = self.pose_ids[last]
+            self.rows[self.pose_ids[row]] = row
+
+        self.pose_ids.pop()
+
+    def distances(self, query, min_shared):
+        """
+        Args:
+            query: dict, Control name -> weighted features of the pose to compare against
+            min_shared: float, Fewest controls the block has to share with the query
+
+        Returns: numpy.ndarray, Mean squared difference per shared control of each pose, or None if the block
+                 shares too few controls
+
+        """
+
+        shared = [name for name in self.names if name in query]
+        if not shared or len(shared) < min_shared:
+            return None
+
+        count = len(self.pose_ids)
+        if len(shared) == len(self.names):
+            features, norms = self.features[:count], self.norms[:count]
+        else:
+            columns = [self.columns[name] for name in shared]
+            features, norms = self.features[:count, columns], self.norms[:count, columns]
+
+        values = numpy.array([query[name] for name in shared], dtype=numpy.float32)
+
+        # Sum of squared differences, expanded so the cross term is one matrix-vector product
+        distances = norms.sum(axis=-1) + (values ** 2).sum() - 2.0 * (features.reshape(count, -1) @ values.reshape(-1))
+
+        return numpy.maximum(distances, 0.0) / len(shared)
+
+
+class SimilarityIndex:
+    """
+    Nearest neighbour search over the feature vectors of the library's poses. Needs NumPy.
+
+    Args:
+        library: library.PoseLibrary, The library to search
+        roots: list, Root control names, see find_root()
+        translation_weight: float, Weight of translations relative to rotations
+        min_shared: float, Fraction of the query's controls a pose needs to share to be a result
+    """
+
+    def __init__(self, library, roots=const.SIMILARITY_ROOTS, translation_weight=const.SIMILARITY_TRANSLATION_WEIGHT,
+                 min_shared=const.SIMILARITY_MIN_SHARED):
+        if numpy is None:
+            raise RuntimeError("Pose similarity search needs NumPy")
+
+        self.library = library
+        self.roots = roots
+        self.translation_weight = translation_weight
+        self.min_shared = min_shared
+
+        # Highest pose_features id read so far
+        self.last_id = 0
+
+        # Sorted control names -> FeatureBlock, and pose id -> the block it's in
+        self.blocks = {}
+        self.poses = {}
+
+    def __len__(self):
+        return len(self.poses)
+
+    def _weighted(self, values):
+        values = numpy.array(values, dtype=numpy.float32).reshape(-1, FEATURE_SIZE)
+        values[:, TRANSLATION] *= self.translation_weight
+        return values
+
+    def _remove(self, pose_id):
+        block = self.poses.pop(pose_id)
+        block.remove(pose_id)
+        if not block:
+            del self.blocks[block.names]
+
+    def refresh(self):
+        """
+        Reads feature vectors saved since the last refresh and drops removed poses.
+
+        Returns: int, Number of poses added or updated
+
+        """
+
+        new_rows = self.library.feature_rows(self.last_id)
+
+        for feature_id, pose_id, controls, blob in new_rows:
+            names, values = unpack_features(controls, blob)
+            order = sorted(range(len(names)), key=names.__getitem__)
+            key = tuple(names[index] for index in order)
+
+            block = self.blocks.get(key)
+            if block is None:
+                block = self.blocks[key] = FeatureBlock(key)
+
+            # Saved again with different controls
+            if pose_id in self.poses and self.poses[pose_id] is not block:
+                self._remove(pose_id)
+
+            block.set(pose_id, self._weighted(values)[order])
+            self.poses[pose_id] = block
+            self.last_id = feature_id
+
+        # Removed poses take their features with them
+        if self.library.feature_count() != len(self.poses):
+            for pose_id in set(self.poses) - set(self.library.feature_pose_ids()):
+                self._remove(pose_id)
+
+        return len(new_rows)
+
+    def backfill(self, load=None):
+        """
+        Builds feature vectors for library poses saved before they were stored, e.g. after upgrading the database.
+
+        Args:
+            load: callable, Takes a pose's filepath and returns its pose data. Defaults to reading the pose file,
+                  or the database for poses stored in it.
+
+        Returns: int, Number of poses indexed
+
+        """
+
+        from . import pose_io
+
+        def load_file(filepath):
+            if filepath.startswith(const.LIBRARY_PREFIX):
+                return self.library.load_filepath(filepath)
+            with open(filepath, "rb") as pose_file:
+                return pose_io.decode_pose(pose_file.read())
+
+        load = load or load_file
+
+        count = 0
+        for pose_id, filepath in self.library.poses_without_features():
+            try:
+                pose_data = load(filepath)
+            except (OSError, ValueError) as e:
+                print(f"Could not index {filepath}: {e}")
+                continue
+
+            if pose_data:
+                self.library.set_features(pose_id, pose_data)
+                count += 1
+
+        return count
+
+    def query_features(self, names, values, count=10, exclude=()):
+        """
+        Finds the poses closest to a feature vector.
+
+        Args:
+            names: list, Control names from pose_features()
+            values: list, Features from pose_features()
+            count: int, Number of poses to return
+            exclude: list, Pose ids left out of the results
+
+        Returns: list of (pose id, distance), closest first
+
+        """
+
+        if not self.poses or not names:
+            return []
+
+        query = dict(zip(names, self._weighted(values)))
+        min_shared = max(self.min_shared * len(names), 1.0)
+
+        pose_ids = []
+        distances = []
+        for block in self.blocks.values():
+            block_distances = block.distances(query, min_shared)
+            if block_distances is not None:
+                pose_ids.extend(block.pose_ids)
+                distances.append(block_distances)
+
+        if not distances:
+            return []
+
+        distances = numpy.concatenate(distances)
+        excluded = set(exclude)
+        if excluded:
+            distances[[row for row, pose_id in enumerate(pose_ids) if pose_id in excluded]] = numpy.inf
+
+        count = min(count, int(numpy.isfinite(distances).sum()))
+        if count <= 0:
+            return []
+
+        nearest = numpy.argpartition(distances, count - 1)[:count]
+        nearest = nearest[numpy.argsort(distances[nearest])]
+
+        return [(pose_ids[row], float(distances[row])) for row in nearest]
+
+    def query(self, pose_data, count=10, exclude=()):
+        """
+        Finds the library poses closest to a pose, e.g. the current selection's.
+
+        Args:
+            pose_data: OrderedDict(), The pose to compare against
+            count: int, Number of poses to return
+            exclude: list, Pose ids left out of the results
+
+        Returns: list of (pose id, distance), closest first
+
+        """
+
+        self.refresh()
+        names, values = pose_features(pose_data, self.roots)
+
+        return self.query_features(names, values, count=count, exclude=exclude)
+
+    def query_pose(self, pose_id, count=10):
+        """
+        Finds the library poses closest to a pose in the library.
+
+        Args:
+            pose_id: int, The pose to compare against. It's left out of the results.
+            count: int, Number of poses to return
+
+        Returns: list of (pose id, distance), closest first
+
+        """
+
+        self.refresh()
+
+        block = self.poses.get(pose_id)
+        if block is None:
+            return []
+
+        values = block.features[block.rows[pose_id]].copy()
+        values[:, TRANSLATION] /= self.translation_weight or 1.0
+
+        return self.query_features(block.names, values.reshape(-1), count=count, exclude=(pose_id,))
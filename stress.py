@@ -0,0 +1,185 @@
+"""
+Multi-process stress test for sharing the pose library and pose folders between sessions
+
+Starts several processes that all write to one pose folder and one library database at the same time, the way
+several open DCC sessions would:
+
+    python -m posey.stress                         8 processes, 50 rounds each, in a temporary folder
+    python -m posey.stress --processes 16 --rounds 200 --folder path/on/network/mount
+
+Each round a process atomically writes its own pose file and a file every process shares, indexes its file in the
+library, stores a pose in the database and searches. Afterwards every file has to parse, every row has to be in the
+library, and no process may have seen a "database is locked" error or a lock timeout. Exits with 1 otherwise.
+"""
+
+import sys
+import random
+import sqlite3
+import argparse
+import tempfile
+from pathlib import Path
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from . import const
+from . import library
+from . import pose_io
+from .app_stubin import random_matrix
+
+CONTROLS    = 20
+SHARED_NAME = "shared.json"
+
+
+def make_pose(seed, controls=CONTROLS):
+    """
+    Args:
+        seed: int, Random seed
+        controls: int, Number of controls
+
+    Returns: OrderedDict(), A pose of random rigid transforms
+
+    """
+
+    rng = random.Random(seed)
+    return OrderedDict((f"ctrl{i}", {"matrix": random_matrix(rng)}) for i in range(controls))
+
+
+def worker(index, folder, db_path, rounds):
+    """
+    Writes pose files and library rows as fast as it can. Runs in its own process.
+
+    Args:
+        index: int, Worker number, used to name what it writes
+        folder: str, The shared pose folder
+        db_path: str, The shared library database
+        rounds: int, Number of rounds
+
+    Returns: dict, "files" written, "indexed" (pose id, filepath) and "stored" (pose id, name) pairs, and "errors"
+
+    """
+
+    result = {"files": [], "indexed": [], "stored": [], "errors": []}
+
+    with library.PoseLibrary(db_path) as lib:
+        for i in range(rounds):
+            pose_data = make_pose(index * rounds + i)
+            filepath = str(Path(folder, f"w{index}_{i}{const.BINARY_EXT}"))
+            name = f"stress w{index} {i}"
+
+            try:
+                pose_io.atomic_write(filepath, pose_io.encode_pose(pose_data, const.FORMAT_BINARY))
+                result["files"].append(filepath)
+
+                pose_io.atomic_write(Path(folder, SHARED_NAME), pose_io.encode_pose(pose_data))
+
+                pose_id = lib.add_pose(name, filepath, author=f"w{index}", tags=["stress", f"w{index}"],
+                                       content_hash=pose_io.content_hash(filepath))
+                result["indexed"].append((pose_id, filepath))
+
+                result["stored"].append((lib.store_pose(name, pose_data, author=f"w{index}", tags=["stored"]), name))
+
+                lib.search("stress", tags=[f"w{index}"], limit=10)
+                lib.count("stored")
+            except (OSError, TimeoutError, sqlite3.Error) as e:
+                result["errors"].append(f"w{index} round {i}: {e}")
+
+    return result
+
+
+def check(results, folder, db_path):
+    """
+    Verifies that everything the workers wrote landed intact.
+
+    Args:
+        results: list, From worker()
+        folder: str, The shared pose folder
+        db_path: str, The shared library database
+
+    Returns: list of str, The problems found
+
+    """
+
+    problems = [error for result in results for error in result["errors"]]
+
+    for filepath in [filepath for result in results for filepath in result["files"]] + [Path(folder, SHARED_NAME)]:
+        try:
+            pose_data = pose_io.read_pose(filepath)
+        except (OSError, ValueError) as e:
+            problems.append(f"{filepath}: {e}")
+            continue
+
+        problems.extend(f"{filepath}: {problem}" for problem in pose_io.validate_pose(pose_data))
+        if len(pose_data) != CONTROLS:
+            problems.append(f"{filepath}: has {len(pose_data)} controls instead of {CONTROLS}")
+
+    with library.PoseLibrary(db_path) as lib:
+        for result in results:
+            for pose_id, filepath in result["indexed"]:
+                record = lib.get_pose(pose_id)
+                if record is None or record.filepath != filepath:
+                    problems.append(f"Pose {pose_id} for {filepath} is missing from the library")
+
+            for pose_id, name in result["stored"]:
+                record = lib.get_pose(pose_id)
+                if record is None or record.name != name:
+                    problems.append(f"Stored pose {pose_id} {name} is missing from the library")
+                elif len(lib.load_pose(pose_id)) != CONTROLS:
+                    problems.append(f"Stored pose {pose_id} {name} didn't load all its controls")
+
+        expected = sum(len(result["indexed"]) + len(result["stored"]) for result in results)
+        if lib.count() != expected:
+            problems.append(f"The library has {lib.count()} poses instead of {expected}")
+
+    return problems
+
+
+def run(processes=8, rounds=50, folder=""):
+    """
+    Runs the workers at the same time and checks what they wrote.
+
+    Args:
+        processes: int, Number of worker processes
+        rounds: int, Rounds per worker
+        folder: str, An empty folder to work in. Defaults to a temporary folder.
+
+    Returns: list of str, The problems found
+
+    """
+
+    if not folder:
+        with tempfile.TemporaryDirectory(prefix="posey_stress_") as tmp_folder:
+            return run(processes, rounds, tmp_folder)
+
+    Path(folder).mkdir(parents=True, exist_ok=True)
+    db_path = str(Path(folder, "library.db"))
+
+    # Created up front, so the workers only race on writes
+    library.PoseLibrary(db_path).close()
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(worker, index, folder, db_path, rounds) for index in range(processes)]
+        results = [future.result() for future in futures]
+
+    return check(results, folder, db_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m posey.stress", description="Posey concurrency stress test")
+    parser.add_argument("--processes", type=int, default=8, help="Worker processes")
+    parser.add_argument("--rounds", type=int, default=50, help="Rounds per worker")
+    parser.add_argument("--folder", default="", help="Empty folder to work in, e.g. on a network mount")
+    args = parser.parse_args(argv)
+
+    problems = run(args.processes, args.rounds, args.folder)
+    for problem in problems[:50]:
+        print(problem, file=sys.stderr)
+
+    writes = args.processes * args.rounds
+    print(f"{args.processes} processes wrote {writes * 2} files and {writes * 2} library rows, "
+          f"{len(problems)} problems")
+
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""
+Left/right control pairs for mirrored pastes
+
+Mirroring a pose reflects every matrix across a plane and swaps the poses of paired left and right controls, so
+the left arm takes on the mirrored pose of the right arm and vice versa. Controls without a counterpart, like the
+spine, are mirrored in place.
+
+Pairs are found by swapping side tokens in control names, e.g. L_arm / R_arm, arm_l / arm_r or leftArm /
+rightArm. A MirrorMap is built once per set of pose names and cached, so mirroring the same rig again doesn't
+repeat the name analysis.
+"""
+
+import re
+from collections import OrderedDict
+
+from . import const
+from . import resolve
+
+# (left, right) name tokens, tried in order
+DEFAULT_PAIRS = (("Left", "Right"), ("left", "right"), ("LEFT", "RIGHT"), ("Lf", "Rt"), ("lf", "rt"), ("L", "R"),
+                 ("l", "r"))
+
+# Characters that separate name tokens
+SEPARATORS = r"_:|.\-"
+
+
+def token_pattern(token):
+    """
+    Builds a regex matching a side token on its own, e.g. "L" in "L_arm" but not in "Leg".
+
+    Args:
+        token: str, Side token
+
+    Returns: re.Pattern
+
+    """
+
+    # Capitalized tokens can also end a camelCase word, e.g. armLeft, and any token can start one, e.g. leftArm
+    before = f"(?<![^{SEPARATORS}a-z])" if token[0].isupper() else f"(?<![^{SEPARATORS}])"
+    after = f"(?=$|[{SEPARATORS}0-9]|[A-Z][a-z])"
+
+    return re.compile(before + re.escape(token) + after)
+
+
+class MirrorRules:
+    """
+    How left and right controls are paired, and how mirrored controls keep their handedness.
+
+    Args:
+        pairs: list, (left, right) name tokens, tried in order
+        explicit: dict, Control name to counterpart for names the tokens can't pair. Applied both ways.
+        flip: str, Local axes negated after the reflection so matrices stay right-handed:
+              "world" negates the mirror axis, which suits world aligned controls.
+              "behavior" negates all three axes, which suits joints mirrored with Maya's behavior option.
+              "x", "y" or "z" negates that axis.
+              "" keeps the reflected matrices as they are.
+    """
+
+    def __init__(self, pairs=DEFAULT_PAIRS, explicit=None, flip=const.MIRROR_FLIP):
+        self.pairs = list(pairs)
+        self.explicit = dict(explicit or {})
+        self.explicit.update({value: key for key, value in self.explicit.items()})
+        self.flip = flip
+
+        self.patterns = []
+        for left, right in self.pairs:
+            self.patterns.append((token_pattern(left), right))
+            self.patterns.append((token_pattern(right), left))
+
+    def key(self):
+        """
+        Returns: tuple, Hashable form of the rules used for caching
+
+        """
+
+        return tuple(self.pairs), tuple(sorted(self.explicit.items())), self.flip
+
+    def counterpart(self, name):
+        """
+        Swaps the side of a control name. Only the short name is changed, namespaces are kept.
+
+        Args:
+            name: str, Control name
+
+        Returns: str, or None if the name has no side
+
+        """
+
+        if name in self.explicit:
+            return self.explicit[name]
+
+        namespace, short = resolve.split_name(name)
+        for pattern, replacement in self.patterns:
+            swapped, count = pattern.subn(replacement, short)
+            if count:
+                return f"{namespace}:{swapped}" if namespace else swapped
+
+        return None
+
+
+class MirrorMap:
+    """
+    Which pose entry every pose entry takes its mirrored pose from.
+
+    Args:
+        names: list, The pose's keys
+        rules: MirrorRules, Pairing rules
+    """
+
+    def __init__(self, names, rules=None):
+        self.rules = rules or MirrorRules()
+        self.sources = OrderedDict()
+        self.pairs = 0
+
+        keys = set(names)
+        for name in names:
+            counterpart = self.rules.counterpart(name)
+            if counterpart in keys and counterpart != name:
+                self.sources[name] = counterpart
+                self.pairs += 1
+            else:
+                self.sources[name] = name
+
+    def source(self, name):
+        """
+        Args:
+            name: str, A pose key
+
+        Returns: str, The pose key to take the mirrored pose from
+
+        """
+
+        return self.sources.get(name, name)
+
+
+class MirrorMapCache:
+    """
+    Keeps the most recently used MirrorMaps, one per rig and set of rules.
+
+    Args:
+        limit: int, Number of maps kept
+    """
+
+    def __init__(self, limit=16):
+        self.limit = limit
+        self.maps = OrderedDict()
+
+    def get(self, names, rules=None):
+        """
+        Gets the mirror map for a pose, building it if needed.
+
+        Args:
+            names: list, The pose's keys
+            rules: MirrorRules, Pairing rules
+
+        Returns: MirrorMap
+
+        """
+
+        rules = rules or MirrorRules()
+        key = (tuple(names), rules.key())
+
+        mirror_map = self.maps.get(key)
+        if mirror_map is None:
+            mirror_map = MirrorMap(names, rules)
+            self.maps[key] = mirror_map
+            while len(self.maps) > self.limit:
+                self.maps.popitem(last=False)
+        else:
+            self.maps.move_to_end(key)
+
+        return mirror_map
+
+    def clear(self):
+        """
+        Returns: None
+
+        """
+
+        self.maps.clear()
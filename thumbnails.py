@@ -0,0 +1,186 @@
+"""
+Thumbnail cache for the Library tab
+
+Thumbnails are scaled once to the fixed sizes in const.THUMB_SIZES and saved in const.THUMB_DIR, named after the
+pose's content hash. Loading, scaling and decoding happen on a worker thread into QImages, which unlike QPixmaps
+are safe to create off the main thread. Decoded thumbnails are kept in a bounded in-memory LRU.
+"""
+
+from pathlib import Path
+from collections import OrderedDict
+from PySide2 import QtGui, QtCore
+
+from . import const
+from .pose_io import content_hash
+
+PLACEHOLDER = Path(const.IMG_DIR, "placeholder.jpg")
+IMAGE_EXTS  = (".png", ".jpg", ".jpeg")
+
+
+def source_image(pose_path):
+    """
+    Finds the screenshot saved next to a pose file.
+
+    Args:
+        pose_path: str, The pose file
+
+    Returns: Path, or None if the pose has no screenshot
+
+    """
+
+    for ext in IMAGE_EXTS:
+        image_path = Path(pose_path).with_suffix(ext)
+        if image_path.exists():
+            return image_path
+
+    return None
+
+
+def scale_image(image, size):
+    """
+    Scales an image to fit inside a size x size square.
+
+    Args:
+        image: QtGui.QImage, The image to scale
+        size: int, Edge length in pixels
+
+    Returns: QtGui.QImage
+
+    """
+
+    return image.scaled(size, size, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+
+
+class ThumbnailSignals(QtCore.QObject):
+    """
+    QRunnable can't emit signals itself, so workers report back through this object.
+    """
+
+    # key, image
+    loaded = QtCore.Signal(object, QtGui.QImage)
+
+
+class ThumbnailJob(QtCore.QRunnable):
+    """
+    Loads a single thumbnail from the disk cache, generating and saving it first if needed.
+    """
+
+    def __init__(self, key, pose_path, size, pose_hash, signals):
+        super(ThumbnailJob, self).__init__()
+        self.key = key
+        self.pose_path = pose_path
+        self.size = size
+        self.pose_hash = pose_hash
+        self.signals = signals
+
+    def run(self):
+        image = QtGui.QImage()
+        try:
+            pose_hash = self.pose_hash or content_hash(self.pose_path)
+            thumb_path = Path(const.THUMB_DIR, f"{pose_hash}_{self.size}.png")
+
+            if thumb_path.exists():
+                image.load(str(thumb_path))
+
+            if image.isNull():
+                source = source_image(self.pose_path)
+                if source is None:
+                    # Not saved, so a screenshot added later still gets a thumbnail
+                    image = scale_image(QtGui.QImage(str(PLACEHOLDER)), self.size)
+                else:
+                    image = scale_image(QtGui.QImage(str(source)), self.size)
+                    if not image.isNull():
+                        thumb_path.parent.mkdir(parents=True, exist_ok=True)
+                        image.save(str(thumb_path))
+
+        except OSError:
+            image = QtGui.QImage()
+
+        self.signals.loaded.emit(self.key, image)
+
+
+class ThumbnailCache(QtCore.QObject):
+    """
+    Hands out thumbnails without blocking the main thread. get() returns the cached thumbnail straight away, or the
+    placeholder while the real one is loaded in the background. thumbnail_ready is emitted once it's available.
+    """
+
+    # pose_path, size, pixmap
+    thumbnail_ready = QtCore.Signal(str, int, QtGui.QPixmap)
+
+    def __init__(self, limit=const.THUMB_CACHE_LIMIT, parent=None):
+        super(ThumbnailCache, self).__init__(parent)
+
+        self.limit = limit
+        self.cache = OrderedDict()
+        self.pending = set()
+        self.placeholders = {}
+
+        self.thread_pool = QtCore.QThreadPool()
+        self.thread_pool.setMaxThreadCount(max(1, QtCore.QThread.idealThreadCount() - 1))
+
+        self.signals = ThumbnailSignals()
+        self.signals.loaded.connect(self.on_loaded)
+
+    def placeholder(self, size):
+        """
+        Gets the placeholder thumbnail, scaled once per size.
+
+        Args:
+            size: int, Thumbnail size
+
+        Returns: QtGui.QPixmap
+
+        """
+
+        if size not in self.placeholders:
+            self.placeholders[size] = QtGui.QPixmap.fromImage(scale_image(QtGui.QImage(str(PLACEHOLDER)), size))
+
+        return self.placeholders[size]
+
+    def get(self, pose_path, size=const.THUMB_SIZES[-1], pose_hash=""):
+        """
+        Gets the thumbnail of a pose.
+
+        Args:
+            pose_path: str, The pose file
+            size: int, One of const.THUMB_SIZES
+            pose_hash: str, The pose's content hash if it's already known, e.g. from the pose library
+
+        Returns: QtGui.QPixmap
+
+        """
+
+        key = (str(pose_path), size)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        if key not in self.pending:
+            self.pending.add(key)
+            self.thread_pool.start(ThumbnailJob(key, str(pose_path), size, pose_hash, self.signals))
+
+        return self.placeholder(size)
+
+    def clear(self):
+        """
+        Empties the in-memory cache. Thumbnails on disk are kept.
+
+        Returns: None
+
+        """
+
+        self.cache.clear()
+
+    def on_loaded(self, key, image):
+        self.pending.discard(key)
+        if image.isNull():
+            return
+
+        # QPixmaps can only be created on the main thread, which is where queued signals are delivered
+        pixmap = QtGui.QPixmap.fromImage(image)
+        self.cache[key] = pixmap
+        while len(self.cache) > self.limit:
+            self.cache.popitem(last=False)
+
+        self.thumbnail_ready.emit(key[0], key[1], pixmap)